@@ -0,0 +1,57 @@
+"""Memory used per loaded photo.
+
+Run with:
+$ python benchmarks/bench_catalog.py [nb_photos]
+"""
+import os.path
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ubm.album import Album  # noqa: E402
+from ubm.photo import Photo  # noqa: E402
+
+
+class DictPhoto(object):
+    """Photo as it was before __slots__, for comparison."""
+
+    def __init__(self):
+        self.title = None
+        self.key = None
+        self.filename = None
+        self.album = None
+        self.content_hash = None
+        self.size = None
+        self.mtime = None
+
+
+def measure(photo_class, nb_photos):
+    album = Album()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    photos = []
+    for i in range(nb_photos):
+        photo = photo_class()
+        # strings are shared with the scan, only the objects are measured
+        photo.album = album
+        photo.size = i
+        photo.mtime = 1.0
+        photos.append(photo)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff
+               for stat in after.compare_to(before, 'filename'))
+    return size / nb_photos
+
+
+def main():
+    nb_photos = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for name, photo_class in (('__dict__', DictPhoto), ('__slots__', Photo)):
+        print('%-10s %6.1f bytes per photo' % (name,
+                                               measure(photo_class,
+                                                       nb_photos)))
+
+
+if __name__ == '__main__':
+    main()
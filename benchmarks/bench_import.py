@@ -0,0 +1,80 @@
+"""Import time of the command line entry point.
+
+Runs a fresh interpreter importing the module several times and reports
+the median wall time, the time -X importtime gives the module, and the
+slowest imports under it.
+
+Run with:
+$ python benchmarks/bench_import.py --runs 10 --module ubm.ubm
+"""
+import argparse
+import os.path
+import statistics
+import subprocess
+import sys
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_once(module):
+    """Import module in a new interpreter.
+
+    :returns: tuple -- Wall time in seconds and the -X importtime lines as
+              (self us, cumulative us, module name).
+    """
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        cwd=root,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True)
+    elapsed = time.perf_counter() - started
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(self_us), int(cumulative_us), name.strip()))
+    return elapsed, imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='ubm.ubm')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15,
+                        help='slowest imports listed')
+    args = parser.parse_args()
+
+    # the first run fills the bytecode caches
+    import_once(args.module)
+    walls = []
+    cumulatives = []
+    runs = []
+    for i in range(args.runs):
+        elapsed, imports = import_once(args.module)
+        walls.append(elapsed)
+        cumulatives.append({name: cumulative
+                            for _, cumulative, name in imports}
+                           .get(args.module, 0))
+        runs.append(imports)
+
+    print('%s: interpreter + import %.1f ms, import %.1f ms (median of %s)' %
+          (args.module,
+           statistics.median(walls) * 1000,
+           statistics.median(cumulatives) / 1000,
+           args.runs))
+    # the slowest imports of the median run
+    median_run = sorted(zip(cumulatives, range(len(runs))))[len(runs) // 2]
+    imports = runs[median_run[1]]
+    print('slowest imports (cumulative ms):')
+    for _, cumulative, name in sorted(imports,
+                                      key=lambda imp: imp[1],
+                                      reverse=True)[:args.top]:
+        print('  %-40s %8.1f' % (name, cumulative / 1000))
+
+
+if __name__ == '__main__':
+    main()
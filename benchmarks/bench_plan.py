@@ -0,0 +1,79 @@
+"""Time taken to plan a sync of a large library, with no Flickr call.
+
+Half of the photos are already uploaded and linked, so the plan has
+uploads, album creations and links to find.
+
+Run with:
+$ python benchmarks/bench_plan.py --photos 1000000 --albums 10000
+"""
+import argparse
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ubm.album import Album  # noqa: E402
+from ubm.flickr_uploader import FlickrUploader  # noqa: E402
+from ubm.photo import Photo  # noqa: E402
+from ubm.plan import SyncPlanner  # noqa: E402
+
+
+def make_photos(nb_photos, nb_albums):
+    albums = []
+    for i in range(nb_albums):
+        album = Album()
+        album.key = album.title = 'album_%s' % i
+        albums.append(album)
+    photos = []
+    for i in range(nb_photos):
+        photo = Photo()
+        photo.album = albums[i * nb_albums // nb_photos]
+        photo.title = 'photo_%s' % i
+        photo.key = '%s|%s.jpg' % (photo.album.key, photo.title)
+        photo.filename = photo.key
+        photo.size = 1024
+        photos.append(photo)
+    return photos
+
+
+def load_caches(uploader, photos):
+    """Make the first half of the photos and albums known remotely."""
+    uploader.photo_cache = {}
+    uploader.album_cache = {}
+    uploader.photo_in_album_cache = {}
+    for i, photo in enumerate(photos[:len(photos) // 2]):
+        uploader.photo_cache[photo.key] = {'id': str(i),
+                                           'title': photo.title,
+                                           'hash': None}
+        uploader.album_cache.setdefault(photo.album.key,
+                                        {'id': photo.album.key,
+                                         'title': photo.album.title})
+        uploader.photo_in_album_cache[photo.key] = photo.album.key
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--photos', type=int, default=1000000)
+    parser.add_argument('--albums', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    uploader = FlickrUploader('key', 'secret', 'token', 'token_secret')
+    photos = make_photos(args.photos, args.albums)
+    load_caches(uploader, photos)
+
+    timings = []
+    for i in range(args.runs):
+        started = time.perf_counter()
+        plan = SyncPlanner(uploader).plan(photos)
+        timings.append(time.perf_counter() - started)
+    print('plan           %8.2f s  (best of %d, %d photos)' % (
+          min(timings), args.runs, len(photos)))
+    print('  uploads %d, albums %d, links %d' % (len(plan.uploads),
+                                                 len(plan.albums),
+                                                 len(plan.links)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Sync and upload throughput against the local Flickr mock.
+
+Measures, on a synthetic library:
+ - the time taken by init_cache to list a remote library,
+ - uploads per second, MB/s and API calls per photo of an upload.
+
+Run with:
+$ python benchmarks/bench_sync.py --photos 500 --latency 0.05 --workers 8
+"""
+import argparse
+import logging
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'tests'))
+
+from flickr_mock import FlickrMock  # noqa: E402
+from ubm.flickr_uploader import FlickrUploader  # noqa: E402
+from ubm.local_loader import LocalLoader  # noqa: E402
+
+
+def make_library(path, nb_photos, nb_albums, photo_size):
+    """Write nb_photos random files spread over nb_albums directories."""
+    for i in range(nb_photos):
+        album = os.path.join(path, 'album_%s' % (i % nb_albums))
+        os.makedirs(album, exist_ok=True)
+        with open(os.path.join(album, 'photo_%s.jpg' % i), 'wb') as f:
+            f.write(os.urandom(photo_size))
+
+
+def uploader_class(mode):
+    if mode == 'async':
+        from ubm.async_flickr_uploader import AsyncFlickrUploader
+        return AsyncFlickrUploader
+    return FlickrUploader
+
+
+def new_uploader(args, mock):
+    options = {}
+    if args.mode == 'async':
+        options['concurrency'] = args.workers
+    else:
+        options['workers'] = args.workers
+    return uploader_class(args.mode)('key', 'secret', 'token',
+                                     'token_secret',
+                                     api_options=mock.api_options(),
+                                     **options)
+
+
+def bench_init_cache(args):
+    with FlickrMock(latency=args.latency) as mock:
+        mock.populate(args.remote_albums,
+                      args.remote_photos // args.remote_albums)
+        uploader = new_uploader(args, mock)
+        started = time.perf_counter()
+        uploader.init_cache(full_sync=True)
+        elapsed = time.perf_counter() - started
+        print('init_cache     %8.2f s  %5d calls  (%d photos, %d albums)' % (
+              elapsed,
+              mock.nb_calls,
+              len(uploader.photo_cache),
+              len(uploader.album_cache)))
+
+
+def bench_upload(args, library):
+    photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+        .load(library)
+    size = sum(photo.size for photo in photos)
+    with FlickrMock(latency=args.latency,
+                    upload_latency=args.upload_latency,
+                    upload_bandwidth=args.bandwidth) as mock:
+        uploader = new_uploader(args, mock)
+        started = time.perf_counter()
+        uploader.upload(photos)
+        elapsed = time.perf_counter() - started
+        print('upload         %8.2f s  %5d calls  (%d photos, %d albums)' % (
+              elapsed,
+              mock.nb_calls,
+              mock.calls['upload'],
+              len(mock.photosets)))
+        print('uploads/s      %8.2f' % (len(photos) / elapsed))
+        print('MB/s           %8.2f' % (size / elapsed / 1e6))
+        print('calls/photo    %8.2f' % (mock.nb_calls / len(photos)))
+        for method, count in mock.calls.most_common():
+            print('  %-30s %5d' % (method, count))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--photos', type=int, default=500,
+                        help='photos of the uploaded library')
+    parser.add_argument('--albums', type=int, default=20)
+    parser.add_argument('--size', type=int, default=256 * 1024,
+                        help='bytes per photo')
+    parser.add_argument('--remote-photos', type=int, default=20000,
+                        help='photos already on the mock for init_cache')
+    parser.add_argument('--remote-albums', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds per call')
+    parser.add_argument('--upload-latency', type=float, default=None)
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='upload bytes per second')
+    parser.add_argument('--mode', choices=('threads', 'async'),
+                        default='threads')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    bench_init_cache(args)
+
+    library = tempfile.mkdtemp(prefix='ubm_bench_')
+    try:
+        make_library(library, args.photos, args.albums, args.size)
+        bench_upload(args, library)
+    finally:
+        shutil.rmtree(library)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,10 @@ setup(
         'pyyaml',
         'bitmath'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'transcode': ['Pillow']
+    },
     entry_points = {
         'console_scripts': [
         ]
@@ -0,0 +1,741 @@
+"""
+.. module:: flickr_mock
+   :platform: Unix, Windows
+   :synopsis: In-memory Flickr served on localhost, for offline tests and
+              benchmarks.
+
+FlickrAPI is pointed at it with ``FlickrMock.api_options()``::
+
+    with FlickrMock(latency=0.05) as mock:
+        mock.populate(nb_photosets=10, photos_per_set=100)
+        api = FlickrAPI('key', 'secret', 'token', 'token_secret',
+                        **mock.api_options())
+
+"""
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+
+REST_PATH = '/services/rest'
+UPLOAD_PATH = '/services/upload'
+REQUEST_TOKEN_PATH = '/services/oauth/request_token'
+AUTHORIZATION_PATH = '/services/oauth/authorize'
+ACCESS_TOKEN_PATH = '/services/oauth/access_token'
+
+USER_ID = '12345678@N00'
+
+
+class MockError(Exception):
+    """Flickr error answered with stat 'fail'."""
+
+    def __init__(self, code, message):
+        self.code = code
+        self.message = message
+
+
+# Flickr answer when the service is overloaded
+SERVICE_UNAVAILABLE = MockError(105, 'Service currently unavailable')
+
+
+class FlickrMock(object):
+    """Photos and photosets of one account kept in memory and served with
+    the Flickr REST, upload and OAuth endpoints.
+
+    The signatures are not checked, only the presence of the OAuth
+    parameters.
+    """
+
+    def __init__(self,
+                 latency=0,
+                 upload_latency=None,
+                 upload_bandwidth=None,
+                 processing_time=0,
+                 error_rate=0,
+                 lost_upload_answers=0,
+                 max_per_page=500,
+                 seed=None):
+        """Mock, served once started.
+
+        :param latency: seconds spent on each call.
+        :type latency: float.
+        :param upload_latency: seconds spent on each upload, ``latency`` by
+                               default.
+        :type upload_latency: float.
+        :param upload_bandwidth: bytes per second the uploads are received
+                                 at, unbounded by default.
+        :type upload_bandwidth: int.
+        :param processing_time: seconds Flickr takes to process an upload,
+                                before answering a synchronous upload or
+                                completing the ticket of an asynchronous
+                                one.
+        :type processing_time: float.
+        :param error_rate: part of the REST calls and uploads failing with
+                           a 'Service currently unavailable' error.
+        :type error_rate: float.
+        :param lost_upload_answers: uploads received but never answered,
+                                    the connection being closed instead.
+        :type lost_upload_answers: int.
+        :param max_per_page: largest page of the collection methods.
+        :type max_per_page: int.
+        :param seed: seed of the error draws.
+        :type seed: int.
+
+        """
+        self.latency = latency
+        self.upload_latency = upload_latency
+        if self.upload_latency is None:
+            self.upload_latency = latency
+        self.upload_bandwidth = upload_bandwidth
+        self.processing_time = processing_time
+        self.error_rate = error_rate
+        self.lost_upload_answers = lost_upload_answers
+        self.max_per_page = max_per_page
+        self.random = random.Random(seed)
+
+        self.lock = threading.RLock()
+        self.ids = itertools.count(10000)
+        self.photos = OrderedDict()
+        self.photosets = OrderedDict()
+        self.request_tokens = {}
+        # ticket id to (photo id, time it completes)
+        self.tickets = {}
+
+        # Served calls, by Flickr method, 'upload' or OAuth step
+        self.calls = Counter()
+        self.errors = Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        self.server = None
+        self.thread = None
+
+    ######################
+    # Server
+    ######################
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve on a background thread, on a free port by default."""
+        self.server = ThreadingHTTPServer((host, port), FlickrMockHandler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='flickr-mock',
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def api_options(self):
+        """FlickrAPI options to use the mock, without the hourly quota."""
+        return {
+            'api_url': self.url + REST_PATH,
+            'upload_url': self.url + UPLOAD_PATH,
+            'rate_limit': {
+                'rest_per_hour': None
+            }
+        }
+
+    def oauth_urls(self):
+        """request_user_authorization options to use the mock."""
+        return {
+            'request_token_url': self.url + REQUEST_TOKEN_PATH,
+            'authorization_url': self.url + AUTHORIZATION_PATH,
+            'access_token_url': self.url + ACCESS_TOKEN_PATH
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    @property
+    def nb_calls(self):
+        return sum(self.calls.values())
+
+    ######################
+    # Account
+    ######################
+
+    def _new_id(self):
+        return str(next(self.ids))
+
+    def add_photo(self, title, description='', tags=(), size=0):
+        with self.lock:
+            photo_id = self._new_id()
+            self.photos[photo_id] = {
+                'id': photo_id,
+                'title': title,
+                'description': description,
+                'tags': list(tags),
+                'size': size,
+                'dateupload': int(time.time()),
+                'lastupdate': int(time.time())
+            }
+        return photo_id
+
+    def add_photoset(self, title, photo_ids, description=''):
+        with self.lock:
+            photoset_id = self._new_id()
+            self.photosets[photoset_id] = {
+                'id': photoset_id,
+                'title': title,
+                'description': description,
+                'primary': photo_ids[0],
+                'photos': list(photo_ids),
+                'date_update': int(time.time())
+            }
+        return photoset_id
+
+    def populate(self,
+                 nb_photosets,
+                 photos_per_set,
+                 nb_photos_not_in_set=0,
+                 prefix='remote'):
+        """Fill the account with ubm photos and albums, their keys start
+        with ``prefix``."""
+        for i in range(nb_photosets):
+            album_key = '%s_%s' % (prefix, i)
+            photo_ids = [
+                self.add_photo('%s_%s' % (album_key, j),
+                               '{UBM: "%s|%s_%s.jpg"}' % (album_key,
+                                                          album_key,
+                                                          j))
+                for j in range(photos_per_set)
+            ]
+            if photo_ids:
+                self.add_photoset(album_key,
+                                  photo_ids,
+                                  '{UBM: "%s"}' % album_key)
+        for j in range(nb_photos_not_in_set):
+            self.add_photo('%s_%s' % (prefix, j),
+                           '{UBM: "%s_%s.jpg"}' % (prefix, j))
+
+    ######################
+    # Requests
+    ######################
+
+    def _fail(self):
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def call(self, params):
+        """Run a REST call.
+
+        :returns: dict -- The JSON answer.
+
+        """
+        method = params.get('method', '')
+        with self.lock:
+            self.calls[method] += 1
+        time.sleep(self.latency)
+        try:
+            if self._fail():
+                raise SERVICE_UNAVAILABLE
+            handler = self.METHODS.get(method)
+            if handler is None:
+                raise MockError(112, 'Method "%s" not found' % method)
+            with self.lock:
+                result = handler(self, params)
+            result['stat'] = 'ok'
+        except MockError as e:
+            with self.lock:
+                self.errors[method] += 1
+            result = {'stat': 'fail', 'code': e.code, 'message': e.message}
+        return result
+
+    def upload(self, fields, size):
+        """Receive an upload.
+
+        :returns: str -- The XML answer, None when it is lost.
+
+        """
+        with self.lock:
+            self.calls['upload'] += 1
+        delay = self.upload_latency
+        if self.upload_bandwidth:
+            delay += size / self.upload_bandwidth
+        time.sleep(delay)
+        if self._fail():
+            with self.lock:
+                self.errors['upload'] += 1
+            return ('<?xml version="1.0" encoding="utf-8" ?>\n'
+                    '<rsp stat="fail">\n<err code="%s" msg="%s" />\n'
+                    '</rsp>\n' % (SERVICE_UNAVAILABLE.code,
+                                  SERVICE_UNAVAILABLE.message))
+        tags = fields.get('tags', '').replace(',', ' ').split()
+        photo_id = self.add_photo(fields.get('title', ''),
+                                  fields.get('description', ''),
+                                  tags,
+                                  size)
+        if fields.get('async') == '1':
+            with self.lock:
+                ticket_id = self._new_id()
+                self.tickets[ticket_id] = (
+                    photo_id,
+                    time.monotonic() + self.processing_time)
+            return ('<?xml version="1.0" encoding="utf-8" ?>\n'
+                    '<rsp stat="ok">\n<ticketid>%s</ticketid>\n</rsp>\n' %
+                    ticket_id)
+        time.sleep(self.processing_time)
+        with self.lock:
+            if self.lost_upload_answers > 0:
+                self.lost_upload_answers -= 1
+                return None
+        return ('<?xml version="1.0" encoding="utf-8" ?>\n'
+                '<rsp stat="ok">\n<photoid>%s</photoid>\n</rsp>\n' % photo_id)
+
+    ######################
+    # REST methods
+    ######################
+
+    def _photo(self, photo_id, code=1):
+        """Photo of an id, or the error ``code`` of the method."""
+        photo = self.photos.get(photo_id)
+        if photo is None:
+            raise MockError(code, 'Photo "%s" not found' % photo_id)
+        return photo
+
+    def _photoset(self, photoset_id):
+        photoset = self.photosets.get(photoset_id)
+        if photoset is None:
+            raise MockError(1, 'Photoset "%s" not found' % photoset_id)
+        return photoset
+
+    def _page(self, params, items, render):
+        """Slice a collection as the Flickr collection methods do."""
+        per_page = min(int(params.get('per_page', 100)), self.max_per_page)
+        page = max(1, int(params.get('page', 1)))
+        start = (page - 1) * per_page
+        return {
+            'page': page,
+            'pages': max(1, math.ceil(len(items) / per_page)),
+            'perpage': per_page,
+            'total': len(items),
+            'items': [render(item) for item in items[start:start + per_page]]
+        }
+
+    @staticmethod
+    def _extras(params):
+        return set(filter(None, params.get('extras', '').split(',')))
+
+    def _render_photo(self, params):
+        extras = self._extras(params)
+
+        def render(photo):
+            result = {
+                'id': photo['id'],
+                'owner': USER_ID,
+                'title': photo['title'],
+                'ispublic': 0,
+                'isfriend': 0,
+                'isfamily': 0
+            }
+            if 'description' in extras:
+                result['description'] = {'_content': photo['description']}
+            if 'last_update' in extras:
+                result['lastupdate'] = str(photo['lastupdate'])
+            if 'tags' in extras:
+                result['tags'] = ' '.join(photo['tags'])
+            return result
+        return render
+
+    def _photos(self, params, photos):
+        page = self._page(params, list(photos), self._render_photo(params))
+        page['photo'] = page.pop('items')
+        return {'photos': page}
+
+    def _touch(self, photoset):
+        photoset['date_update'] = int(time.time())
+
+    def test_login(self, params):
+        return {'user': {'id': USER_ID, 'username': {'_content': 'mock'}}}
+
+    def photos_get_info(self, params):
+        photo = self._photo(params.get('photo_id'))
+        return {
+            'photo': {
+                'id': photo['id'],
+                'title': {'_content': photo['title']},
+                'description': {'_content': photo['description']},
+                'dates': {'lastupdate': str(photo['lastupdate'])}
+            }
+        }
+
+    def photos_search(self, params):
+        tags = set(filter(None, params.get('tags', '').split(',')))
+        min_upload_date = int(params.get('min_upload_date', 0))
+        return self._photos(params, (
+            photo for photo in self.photos.values()
+            if (not tags or tags.intersection(photo['tags'])) and
+            photo['dateupload'] >= min_upload_date))
+
+    def photos_delete(self, params):
+        photo = self._photo(params.get('photo_id'))
+        del self.photos[photo['id']]
+        for photoset in list(self.photosets.values()):
+            if photo['id'] in photoset['photos']:
+                photoset['photos'].remove(photo['id'])
+                self._touch(photoset)
+                # as on Flickr, a set without photos is deleted
+                if not photoset['photos']:
+                    del self.photosets[photoset['id']]
+                elif photoset['primary'] == photo['id']:
+                    photoset['primary'] = photoset['photos'][0]
+        return {}
+
+    def photos_set_meta(self, params):
+        photo = self._photo(params.get('photo_id'))
+        photo['title'] = params.get('title', photo['title'])
+        photo['description'] = params.get('description',
+                                          photo['description'])
+        photo['lastupdate'] = int(time.time())
+        return {}
+
+    def photos_get_not_in_set(self, params):
+        in_set = set()
+        for photoset in self.photosets.values():
+            in_set.update(photoset['photos'])
+        return self._photos(params, (photo for photo in self.photos.values()
+                                     if photo['id'] not in in_set))
+
+    def people_get_photos(self, params):
+        return self._photos(params, self.photos.values())
+
+    def photos_recently_updated(self, params):
+        min_date = int(params.get('min_date', 0))
+        return self._photos(params, (
+            photo for photo in self.photos.values()
+            if photo['lastupdate'] >= min_date))
+
+    def photosets_get_list(self, params):
+        def render(photoset):
+            return {
+                'id': photoset['id'],
+                'primary': photoset['primary'],
+                'photos': len(photoset['photos']),
+                'videos': 0,
+                'title': {'_content': photoset['title']},
+                'description': {'_content': photoset['description']},
+                'date_update': str(photoset['date_update'])
+            }
+        page = self._page(params, list(self.photosets.values()), render)
+        page['photoset'] = page.pop('items')
+        return {'photosets': page}
+
+    def photosets_get_photos(self, params):
+        photoset = self._photoset(params.get('photoset_id'))
+        render_photo = self._render_photo(params)
+
+        def render(photo_id):
+            result = render_photo(self.photos[photo_id])
+            result['isprimary'] = \
+                '1' if photo_id == photoset['primary'] else '0'
+            return result
+        page = self._page(params, photoset['photos'], render)
+        page['photo'] = page.pop('items')
+        page.update({
+            'id': photoset['id'],
+            'primary': photoset['primary'],
+            'owner': USER_ID,
+            'title': photoset['title']
+        })
+        return {'photoset': page}
+
+    def photosets_create(self, params):
+        photo = self._photo(params.get('primary_photo_id'))
+        photoset_id = self.add_photoset(params.get('title', ''),
+                                        [photo['id']],
+                                        params.get('description', ''))
+        return {
+            'photoset': {
+                'id': photoset_id,
+                'url': 'https://www.flickr.com/photos/mock/sets/%s/' %
+                       photoset_id
+            }
+        }
+
+    def photosets_delete(self, params):
+        photoset = self._photoset(params.get('photoset_id'))
+        del self.photosets[photoset['id']]
+        return {}
+
+    def photosets_add_photo(self, params):
+        photoset = self._photoset(params.get('photoset_id'))
+        photo = self._photo(params.get('photo_id'), code=2)
+        if photo['id'] in photoset['photos']:
+            raise MockError(3, 'Photo already in set')
+        photoset['photos'].append(photo['id'])
+        self._touch(photoset)
+        return {}
+
+    def photosets_remove_photo(self, params):
+        photoset = self._photoset(params.get('photoset_id'))
+        photo = self._photo(params.get('photo_id'), code=2)
+        if photo['id'] not in photoset['photos']:
+            raise MockError(3, 'Photo not in set')
+        photoset['photos'].remove(photo['id'])
+        self._touch(photoset)
+        # as on Flickr, a set without photos is deleted
+        if not photoset['photos']:
+            del self.photosets[photoset['id']]
+        elif photoset['primary'] == photo['id']:
+            photoset['primary'] = photoset['photos'][0]
+        return {}
+
+    def photosets_edit_photos(self, params):
+        photoset = self._photoset(params.get('photoset_id'))
+        photo_ids = list(OrderedDict.fromkeys(
+            filter(None, params.get('photo_ids', '').split(','))))
+        for photo_id in photo_ids:
+            self._photo(photo_id, code=2)
+        primary_photo_id = params.get('primary_photo_id')
+        if primary_photo_id not in photo_ids:
+            raise MockError(4, 'Primary photo not in the photo list')
+        photoset['photos'] = photo_ids
+        photoset['primary'] = primary_photo_id
+        self._touch(photoset)
+        return {}
+
+    def photos_upload_check_tickets(self, params):
+        now = time.monotonic()
+        tickets = []
+        for ticket_id in filter(None, params.get('tickets', '').split(',')):
+            with self.lock:
+                ticket = self.tickets.get(ticket_id)
+            if ticket is None:
+                tickets.append({'id': ticket_id, 'invalid': 1})
+            elif now < ticket[1]:
+                tickets.append({'id': ticket_id, 'complete': 0})
+            else:
+                tickets.append({'id': ticket_id,
+                                'complete': 1,
+                                'photoid': ticket[0],
+                                'imported': int(time.time())})
+        return {'uploader': {'ticket': tickets}}
+
+    METHODS = {
+        'flickr.test.login': test_login,
+        'flickr.photos.getInfo': photos_get_info,
+        'flickr.photos.search': photos_search,
+        'flickr.photos.delete': photos_delete,
+        'flickr.photos.setMeta': photos_set_meta,
+        'flickr.photos.getNotInSet': photos_get_not_in_set,
+        'flickr.photos.upload.checkTickets': photos_upload_check_tickets,
+        'flickr.photos.recentlyUpdated': photos_recently_updated,
+        'flickr.people.getPhotos': people_get_photos,
+        'flickr.photosets.getList': photosets_get_list,
+        'flickr.photosets.getPhotos': photosets_get_photos,
+        'flickr.photosets.create': photosets_create,
+        'flickr.photosets.delete': photosets_delete,
+        'flickr.photosets.addPhoto': photosets_add_photo,
+        'flickr.photosets.removePhoto': photosets_remove_photo,
+        'flickr.photosets.editPhotos': photosets_edit_photos
+    }
+
+    ######################
+    # OAuth
+    ######################
+
+    def request_token(self, oauth_params):
+        with self.lock:
+            self.calls['oauth.request_token'] += 1
+            token = uuid.uuid4().hex
+            self.request_tokens[token] = oauth_params.get('oauth_callback')
+        return urlencode({
+            'oauth_callback_confirmed': 'true',
+            'oauth_token': token,
+            'oauth_token_secret': uuid.uuid4().hex[:16]
+        })
+
+    def authorize(self, params):
+        """The user accepts at once, the browser is sent to the
+        callback."""
+        with self.lock:
+            self.calls['oauth.authorize'] += 1
+            callback = self.request_tokens.get(params.get('oauth_token'))
+        return '%s%s%s' % (callback,
+                           '&' if '?' in callback else '?',
+                           urlencode({
+                               'oauth_token': params.get('oauth_token'),
+                               'oauth_verifier': uuid.uuid4().hex[:16]
+                           }))
+
+    def access_token(self, oauth_params):
+        with self.lock:
+            self.calls['oauth.access_token'] += 1
+        return urlencode({
+            'fullname': 'Mock User',
+            'oauth_token': '%s-%s' % (USER_ID, uuid.uuid4().hex[:16]),
+            'oauth_token_secret': uuid.uuid4().hex[:16],
+            'user_nsid': USER_ID,
+            'username': 'mock'
+        })
+
+
+def parse_oauth_header(value):
+    """Parameters of an 'Authorization: OAuth ...' header."""
+    if not value or not value.startswith('OAuth '):
+        return {}
+    return {name: unquote(param)
+            for name, param in re.findall(r'(\w+)="([^"]*)"', value)}
+
+
+def parse_multipart(content_type, body):
+    """Fields of a multipart/form-data body, the file field is only
+    measured.
+
+    :returns: tuple -- dict of the text fields and size of the file.
+
+    """
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if match is None:
+        return {}, 0
+    delimiter = b'--' + match.group(1).encode('ascii')
+    fields = {}
+    file_size = 0
+    # each part sits between '\r\n' after its delimiter and '\r\n' before
+    # the next one
+    for part in body.split(delimiter)[1:-1]:
+        headers, _, value = part[2:-2].partition(b'\r\n\r\n')
+        name = re.search(rb'name="([^"]*)"', headers)
+        if name is None:
+            continue
+        if re.search(rb'filename=', headers):
+            file_size = len(value)
+        else:
+            fields[name.group(1).decode('utf-8')] = value.decode('utf-8')
+    return fields, file_size
+
+
+class FlickrMockHandler(BaseHTTPRequestHandler):
+
+    # keep-alive, as the connection pools expect
+    protocol_version = 'HTTP/1.1'
+    # answer in one write, headers and body together, without waiting for
+    # the ack of the headers
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.mock.lock:
+            self.mock.bytes_received += len(body)
+        return body
+
+    def _send(self, status, body, content_type, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.mock.lock:
+            self.mock.bytes_sent += len(data)
+
+    def _send_json(self, result):
+        self._send(200, json.dumps(result), 'application/json')
+
+    def _authorized(self, params):
+        return 'oauth_signature' in params or \
+            'oauth_signature' in parse_oauth_header(
+                self.headers.get('Authorization'))
+
+    def _rest(self, params):
+        if not self._authorized(params):
+            self._send_json({'stat': 'fail',
+                             'code': 98,
+                             'message': 'Invalid auth token'})
+            return
+        self._send_json(self.mock.call(params))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        if url.path == REST_PATH:
+            self._rest(params)
+        elif url.path == AUTHORIZATION_PATH:
+            self._send(302, '', 'text/plain',
+                       {'Location': self.mock.authorize(params)})
+        else:
+            self._send(404, 'Not found', 'text/plain')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self._read_body()
+        content_type = self.headers.get('Content-Type', '')
+        oauth_params = parse_oauth_header(self.headers.get('Authorization'))
+        if url.path == REST_PATH:
+            params = dict(parse_qsl(body.decode('utf-8'),
+                                    keep_blank_values=True))
+            self._rest(params)
+        elif url.path == UPLOAD_PATH:
+            fields, size = parse_multipart(content_type, body)
+            if 'oauth_signature' not in oauth_params:
+                self._send(200,
+                           '<rsp stat="fail"><err code="98" '
+                           'msg="Invalid auth token" /></rsp>',
+                           'text/xml')
+                return
+            answer = self.mock.upload(fields, size)
+            if answer is None:
+                # the file was received, the client gets a reset
+                self.close_connection = True
+                return
+            self._send(200, answer, 'text/xml')
+        elif url.path == REQUEST_TOKEN_PATH:
+            self._send(200,
+                       self.mock.request_token(oauth_params),
+                       'application/x-www-form-urlencoded')
+        elif url.path == ACCESS_TOKEN_PATH:
+            self._send(200,
+                       self.mock.access_token(oauth_params),
+                       'application/x-www-form-urlencoded')
+        else:
+            self._send(404, 'Not found', 'text/plain')
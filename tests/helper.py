@@ -8,7 +8,7 @@ root_path = os.path.join(data_root, 'root_path')
 
 test_conf = None
 with open(os.path.join(data_root, 'testconf.yaml'), 'r') as stream:
-    test_conf = yaml.load(stream)
+    test_conf = yaml.safe_load(stream)
 
 
 def delete_test_data():
@@ -0,0 +1,141 @@
+from unittest import TestCase, skipUnless
+import asyncio
+import importlib.util
+
+from ubm.flickr_api import FlickrAPI, FlickrAPIError
+from ubm.flickr_uploader import FlickrUploader
+from ubm.local_loader import LocalLoader
+from ubm.progress import UploadProgress
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+HAS_AIOHTTP = importlib.util.find_spec('aiohttp') is not None
+
+if HAS_AIOHTTP:
+    from ubm.async_flickr_api import AsyncFlickrAPI
+    from ubm.async_flickr_uploader import AsyncFlickrUploader
+
+
+@skipUnless(HAS_AIOHTTP, 'aiohttp is not installed')
+class TestAsyncFlickrAPI(TestCase):
+
+    def setUp(self):
+        self.mock = FlickrMock(max_per_page=3).start()
+        self.addCleanup(self.mock.stop)
+
+    def run_api(self, coroutine_function):
+        async def run():
+            async with AsyncFlickrAPI('key', 'secret', 'token',
+                                      'token_secret',
+                                      **self.mock.api_options()) as api:
+                return await coroutine_function(api)
+        return asyncio.run(run())
+
+    def test_get(self):
+        async def calls(api):
+            return await api.test_login(), await api.photo_exists('1')
+
+        user, exists = self.run_api(calls)
+
+        self.assertEqual(user['username']['_content'], 'mock')
+        self.assertFalse(exists)
+        self.assertEqual(self.mock.calls['flickr.test.login'], 1)
+
+    def test_not_a_flickr_api(self):
+        # the blocking helpers of FlickrAPI are not inherited
+        self.assertFalse(issubclass(AsyncFlickrAPI, FlickrAPI))
+        self.assertFalse(hasattr(AsyncFlickrAPI, 'session'))
+
+    def test_collection_pages(self):
+        self.mock.populate(nb_photosets=1, photos_per_set=10)
+
+        async def photos(api):
+            return [photo async for photo in api.get_user_photos()]
+
+        self.assertEqual([photo['id'] for photo in self.run_api(photos)],
+                         list(self.mock.photos))
+        self.assertEqual(self.mock.calls['flickr.people.getPhotos'], 4)
+
+    def test_upload(self):
+        photo = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)[0]
+
+        async def upload(api):
+            return await api.upload_photo(photo.filename,
+                                          title=photo.title,
+                                          desc='desc')
+
+        result = self.run_api(upload)
+
+        self.assertEqual(self.mock.calls['upload'], 1)
+        self.assertEqual(self.mock.photos[result['photoid']]['title'],
+                         photo.title)
+        self.assertGreaterEqual(self.mock.bytes_received, photo.size)
+
+
+@skipUnless(HAS_AIOHTTP, 'aiohttp is not installed')
+class TestAsyncFlickrUploader(TestCase):
+
+    def test_upload(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        in_album = [photo for photo in photos if photo.album is not None]
+        albums = {photo.album.key for photo in in_album}
+
+        with FlickrMock() as mock:
+            uploader = AsyncFlickrUploader('key', 'secret', 'token',
+                                           'token_secret',
+                                           concurrency=4,
+                                           api_options=mock.api_options())
+            uploader.upload(photos)
+            uploader.flickrAPI.close()
+
+        self.assertEqual(mock.calls['upload'], len(photos))
+        self.assertEqual(len(mock.photos), len(photos))
+        self.assertEqual(len(mock.photosets), len(albums))
+        self.assertEqual(sum(len(photoset['photos'])
+                             for photoset in mock.photosets.values()),
+                         len(in_album))
+        for photo in in_album:
+            self.assertTrue(uploader.photo_in_album_exists(photo))
+
+    def test_failed_upload(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        progress = UploadProgress()
+        events = []
+        progress.add_hook(events.append)
+
+        with FlickrMock() as mock:
+            uploader = AsyncFlickrUploader('key', 'secret', 'token',
+                                           'token_secret',
+                                           concurrency=4,
+                                           api_options=mock.api_options(),
+                                           progress=progress)
+            plan = uploader.plan_upload(photos)
+            mock.error_rate = 1
+            with self.assertRaises(FlickrAPIError):
+                uploader.execute(plan)
+            uploader.flickrAPI.close()
+
+        self.assertEqual(events[-1]['event'], 'done')
+        self.assertTrue(events[-1]['failed'])
+
+    def test_lost_upload_answer(self):
+        photo = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)[0]
+
+        with FlickrMock(lost_upload_answers=1) as mock:
+            uploader = AsyncFlickrUploader('key', 'secret', 'token',
+                                           'token_secret',
+                                           large_file_size=0,
+                                           large_upload_retries=1,
+                                           api_options=mock.api_options())
+            uploader.RETRY_DELAY = 0
+            uploader.upload([photo])
+            uploader.flickrAPI.close()
+
+        self.assertEqual(mock.calls['upload'], 1)
+        self.assertEqual(mock.calls['flickr.photos.search'], 1)
+        self.assertEqual(uploader.get_photo_id(photo), list(mock.photos)[0])
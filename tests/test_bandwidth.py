@@ -0,0 +1,106 @@
+from unittest import TestCase
+import datetime
+import os.path
+import time
+
+from ubm.bandwidth import BandwidthLimiter, ScheduleWindow
+from ubm.flickr_api import FlickrAPI
+from ubm.ubm import bandwidth_options
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+# a Monday
+MONDAY = datetime.datetime(2024, 1, 1)
+
+
+def at(day, hour, minute=0):
+    return MONDAY + datetime.timedelta(days=day, hours=hour, minutes=minute)
+
+
+class TestScheduleWindow(TestCase):
+
+    def test_contains(self):
+        window = ScheduleWindow('09:00', '18:00', days=['mon', 'Friday'])
+        self.assertTrue(window.contains(at(0, 9)))
+        self.assertTrue(window.contains(at(4, 17, 59)))
+        self.assertFalse(window.contains(at(0, 18)))
+        self.assertFalse(window.contains(at(1, 12)))
+
+    def test_past_midnight(self):
+        # 22:00 to 06:00 read unquoted from YAML, in minutes
+        window = ScheduleWindow(1320, '6:00', days=['sat'])
+        self.assertTrue(window.contains(at(5, 23)))
+        self.assertTrue(window.contains(at(6, 5)))
+        self.assertFalse(window.contains(at(6, 23)))
+        self.assertFalse(window.contains(at(5, 5)))
+
+
+class TestBandwidthLimiter(TestCase):
+
+    def test_schedule(self):
+        limiter = BandwidthLimiter(rate=None, schedule=[
+            ScheduleWindow('09:00', '18:00', rate=2048,
+                           days=['mon', 'tue', 'wed', 'thu', 'fri'])])
+        self.assertEqual(limiter.rate_at(at(2, 10)), 2048)
+        self.assertIsNone(limiter.rate_at(at(2, 20)))
+        self.assertIsNone(limiter.rate_at(at(5, 10)))
+
+    def test_unlimited(self):
+        limiter = BandwidthLimiter()
+        self.assertEqual(limiter.reserve(10 ** 9), 0)
+        self.assertIsNone(limiter.bucket)
+
+    def test_set_rate(self):
+        limiter = BandwidthLimiter(burst=1)
+        limiter.set_rate(1000)
+        self.assertEqual(limiter.reserve(1000), 0)
+        self.assertAlmostEqual(limiter.reserve(500), 0.5, places=1)
+
+        # the change applies at once, without waiting for the next check
+        limiter.clear_rate()
+        self.assertEqual(limiter.reserve(10 ** 9), 0)
+        limiter.configure(rate=100)
+        self.assertGreater(limiter.reserve(1000), 0)
+
+    def test_configure_later(self):
+        limiter = BandwidthLimiter(burst=1)
+        self.assertEqual(limiter.reserve(10 ** 9), 0)
+
+        # a signal handler may run while reserve holds the lock
+        with limiter.lock:
+            limiter.configure_later(rate=1000)
+        self.assertEqual(limiter.reserve(1000), 0)
+        self.assertEqual(limiter.current_rate, 1000)
+        self.assertGreater(limiter.reserve(1000), 0)
+
+    def test_bandwidth_options(self):
+        options = bandwidth_options({'bandwidth': {
+            'rate': '1 MiB',
+            'schedule': [{'start': '09:00', 'end': '18:00', 'rate': None}]
+        }})
+        self.assertEqual(options['rate'], 1024 * 1024)
+        self.assertIsNone(options['schedule'][0].rate)
+
+        for rate in (0, '0 MiB', -1):
+            with self.assertRaises(ValueError):
+                bandwidth_options({'bandwidth': {'rate': rate}})
+        with self.assertRaises(ValueError):
+            bandwidth_options({'bandwidth': {'schedule': [
+                {'start': '09:00', 'end': '18:00', 'rate': 0}]}})
+
+    def test_throttled_upload(self):
+        filename = os.path.join(root_path, 'test_ubm_1',
+                                'frog-photography-11__880.jpg')
+        size = os.path.getsize(filename)
+        # the file takes half a second at this rate, minus the burst
+        limiter = BandwidthLimiter(rate=size * 2, burst=0.1)
+        with FlickrMock() as mock:
+            api = FlickrAPI('key', 'secret', 'token', 'token_secret',
+                            bandwidth=limiter,
+                            **mock.api_options())
+            start = time.monotonic()
+            api.upload_photo(filename, title='frog')
+            elapsed = time.monotonic() - start
+            api.close()
+        self.assertGreaterEqual(elapsed, 0.35)
@@ -70,3 +70,24 @@ class TestFlickrAPI(TestCase):
             self.api.get_photo_info(uploaded_photo['photoid'])
 
         self.assertEqual(flickrAPIError.exception.code, 1)
+
+    def test_get_collection_prefetch_in_order(self):
+        requested = []
+
+        def get(method, key, params=None, extras=None):
+            requested.append(params)
+            page = params['page']
+            return {'pages': 5, 'photo': [page * 10, page * 10 + 1]}
+
+        self.api.get = get
+        self.api.page_workers = 3
+        photos = list(self.api.get_collection('flickr.photos.search',
+                                              'photos',
+                                              'photo'))
+
+        self.assertEqual(photos, [page * 10 + i
+                                  for page in range(1, 6)
+                                  for i in range(2)])
+        self.assertEqual(len(requested), 5)
+        for params in requested:
+            self.assertEqual(params['per_page'], FlickrAPI.MAX_PER_PAGE)
@@ -0,0 +1,163 @@
+from unittest import TestCase
+import socket
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests_oauthlib import OAuth1Session
+
+from ubm.flickr_api import FlickrAPI, FlickrAPIBase, FlickrAPIError
+from ubm.flickr_uploader import FlickrUploader
+from ubm.local_loader import LocalLoader
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+
+class TestFlickrMock(TestCase):
+
+    def setUp(self):
+        self.mock = FlickrMock(max_per_page=3).start()
+        self.addCleanup(self.mock.stop)
+
+    def api(self):
+        api = FlickrAPI('key', 'secret', 'token', 'token_secret',
+                        **self.mock.api_options())
+        self.addCleanup(api.close)
+        return api
+
+    def test_collection_pages(self):
+        self.mock.populate(nb_photosets=1, photos_per_set=10)
+
+        photos = list(self.api().get_user_photos(extras={'description'}))
+
+        self.assertEqual([photo['id'] for photo in photos],
+                         list(self.mock.photos))
+        self.assertEqual(photos[0]['description']['_content'],
+                         '{UBM: "remote_0|remote_0_0.jpg"}')
+        self.assertEqual(self.mock.calls['flickr.people.getPhotos'], 4)
+
+    def test_collection_prefetch(self):
+        self.mock.populate(nb_photosets=1, photos_per_set=10)
+        photos = self.api().get_user_photos()
+
+        # the next pages are requested while the first one is consumed
+        next(photos)
+        deadline = time.monotonic() + 5
+        while self.mock.calls['flickr.people.getPhotos'] < 4 and \
+                time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.mock.calls['flickr.people.getPhotos'], 4)
+        self.assertEqual(len(list(photos)), 9)
+
+    def test_errors(self):
+        self.mock.error_rate = 1
+
+        with self.assertRaises(FlickrAPIError) as context:
+            self.api().test_login()
+        self.assertEqual(context.exception.code, 105)
+        self.assertEqual(self.mock.errors['flickr.test.login'], 1)
+
+    def test_upload(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        albums = {photo.album.key for photo in photos
+                  if photo.album is not None}
+
+        def run():
+            uploader = FlickrUploader('key', 'secret', 'token',
+                                      'token_secret',
+                                      workers=4,
+                                      api_options=self.mock.api_options())
+            uploader.upload(photos)
+            uploader.flickrAPI.close()
+
+        run()
+        self.assertEqual(self.mock.calls['upload'], len(photos))
+        self.assertEqual(len(self.mock.photos), len(photos))
+        self.assertEqual(len(self.mock.photosets), len(albums))
+        self.assertEqual(sum(len(photoset['photos'])
+                             for photoset in self.mock.photosets.values()),
+                         len([photo for photo in photos
+                              if photo.album is not None]))
+
+        # the second run finds everything on the mock
+        self.mock.reset_stats()
+        run()
+        self.assertEqual(self.mock.calls['upload'], 0)
+        self.assertEqual(self.mock.calls['flickr.photosets.create'], 0)
+
+    def test_lost_upload_answer(self):
+        photo = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)[0]
+        self.mock.lost_upload_answers = 1
+        uploader = FlickrUploader('key', 'secret', 'token', 'token_secret',
+                                  large_file_size=0,
+                                  large_upload_retries=1,
+                                  api_options=self.mock.api_options())
+        self.addCleanup(uploader.flickrAPI.close)
+        uploader.RETRY_DELAY = 0
+        uploader.init_cache()
+
+        uploader.upload_photo(photo)
+
+        # found on Flickr instead of being uploaded again
+        self.assertEqual(self.mock.calls['upload'], 1)
+        self.assertEqual(self.mock.calls['flickr.photos.search'], 1)
+        self.assertEqual(uploader.get_photo_id(photo),
+                         list(self.mock.photos)[0])
+
+    def test_request_not_sent(self):
+        # nothing listens on a port just released
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        api = FlickrAPI('key', 'secret', 'token', 'token_secret',
+                        api_url='http://127.0.0.1:%s/' % port,
+                        rate_limit={'rest_per_hour': None})
+        self.addCleanup(api.close)
+        with self.assertRaises(FlickrAPI.TRANSIENT_ERRORS) as context:
+            api.test_login()
+        self.assertTrue(FlickrAPI.request_not_sent(context.exception))
+
+        # the answer of a received upload is lost
+        self.mock.lost_upload_answers = 1
+        photo = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)[0]
+        with self.assertRaises(FlickrAPI.TRANSIENT_ERRORS) as context:
+            self.api().upload_photo(photo.filename)
+        self.assertFalse(FlickrAPI.request_not_sent(context.exception))
+
+    def test_transport_required(self):
+        class GetOnlyAPI(FlickrAPIBase):
+            def get(self, method, key, params=None, extras=None):
+                return {}
+
+        # a missing transport method fails when the API is made
+        with self.assertRaises(TypeError):
+            GetOnlyAPI('key', 'secret', 'token', 'token_secret')
+
+    def test_oauth(self):
+        urls = self.mock.oauth_urls()
+        callback = 'http://localhost:7777/callback'
+        oauth = OAuth1Session('key',
+                              client_secret='secret',
+                              callback_uri=callback)
+        request_token = oauth.fetch_request_token(urls['request_token_url'])
+
+        response = requests.get(
+            oauth.authorization_url(urls['authorization_url']),
+            allow_redirects=False)
+        location = response.headers['Location']
+        self.assertTrue(location.startswith(callback))
+        verifier = parse_qs(urlsplit(location).query)['oauth_verifier'][0]
+
+        oauth = OAuth1Session(
+            'key',
+            client_secret='secret',
+            resource_owner_key=request_token['oauth_token'],
+            resource_owner_secret=request_token['oauth_token_secret'],
+            verifier=verifier)
+        tokens = oauth.fetch_access_token(urls['access_token_url'])
+        self.assertIn('oauth_token', tokens)
+        self.assertIn('oauth_token_secret', tokens)
@@ -1,7 +1,16 @@
 from unittest import TestCase
 import configparser
+import os.path
+import tempfile
+import threading
 
+from ubm.flickr_api import FlickrAPIError
 from ubm.flickr_uploader import FlickrUploader
+from ubm.local_loader import LocalLoader
+from ubm.content_hash import hash_file
+from ubm.journal import UploadJournal
+
+from helper import root_path
 
 
 class TestFlickrUploader(TestCase):
@@ -38,3 +47,375 @@ class TestFlickrUploader(TestCase):
 
     def test_init_cache(self):
         self.uploader.init_cache()
+
+    def test_upload_concurrently(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        self.uploader.workers = 4
+        self.uploader.max_inflight_bytes = 1024
+        self.uploader.photo_cache = {}
+        self.uploader.album_cache = {}
+        self.uploader.photo_in_album_cache = {}
+
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        self.uploader.upload_concurrently(photos)
+        self.uploader.flush_links()
+
+        self.assertEqual(len(api.uploaded), len(photos))
+        for call in api.calls:
+            if call[0] == 'add':
+                self.assertIn(call[1], api.created)
+        self.assertEqual(len(api.created), 3)
+        self.assertEqual(len(self.uploader.photo_in_album_cache),
+                         len([p for p in photos if p.album is not None]))
+
+    def test_large_file_lane(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        large = max(photos, key=lambda photo: photo.size)
+        api = LargeFileFlickrAPI(large.filename, len(photos) - 1)
+        self.uploader.flickrAPI = api
+        self.uploader.RETRY_DELAY = 0
+        self.uploader.large_file_size = large.size
+        self.uploader.photo_cache = {}
+        self.uploader.album_cache = {}
+        self.uploader.photo_in_album_cache = {}
+
+        # one worker: the large file waits for all the others, which only
+        # get uploaded in their own lane
+        self.uploader.upload_concurrently(photos)
+
+        self.assertEqual(len(api.uploaded), len(photos))
+        self.assertEqual(api.uploaded[-1], large.filename)
+        self.assertEqual(api.timeouts[large.filename],
+                         [self.uploader.large_upload_timeout] * 2)
+
+    def test_relink_known_content(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        moved, copied = photos[0], photos[1]
+        self.uploader.inventory.save_photo('old|moved.jpg', '1', 'moved',
+                                           hash_file(moved.filename))
+        self.uploader.inventory.save_photo(copied.key, '2', 'copied',
+                                           hash_file(copied.filename))
+        self.uploader.inventory.save_photoset('10', 'old', 'old', None, 1)
+        self.uploader.inventory.add_photoset_member('10', 'old|moved.jpg')
+        self.uploader.inventory.set_last_sync(0)
+        self.uploader.init_cache(refresh=False)
+
+        copy = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)[1]
+        copy.key = 'copy|' + copy.key
+        self.uploader.relink_known_content(photos + [copy])
+
+        self.assertEqual(api.meta, [('1', moved.title)])
+        self.assertEqual(api.removed, [('10', '1')])
+        self.assertNotIn('old|moved.jpg', self.uploader.photo_cache)
+        self.assertEqual(self.uploader.get_photo_id(moved), '1')
+        self.assertEqual(self.uploader.get_photo_id(copy), '2')
+        self.assertEqual(self.uploader.get_photo_id(copied), '2')
+        self.assertFalse(self.uploader.photo_exists(photos[2]))
+
+        # the shared copy is not hashed and matched again on the next run
+        photo_cache = self.uploader.inventory.load()[0]
+        self.assertEqual(photo_cache[copy.key]['id'], '2')
+        self.assertEqual(photo_cache[moved.key]['id'], '1')
+
+    def test_hash_photos_uploaded_without_hash(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        photo = photos[0]
+        self.uploader.inventory.save_photo(photo.key, '1', photo.title)
+        self.uploader.inventory.set_last_sync(0)
+        self.uploader.init_cache()
+
+        self.assertEqual(self.uploader.match_known_content([photo]), [])
+        content_hash = hash_file(photo.filename)
+        self.assertEqual(self.uploader.inventory.load()[0][photo.key]['hash'],
+                         content_hash)
+
+        # moved after the hash was recorded, it is found by content
+        moved = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)[0]
+        moved.key = 'moved|' + moved.key
+        self.uploader.init_cache()
+        self.assertEqual(self.uploader.match_known_content([moved]),
+                         [(moved, photo.key, True)])
+
+    def test_resume_from_journal(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        in_album = [photo for photo in photos if photo.album is not None]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            journal = UploadJournal(os.path.join(tmp_dir, 'journal.jsonl'))
+            # an interrupted run uploaded every photo but linked none
+            for photo in photos:
+                journal.uploaded(photo.key, photo.key, photo.title)
+            journal.close()
+            self.uploader.inventory.set_last_sync(0)
+            self.uploader.journal = journal
+
+            self.uploader.upload(photos)
+
+            self.assertEqual(api.uploaded, [])
+            self.assertFalse(os.path.exists(journal.path))
+            self.assertEqual(len(self.uploader.photo_in_album_cache),
+                             len(in_album))
+
+    def test_stop_before_scheduling(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        self.uploader.request_stop()
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        self.uploader.upload(photos)
+        self.assertEqual(api.uploaded, [])
+
+    def test_bulk_link(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        self.uploader.bulk_link_threshold = 2
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        album = photos[-1].album
+        in_album = [photo for photo in photos if photo.album is album]
+        self.uploader.inventory.save_photoset('10', album.key, album.title,
+                                              None, 1)
+        for i, photo in enumerate(in_album):
+            self.uploader.inventory.save_photo(photo.key, str(i), photo.title)
+        self.uploader.inventory.set_last_sync(0)
+        self.uploader.init_cache(refresh=False)
+        api.photoset_photos['10'] = [{'id': '100', 'isprimary': '1'}]
+
+        for photo in in_album:
+            self.uploader.process_photo(photo)
+        self.uploader.flush_links()
+
+        self.assertEqual(api.edited,
+                         [('10', '100', ['100'] + [str(i) for i in
+                                                   range(len(in_album))])])
+        self.assertEqual(self.uploader.nb_links, len(in_album))
+        self.assertEqual(self.uploader.nb_link_calls, 2)
+        for photo in in_album:
+            self.assertTrue(self.uploader.photo_in_album_exists(photo))
+
+    def test_link_right_away(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        self.uploader.bulk_link_threshold = None
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        album = photos[-1].album
+        in_album = [photo for photo in photos if photo.album is album]
+        self.uploader.inventory.save_photoset('10', album.key, album.title,
+                                              None, 1)
+        for i, photo in enumerate(in_album):
+            self.uploader.inventory.save_photo(photo.key, str(i), photo.title)
+        self.uploader.inventory.set_last_sync(0)
+        self.uploader.init_cache(refresh=False)
+
+        # nothing linked yet, nothing logged
+        with self.assertNoLogs('ubm.flickr_uploader'):
+            self.uploader.flush_links()
+
+        for photo in in_album:
+            self.uploader.process_photo(photo)
+            self.assertTrue(self.uploader.photo_in_album_exists(photo))
+        self.assertEqual(self.uploader.pending_links, {})
+        self.assertEqual(self.uploader.nb_link_calls, len(in_album))
+
+    def test_link_deleted_photo(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        album = photos[-1].album
+        in_album = [photo for photo in photos if photo.album is album]
+        self.uploader.inventory.save_photoset('10', album.key, album.title,
+                                              None, 1)
+        for i, photo in enumerate(in_album):
+            self.uploader.inventory.save_photo(photo.key, 'old%s' % i,
+                                               photo.title)
+        self.uploader.inventory.set_last_sync(0)
+        self.uploader.init_cache(refresh=False)
+        api.photoset_photos['10'] = [{'id': '100', 'isprimary': '1'}]
+        # deleted on Flickr, the inventory does not know it
+        api.deleted = {'old0', 'old1'}
+
+        # one by one, then in one edit
+        self.uploader.link_photos(album, in_album[:1])
+        self.uploader.bulk_link_threshold = 1
+        self.uploader.link_photos(album, in_album[1:])
+
+        self.assertEqual(api.uploaded, [in_album[0].filename,
+                                        in_album[1].filename])
+        self.assertIn(('add', '10', '1'), api.calls)
+        self.assertEqual(api.edited[-1][2][:2], ['100', '2'])
+        photo_cache = self.uploader.inventory.load()[0]
+        self.assertEqual(photo_cache[in_album[0].key]['id'], '1')
+        self.assertEqual(photo_cache[in_album[1].key]['id'], '2')
+        for photo in in_album:
+            self.assertTrue(self.uploader.photo_in_album_exists(photo))
+
+    def test_create_album_with_planned_primary(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        self.uploader.bulk_link_threshold = None
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        album = photos[-1].album
+        in_album = [photo for photo in photos if photo.album is album]
+        for i, photo in enumerate(in_album):
+            self.uploader.inventory.save_photo(photo.key, str(i), photo.title)
+        self.uploader.inventory.set_last_sync(0)
+        self.uploader.init_cache(refresh=False)
+        # the last photo is the primary, the first one is uploaded first
+        self.uploader.album_primaries = {album.key: in_album[-1].key}
+
+        for photo in in_album:
+            self.uploader.process_album(photo)
+
+        last_id = str(len(in_album) - 1)
+        self.assertEqual(api.calls[0], ('create', 'set0', last_id))
+        self.assertEqual(api.calls[1:],
+                         [('add', 'set0', str(i))
+                          for i in range(len(in_album) - 1)])
+        self.assertEqual(self.uploader.waiting_for_album, {})
+        for photo in in_album:
+            self.assertTrue(self.uploader.photo_in_album_exists(photo))
+
+    def test_create_album_without_planned_primary(self):
+        api = FakeFlickrAPI()
+        self.uploader.flickrAPI = api
+        self.uploader.bulk_link_threshold = None
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        album = photos[-1].album
+        in_album = [photo for photo in photos if photo.album is album]
+        for i, photo in enumerate(in_album):
+            self.uploader.inventory.save_photo(photo.key, str(i), photo.title)
+        self.uploader.inventory.set_last_sync(0)
+        self.uploader.init_cache(refresh=False)
+        self.uploader.album_primaries = {album.key: in_album[-1].key}
+
+        # the primary failed, the first waiting photo creates the album
+        for photo in in_album[:-1]:
+            self.uploader.process_album(photo)
+        self.assertEqual(api.calls, [])
+        self.uploader.create_waiting_albums()
+
+        self.assertEqual(api.calls[0], ('create', 'set0', '0'))
+        self.assertEqual(self.uploader.album_primaries, {})
+        for photo in in_album[:-1]:
+            self.assertTrue(self.uploader.photo_in_album_exists(photo))
+
+
+class FakeFlickrAPI(object):
+    """Record the calls made by the uploader instead of reaching Flickr."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.uploaded = []
+        self.created = set()
+        self.meta = []
+        self.photoset_photos = {}
+        self.edited = []
+        # ids of the photos deleted on Flickr
+        self.deleted = set()
+        self.removed = []
+
+    def _check_photos(self, photo_ids):
+        if self.deleted.intersection(photo_ids):
+            raise FlickrAPIError('fail', code=2, message='Photo not found')
+
+    def photo_exists(self, photo_id):
+        return photo_id not in self.deleted
+
+    def get_photoset_photos(self, photoset_id, extras=None):
+        return iter(self.photoset_photos[photoset_id])
+
+    def edit_photoset_photos(self, photoset_id, primary_photo_id, photo_ids):
+        self._check_photos(photo_ids)
+        self.edited.append((photoset_id, primary_photo_id, photo_ids))
+
+    def get_photosets(self):
+        return iter([])
+
+    def get_user_photos(self, extras=None):
+        return iter([])
+
+    def get_recently_updated_photos(self, min_date, extras=None):
+        return iter([])
+
+    def set_photo_meta(self, photo_id, title, desc):
+        self.meta.append((photo_id, title))
+
+    def remove_photo_from_photoset(self, photoset_id, photo_id):
+        self.removed.append((photoset_id, photo_id))
+
+    def upload_photo(self,
+                     filename,
+                     title=None,
+                     desc=None,
+                     tags=None,
+                     progress=None,
+                     timeout=None,
+                     ticket=False):
+        with self.lock:
+            self.uploaded.append(filename)
+            return {'photoid': str(len(self.uploaded))}
+
+    def create_photoset(self, title, primary_photo_id, desc=None):
+        with self.lock:
+            photoset_id = 'set%s' % len(self.created)
+            self.created.add(photoset_id)
+            self.calls.append(('create', photoset_id, primary_photo_id))
+            return {'id': photoset_id}
+
+    def add_photo_to_photoset(self, photoset_id, photo_id):
+        self._check_photos([photo_id])
+        with self.lock:
+            self.calls.append(('add', photoset_id, photo_id))
+
+
+class LargeFileFlickrAPI(FakeFlickrAPI):
+    """Fail the first upload of a large file, then block it until the
+    other files are uploaded."""
+
+    TRANSIENT_ERRORS = (ConnectionError,)
+
+    @staticmethod
+    def request_not_sent(error):
+        # refused, the file was not sent
+        return True
+
+    def __init__(self, large_filename, nb_others):
+        super().__init__()
+        self.large_filename = large_filename
+        self.nb_others = nb_others
+        self.others_done = threading.Event()
+        self.timeouts = {}
+
+    def upload_photo(self, filename, timeout=None, **kwargs):
+        with self.lock:
+            self.timeouts.setdefault(filename, []).append(timeout)
+        if filename != self.large_filename:
+            result = super().upload_photo(filename, **kwargs)
+            with self.lock:
+                if len(self.uploaded) == self.nb_others:
+                    self.others_done.set()
+            return result
+        if len(self.timeouts[filename]) == 1:
+            raise ConnectionError('reset')
+        if not self.others_done.wait(10):
+            raise AssertionError('the large file held back the others')
+        return super().upload_photo(filename, **kwargs)
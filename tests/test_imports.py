@@ -0,0 +1,42 @@
+from unittest import TestCase
+import json
+import os.path
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only needed by request_user_authorization or optional features
+LAZY_MODULES = [
+    'webbrowser',
+    'requests_oauthlib',
+    'ubm.oauth1_callback_server',
+    'http.server',
+    'aiohttp',
+    'PIL',
+    'multiprocessing',
+    'logging.config'
+]
+
+
+def import_in_subprocess(module):
+    """Modules loaded and root log handlers after importing module in a new
+    interpreter."""
+    code = ('import json, logging, sys\n'
+            'import %s\n'
+            'print(json.dumps({"modules": sorted(sys.modules), '
+            '"handlers": len(logging.getLogger().handlers)}))' % module)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    return json.loads(output.decode('utf-8'))
+
+
+class TestImports(TestCase):
+
+    def test_cli_imports(self):
+        result = import_in_subprocess('ubm.ubm')
+
+        loaded = [module for module in LAZY_MODULES
+                  if module in result['modules']]
+        self.assertEqual(loaded, [])
+        # logging is set up by main, not on import
+        self.assertEqual(result['handlers'], 0)
@@ -0,0 +1,129 @@
+from unittest import TestCase
+
+from ubm.inventory import RemoteInventory
+from ubm.flickr_uploader import FlickrUploader
+
+
+def photoset(photoset_id, key, date_update, nb_photos):
+    return {
+        'id': photoset_id,
+        'title': {'_content': 'title %s' % photoset_id},
+        'description': {'_content': '{UBM: "%s"}' % key},
+        'date_update': date_update,
+        'photos': nb_photos,
+        'videos': 0
+    }
+
+
+def photo(photo_id, key):
+    return {
+        'id': photo_id,
+        'title': 'photo %s' % photo_id,
+        'description': {'_content': '{UBM: "%s"}' % key}
+    }
+
+
+class FakeFlickrAPI(object):
+
+    def __init__(self):
+        self.photosets = []
+        self.photoset_photos = {}
+        self.photos = []
+        self.recently_updated = []
+        self.listed = []
+        self.deleted = set()
+        self.checked = []
+
+    def get_photosets(self):
+        return iter(self.photosets)
+
+    def get_photoset_photos(self, photoset_id, extras=None):
+        self.listed.append(photoset_id)
+        return iter(self.photoset_photos[photoset_id])
+
+    def get_user_photos(self, extras=None):
+        return iter(self.photos)
+
+    def get_recently_updated_photos(self, min_date, extras=None):
+        return iter(self.recently_updated)
+
+    def photo_exists(self, photo_id):
+        self.checked.append(photo_id)
+        return photo_id not in self.deleted
+
+
+class TestRemoteInventory(TestCase):
+
+    def setUp(self):
+        self.inventory = RemoteInventory()
+
+    def test_load(self):
+        self.inventory.save_photos([('a|1.jpg', '1', '1', None),
+                                    ('2.jpg', '2', '2', 'sha256:2')])
+        self.inventory.save_photoset('10', 'a', 'a', '100', 1)
+        self.inventory.set_photoset_members('10', ['a|1.jpg'])
+
+        photo_cache, album_cache, photo_in_album_cache = self.inventory.load()
+
+        self.assertEqual(photo_cache['2.jpg']['id'], '2')
+        self.assertEqual(photo_cache['2.jpg']['hash'], 'sha256:2')
+        self.assertEqual(album_cache['a']['id'], '10')
+        self.assertEqual(photo_in_album_cache, {'a|1.jpg': 'a'})
+
+    def test_refresh_only_lists_changed_photosets(self):
+        api = FakeFlickrAPI()
+        api.photosets = [photoset('10', 'a', '100', 1),
+                         photoset('20', 'b', '100', 1)]
+        api.photoset_photos = {'10': [{'id': '1'}],
+                               '20': [{'id': '2'}]}
+        api.photos = [photo('1', 'a|1.jpg'),
+                      photo('2', 'b|2.jpg'),
+                      photo('3', '3.jpg')]
+
+        uploader = FlickrUploader('key', 'secret', inventory=self.inventory)
+        uploader.flickrAPI = api
+        uploader.init_cache()
+        self.assertEqual(api.listed, ['10', '20'])
+        self.assertEqual(len(uploader.photo_cache), 3)
+
+        api.listed = []
+        api.photosets = [photoset('10', 'a', '200', 2)]
+        api.photoset_photos['10'].append({'id': '4'})
+        api.recently_updated = [photo('4', 'a|4.jpg'), photo('5', '5.jpg')]
+        uploader.init_cache()
+
+        self.assertEqual(api.listed, ['10'])
+        self.assertNotIn('b', uploader.album_cache)
+        self.assertEqual(uploader.photo_in_album_cache['a|4.jpg'], 'a')
+        self.assertIn('5.jpg', uploader.photo_cache)
+
+        api.listed = []
+        api.photos = [photo('1', 'a|1.jpg')]
+        uploader.init_cache(full_sync=True)
+        self.assertEqual(api.listed, ['10'])
+        self.assertNotIn('5.jpg', uploader.photo_cache)
+
+    def test_refresh_removes_deleted_photos(self):
+        api = FakeFlickrAPI()
+        api.photosets = [photoset('10', 'a', '100', 2),
+                         photoset('20', 'b', '100', 1)]
+        api.photoset_photos = {'10': [{'id': '1'}, {'id': '2'}],
+                               '20': [{'id': '3'}]}
+        api.photos = [photo('1', 'a|1.jpg'),
+                      photo('2', 'a|2.jpg'),
+                      photo('3', 'b|3.jpg')]
+
+        uploader = FlickrUploader('key', 'secret', inventory=self.inventory)
+        uploader.flickrAPI = api
+        uploader.init_cache()
+
+        # 1 is deleted, 2 only removed from its set, the set of 3 is gone
+        # with it
+        api.deleted = {'1', '3'}
+        api.photosets = [photoset('10', 'a', '200', 0)]
+        api.photoset_photos['10'] = []
+        uploader.init_cache()
+
+        self.assertEqual(sorted(api.checked), ['1', '2', '3'])
+        self.assertEqual(sorted(uploader.photo_cache), ['a|2.jpg'])
+        self.assertEqual(uploader.photo_in_album_cache, {})
@@ -0,0 +1,41 @@
+from unittest import TestCase
+import os.path
+import tempfile
+
+from ubm.journal import UploadJournal
+
+
+class TestUploadJournal(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'journal.jsonl')
+        self.journal = UploadJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmp_dir.cleanup()
+
+    def test_read_recorded_steps(self):
+        self.assertEqual(self.journal.read(), [])
+        self.journal.uploaded('a|1.jpg', '1', '1')
+        self.journal.album_created('a', '10', 'a', 'a|1.jpg')
+        self.journal.linked('a|2.jpg', 'a')
+
+        steps = [entry['step'] for entry in self.journal.read()]
+        self.assertEqual(steps, [UploadJournal.UPLOADED,
+                                 UploadJournal.ALBUM_CREATED,
+                                 UploadJournal.LINKED])
+
+    def test_skip_truncated_entry(self):
+        self.journal.uploaded('a|1.jpg', '1', '1')
+        self.journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"step": "upl')
+
+        self.assertEqual(len(self.journal.read()), 1)
+
+    def test_clear(self):
+        self.journal.linked('a|2.jpg', 'a')
+        self.journal.clear()
+        self.assertFalse(os.path.exists(self.path))
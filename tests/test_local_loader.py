@@ -2,10 +2,15 @@ from unittest import TestCase
 import os
 import os.path
 import configparser
+import shutil
+import tempfile
+import time
 
 from ubm.local_loader import LocalLoader
 from ubm.flickr_uploader import FlickrUploader
 
+from helper import root_path
+
 
 class TestLocalLoader(TestCase):
 
@@ -51,4 +56,137 @@ class TestLocalLoader(TestCase):
         self.assertEqual(self.loader._album_key('hello/coucou/test.png'),
                          'hello|coucou')
 
+    def test_load_with_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tree = os.path.join(tmp_dir, 'root')
+            shutil.copytree(root_path, tree)
+            past = time.time() - 3600
+            for root, dirs, files in os.walk(tree):
+                os.utime(root, (past, past))
+            manifest_path = os.path.join(tmp_dir, 'manifest.json')
+
+            loader = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES,
+                                 manifest_path=manifest_path)
+            photos = loader.load(tree)
+            self.assertEqual(loader.nb_dirs_skipped, 0)
+            self.assertEqual(loader.nb_dirs_scanned, 4)
+
+            loader = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES,
+                                 manifest_path=manifest_path)
+            reloaded = loader.load(tree)
+            self.assertEqual(loader.nb_dirs_skipped, 4)
+            self.assertEqual(loader.nb_dirs_scanned, 0)
+            self.assertEqual([(p.key, p.title, p.filename) for p in photos],
+                             [(p.key, p.title, p.filename) for p in reloaded])
+
+            open(os.path.join(tree, 'test_ubm_1', 'new.jpg'), 'w').close()
+            reloaded = loader.load(tree)
+            self.assertEqual(loader.nb_dirs_scanned, 1)
+            self.assertEqual(len(reloaded), len(photos) + 1)
+
+            loader.invalidate_manifest()
+            self.assertFalse(os.path.exists(manifest_path))
+            loader.load(tree)
+            self.assertEqual(loader.nb_dirs_scanned, 4)
+
+    def test_rewritten_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tree = os.path.join(tmp_dir, 'root')
+            shutil.copytree(root_path, tree)
+            album = os.path.join(tree, 'test_ubm_1')
+            past = time.time() - 3600
+            os.utime(album, (past, past))
+            loader = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES,
+                                 manifest_path=os.path.join(tmp_dir,
+                                                            'manifest.json'))
+            loader.load(tree)
+
+            # rewritten in place, the directory mtime does not change
+            photo = [photo for photo in loader.load(tree)
+                     if os.path.dirname(photo.filename) == album][0]
+            with open(photo.filename, 'ab') as f:
+                f.write(b'\0' * 1000)
+            os.utime(album, (past, past))
+
+            reloaded = {photo.key: photo for photo in loader.load(tree)}
+            self.assertGreater(loader.nb_dirs_skipped, 0)
+            self.assertEqual(reloaded[photo.key].size, photo.size + 1000)
+
+    def test_broken_link(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tree = os.path.join(tmp_dir, 'root')
+            shutil.copytree(root_path, tree)
+            photos = self.loader.load(tree)
+            os.symlink(os.path.join(tmp_dir, 'missing.jpg'),
+                       os.path.join(tree, 'test_ubm_1', 'broken.jpg'))
+
+            # only the link is skipped, not its directory
+            with self.assertLogs('ubm.local_loader', 'WARNING'):
+                reloaded = self.loader.load(tree)
+            self.assertEqual(sorted(photo.key for photo in reloaded),
+                             sorted(photo.key for photo in photos))
+
+    def test_load_in_parallel(self):
+        loader = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES,
+                             scan_workers=4)
+        photos = loader.load(root_path)
+
+        self.assertEqual(len(photos), len(list(
+            self.loader._image_files(root_path))))
+        for photo in photos:
+            filename = os.path.relpath(photo.filename, root_path)
+            self.assertEqual(photo.key, self.loader._photo_key(filename))
+            self.assertEqual(photo.title, self.loader._photo_name(filename))
+            self.assertEqual(photo.size, os.path.getsize(photo.filename))
+            if photo.album is None:
+                self.assertIsNone(self.loader._album_key(filename))
+            else:
+                self.assertEqual(photo.album.key,
+                                 self.loader._album_key(filename))
+                self.assertEqual(photo.album.title,
+                                 self.loader._album_name(filename))
+
+    def test_load_roots(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_path = os.path.join(tmp_dir, 'manifest.json')
+            loader = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES,
+                                 manifest_path=manifest_path)
+            other = os.path.join(tmp_dir, 'other')
+            shutil.copytree(root_path, other)
+            photos = loader.load([root_path, {'path': other,
+                                              'name': 'disk2'}])
+            single = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+                .load(root_path)
+
+            self.assertEqual(len(photos), 2 * len(single))
+            keys = {photo.key for photo in photos}
+            self.assertEqual(len(keys), len(photos))
+            for photo in single:
+                self.assertIn('root_path|' + photo.key, keys)
+                self.assertIn('disk2|' + photo.key, keys)
+            album_keys = {photo.album.key for photo in photos
+                          if photo.album is not None}
+            self.assertIn('disk2|test_ubm_1', album_keys)
+            self.assertTrue(os.path.exists(manifest_path + '.disk2'))
+
+            # an empty name keeps the keys of a single root
+            photos = loader.load([{'path': root_path, 'name': ''}])
+            self.assertEqual([photo.key for photo in photos],
+                             [photo.key for photo in single])
+
+            with self.assertRaises(ValueError):
+                loader.load([root_path, {'path': other,
+                                         'name': 'root_path'}])
+            # 'disk2|...' keys of the unnamed root would be the other's
+            with self.assertRaises(ValueError):
+                loader.load([{'path': root_path, 'name': ''},
+                             {'path': other, 'name': 'disk2'}])
 
+            # only the manifests of the roots are removed
+            unrelated = manifest_path + '.bak'
+            open(unrelated, 'w').close()
+            loader.invalidate_manifest([root_path, {'path': other,
+                                                    'name': 'disk2'}])
+            self.assertFalse(os.path.exists(manifest_path + '.disk2'))
+            self.assertFalse(os.path.exists(manifest_path + '.root_path'))
+            self.assertTrue(os.path.exists(unrelated))
@@ -0,0 +1,91 @@
+from unittest import TestCase
+import json
+import os.path
+import tempfile
+
+from ubm.flickr_api import FlickrAPI, FlickrAPIError
+from ubm.metrics import LatencyHistogram, Metrics
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+PHOTO = os.path.join(root_path, 'test_ubm_1', 'frog-photography-11__880.jpg')
+
+
+class TestMetrics(TestCase):
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+
+        for i in range(1, 101):
+            histogram.add(i / 100)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.mean, 0.505)
+        self.assertEqual(histogram.max, 1)
+        for percent in (50, 95, 99):
+            value = histogram.percentile(percent)
+            self.assertGreaterEqual(value, percent / 100)
+            self.assertLessEqual(value,
+                                 percent / 100 * LatencyHistogram.GROWTH)
+        self.assertEqual(histogram.percentile(100), 1)
+
+    def test_record(self):
+        metrics = Metrics()
+        events = []
+        metrics.add_hook(events.append)
+
+        metrics.record('flickr.test.login', 0.1, bytes_sent=10,
+                       bytes_received=20)
+        metrics.record('flickr.test.login', 0.2, error=True)
+        metrics.record(Metrics.UPLOAD, 1, bytes_sent=1000)
+
+        self.assertEqual(len(events), 3)
+        self.assertEqual(events[1]['endpoint'], 'flickr.test.login')
+        self.assertTrue(events[1]['error'])
+
+        report = metrics.report()
+        self.assertEqual(report['flickr.test.login']['count'], 2)
+        self.assertEqual(report['flickr.test.login']['errors'], 1)
+        self.assertEqual(report['flickr.test.login']['bytes_received'], 20)
+        self.assertEqual(report['total'], {'count': 3,
+                                           'errors': 1,
+                                           'bytes_sent': 1010,
+                                           'bytes_received': 20})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.json')
+            metrics.write_report(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f)['total']['count'], 3)
+
+    def test_broken_hook(self):
+        metrics = Metrics()
+
+        def hook(event):
+            raise ValueError()
+        metrics.add_hook(hook)
+
+        metrics.record('flickr.test.login', 0.1)
+        self.assertEqual(metrics.report()['total']['count'], 1)
+
+    def test_flickr_calls(self):
+        with FlickrMock() as mock:
+            api = FlickrAPI('key', 'secret', 'token', 'token_secret',
+                            **mock.api_options())
+            api.test_login()
+            api.upload_photo(PHOTO, title='frog')
+            mock.error_rate = 1
+            with self.assertRaises(FlickrAPIError):
+                api.test_login()
+            api.close()
+
+        report = api.metrics.report()
+        self.assertEqual(report['flickr.test.login']['count'], 2)
+        self.assertEqual(report['flickr.test.login']['errors'], 1)
+        self.assertEqual(report[Metrics.UPLOAD]['count'], 1)
+        self.assertEqual(report[Metrics.UPLOAD]['errors'], 0)
+        self.assertGreater(report[Metrics.UPLOAD]['bytes_sent'],
+                           os.path.getsize(PHOTO))
+        self.assertEqual(report['total']['bytes_received'], mock.bytes_sent)
@@ -0,0 +1,61 @@
+from unittest import TestCase
+import email.parser
+import os.path
+
+from ubm.multipart import MultipartFileBody
+
+from helper import root_path
+
+
+class TestMultipartFileBody(TestCase):
+
+    def setUp(self):
+        self.filename = os.path.join(root_path,
+                                     'test_ubm_1',
+                                     'petite-grenouille-venimeuse.jpg')
+
+    def test_body(self):
+        body = MultipartFileBody({'title': 'grenouille ÛÜ', 'tags': 'a,b'},
+                                 'photo',
+                                 self.filename,
+                                 chunk_size=1024)
+        chunks = list(body)
+        content = b''.join(chunks)
+
+        self.assertEqual(len(body), len(content))
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks[1:-1]))
+        self.assertIsNone(body.file)
+
+        message = email.parser.BytesParser().parsebytes(
+            ('Content-Type: %s\r\n\r\n' % body.content_type).encode('ascii') +
+            content)
+        parts = message.get_payload()
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(parts[0].get_payload(decode=True).decode('utf-8'),
+                         'grenouille ÛÜ')
+        self.assertEqual(parts[2].get_param('name',
+                                            header='content-disposition'),
+                         'photo')
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(parts[2].get_payload(decode=True), f.read())
+
+    def test_close_before_end(self):
+        body = MultipartFileBody({}, 'photo', self.filename, chunk_size=16)
+        chunks = iter(body)
+        next(chunks)
+        next(chunks)
+        self.assertFalse(body.file.closed)
+        body.close()
+        self.assertIsNone(body.file)
+
+    def test_progress(self):
+        sizes = []
+        body = MultipartFileBody({'title': 'grenouille'},
+                                 'photo',
+                                 self.filename,
+                                 chunk_size=1024,
+                                 progress=sizes.append)
+        list(body)
+
+        self.assertEqual(sum(sizes), os.path.getsize(self.filename))
+        self.assertTrue(all(size <= 1024 for size in sizes))
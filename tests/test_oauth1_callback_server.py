@@ -19,3 +19,27 @@ class TestOAuthCallbackServer(TestCase):
         self.assertEqual(server.wait_for_callback_url(), callback_url)
 
         server.stop()
+
+    def test_wait_timeout(self):
+        server = OAuthCallbackServer('localhost', 0)
+        server.start()
+        try:
+            response = requests.get('http://localhost:%s/other?coucou=hello'
+                                    % server.port)
+            self.assertEqual(response.status_code, 404)
+
+            with self.assertRaises(TimeoutError):
+                server.wait_for_callback_url(timeout=0.1)
+        finally:
+            server.stop()
+
+    def test_restart(self):
+        server = OAuthCallbackServer('localhost', 0)
+        for i in range(2):
+            server.start()
+            callback_url = 'http://localhost:%s/callback?i=%s' % (
+                server.port, i)
+            requests.get(callback_url)
+            self.assertEqual(server.wait_for_callback_url(timeout=5),
+                             callback_url)
+            server.stop()
@@ -0,0 +1,115 @@
+from unittest import TestCase
+import os.path
+import tempfile
+
+from ubm.content_hash import hash_file
+from ubm.flickr_uploader import FlickrUploader
+from ubm.local_loader import LocalLoader
+from ubm.plan import SyncPlan, SyncPlanner
+from ubm.ubm import main
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+
+class TestSyncPlan(TestCase):
+
+    def setUp(self):
+        self.mock = FlickrMock().start()
+        self.addCleanup(self.mock.stop)
+        self.photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+
+    def uploader(self, **kwargs):
+        uploader = FlickrUploader('key', 'secret', 'token', 'token_secret',
+                                  api_options=self.mock.api_options(),
+                                  **kwargs)
+        self.addCleanup(uploader.flickrAPI.close)
+        return uploader
+
+    def test_plan(self):
+        uploader = self.uploader()
+        uploader.init_cache()
+        # the first photo of the first album is already uploaded
+        first = [photo for photo in self.photos if photo.album is not None][0]
+        uploader.photo_uploaded(first, '1')
+
+        plan = SyncPlanner(uploader).plan(self.photos)
+
+        albums = {photo.album.key for photo in self.photos
+                  if photo.album is not None}
+        self.assertEqual(len(plan.uploads), len(self.photos) - 1)
+        self.assertNotIn(first.key, plan.uploads)
+        self.assertEqual(len(plan.albums), len(albums))
+        self.assertIn((first.album.key, first.key), plan.albums)
+        self.assertEqual(len(plan.links),
+                         len([photo for photo in self.photos
+                              if photo.album is not None]) - len(albums))
+        self.assertEqual(plan.totals['nb_photos'], len(self.photos))
+        self.assertEqual(plan.totals['size_photos'],
+                         sum(photo.size for photo in self.photos))
+        self.assertEqual(plan.totals['size_photos_to_upload'],
+                         plan.totals['size_photos'] - first.size)
+        self.assertEqual(len(plan.steps), len(self.photos))
+        self.assertEqual(self.mock.calls['upload'], 0)
+
+    def test_save_and_load(self):
+        uploader = self.uploader()
+        plan = uploader.plan_upload(self.photos)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'plan.json')
+            plan.save(path)
+            loaded = SyncPlan.load(path)
+
+        self.assertEqual(loaded.to_dict(), plan.to_dict())
+        self.assertEqual(loaded.describe(), plan.describe())
+        photo = loaded.photos[plan.steps[0]]
+        self.assertEqual(photo.filename, plan.photos[plan.steps[0]].filename)
+
+    def test_execute_saved_plan(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'plan.json')
+            self.uploader().plan_upload(self.photos).save(path)
+            self.assertEqual(self.mock.calls['upload'], 0)
+
+            uploader = self.uploader()
+            uploader.load_remote_state()
+            uploader.execute(SyncPlan.load(path))
+            self.assertEqual(self.mock.calls['upload'], len(self.photos))
+
+            # the steps already done are skipped
+            uploader = self.uploader()
+            uploader.load_remote_state()
+            uploader.execute(SyncPlan.load(path))
+            self.assertEqual(self.mock.calls['upload'], len(self.photos))
+
+        self.assertTrue(self.uploader().plan_upload(self.photos).is_empty())
+
+    def test_plan_without_hashing(self):
+        uploader = self.uploader(content_hash=True)
+        moved = self.photos[0]
+        moved.content_hash = hash_file(moved.filename)
+        uploader.init_cache()
+        uploader.photo_uploaded(moved, '1')
+
+        renamed = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        renamed[0].key = 'moved|' + renamed[0].key
+        renamed = renamed[:1]
+
+        plan = SyncPlanner(uploader, match_content=False).plan(renamed)
+        self.assertEqual(plan.uploads, [renamed[0].key])
+        self.assertEqual(plan.known_content, [])
+        self.assertIsNone(renamed[0].content_hash)
+
+        # hashed, the moved photo is found
+        plan = SyncPlanner(uploader).plan(renamed)
+        self.assertEqual(plan.uploads, [])
+        self.assertEqual(plan.known_content,
+                         [(renamed[0].key, moved.key, True)])
+
+    def test_plan_requires_dry_run(self):
+        for option in (['--plan', 'plan.json'], ['--no-hash']):
+            with self.assertRaises(SystemExit):
+                main(['-c', 'ubm.yaml'] + option)
@@ -0,0 +1,134 @@
+from unittest import TestCase
+import io
+import json
+import os.path
+import tempfile
+
+from ubm.flickr_api import FlickrAPIError
+from ubm.flickr_uploader import FlickrUploader
+from ubm.local_loader import LocalLoader
+from ubm.photo import Photo
+from ubm.progress import UploadProgress, TerminalProgress, \
+    JsonLinesProgress
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+
+class TestUploadProgress(TestCase):
+
+    def setUp(self):
+        self.progress = UploadProgress(interval=0)
+        self.events = []
+        self.progress.add_hook(self.events.append)
+
+    def test_events(self):
+        photo = Photo()
+        photo.title = 'frog'
+
+        self.progress.start({'nb_photos_to_upload': 2,
+                             'size_photos_to_upload': 300})
+        file_progress = self.progress.file()
+        file_progress(100)
+        file_progress(50)
+        self.progress.photo_done(photo)
+
+        self.assertEqual([event['event'] for event in self.events],
+                         ['start', 'progress', 'progress', 'photo'])
+        last = self.events[-1]
+        self.assertEqual(last['title'], 'frog')
+        self.assertEqual(last['photos_done'], 1)
+        self.assertEqual(last['photos_remaining'], 1)
+        self.assertEqual(last['bytes_done'], 150)
+        self.assertEqual(last['bytes_remaining'], 150)
+        self.assertGreater(last['rate'], 0)
+        self.assertAlmostEqual(last['eta'], 150 / last['rate'])
+
+        # a failed upload takes back its bytes
+        file_progress = self.progress.file()
+        file_progress(80)
+        file_progress.cancel()
+        self.progress.finish()
+
+        self.assertEqual(self.events[-1]['event'], 'done')
+        self.assertFalse(self.events[-1]['interrupted'])
+        self.assertEqual(self.events[-1]['bytes_done'], 150)
+
+    def test_interval(self):
+        self.progress.interval = 3600
+        self.progress.start({'nb_photos_to_upload': 1,
+                             'size_photos_to_upload': 100})
+        for i in range(10):
+            self.progress.add_bytes(10)
+
+        self.assertEqual([event['event'] for event in self.events],
+                         ['start', 'progress'])
+
+    def test_sinks(self):
+        stream = io.StringIO()
+        self.progress.add_hook(TerminalProgress(stream))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'progress.jsonl')
+            self.progress.add_hook(JsonLinesProgress(path))
+
+            self.progress.start({'nb_photos_to_upload': 1,
+                                 'size_photos_to_upload': 2048})
+            self.progress.add_bytes(1024)
+            self.progress.finish(interrupted=True)
+
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+        self.assertEqual([event['event'] for event in events],
+                         ['start', 'progress', 'done'])
+        self.assertTrue(events[-1]['interrupted'])
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('0/1 photos', lines[0])
+        self.assertIn('1.0 KiB/2.0 KiB', lines[1])
+
+    def test_upload(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+
+        with FlickrMock() as mock:
+            uploader = FlickrUploader('key', 'secret', 'token',
+                                      'token_secret',
+                                      workers=4,
+                                      api_options=mock.api_options(),
+                                      progress=self.progress)
+            uploader.upload(photos)
+            uploader.flickrAPI.close()
+
+        start = self.events[0]
+        done = self.events[-1]
+        self.assertEqual(start['photos_total'], len(photos))
+        self.assertEqual(start['bytes_total'],
+                         sum(photo.size for photo in photos))
+        self.assertEqual(done['event'], 'done')
+        self.assertEqual(done['photos_done'], len(photos))
+        self.assertEqual(done['bytes_done'], done['bytes_total'])
+        self.assertEqual(len([event for event in self.events
+                              if event['event'] == 'photo']), len(photos))
+        self.assertFalse(done['failed'])
+
+    def test_failed_upload(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+
+        with FlickrMock() as mock:
+            uploader = FlickrUploader('key', 'secret', 'token',
+                                      'token_secret',
+                                      api_options=mock.api_options(),
+                                      progress=self.progress)
+            plan = uploader.plan_upload(photos)
+            mock.error_rate = 1
+            with self.assertRaises(FlickrAPIError):
+                uploader.execute(plan)
+            uploader.flickrAPI.close()
+
+        # the hooks still get the end of the run
+        done = self.events[-1]
+        self.assertEqual(done['event'], 'done')
+        self.assertTrue(done['failed'])
+        self.assertFalse(done['interrupted'])
@@ -0,0 +1,30 @@
+from unittest import TestCase
+import time
+
+from ubm.rate_limiter import TokenBucket
+
+
+class TestTokenBucket(TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=100, capacity=5)
+        start = time.monotonic()
+        for i in range(5):
+            self.assertEqual(bucket.acquire(), 0)
+        for i in range(10):
+            bucket.acquire()
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 0.5)
+
+    def test_shared(self):
+        bucket = TokenBucket.per_hour(('test', 'key'), 3600)
+        self.assertIs(TokenBucket.per_hour(('test', 'key'), 3600), bucket)
+        self.assertAlmostEqual(bucket.rate, 0.95)
+
+        # one quota per name, the last settings apply to every user
+        with self.assertLogs('ubm.rate_limiter', 'WARNING'):
+            self.assertIs(TokenBucket.per_hour(('test', 'key'), 7200,
+                                               burst=5), bucket)
+        self.assertAlmostEqual(bucket.rate, 7200 * 0.95 / 3600)
+        self.assertEqual(bucket.capacity, 5)
@@ -0,0 +1,121 @@
+from unittest import TestCase
+import time
+
+from ubm.flickr_api import FlickrAPI
+from ubm.flickr_uploader import FlickrUploader
+from ubm.local_loader import LocalLoader
+from ubm.photo import Photo
+from ubm.tickets import TicketPoller
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+
+class FakeTicketAPI(object):
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.checks = []
+
+    def check_tickets(self, ticket_ids):
+        self.checks.append(list(ticket_ids))
+        return {'ticket': [dict(self.statuses[ticket_id], id=ticket_id)
+                           for ticket_id in ticket_ids]}
+
+
+class TestTicketPoller(TestCase):
+
+    def photo(self, title):
+        photo = Photo()
+        photo.title = title
+        return photo
+
+    def test_batches(self):
+        api = FakeTicketAPI({
+            str(i): {'complete': 1, 'photoid': 'p%s' % i}
+            for i in range(5)})
+        done = []
+        poller = TicketPoller(api,
+                              lambda photo, photo_id: done.append(photo_id),
+                              interval=0,
+                              batch_size=2)
+        for i in range(5):
+            poller.add(str(i), self.photo(str(i)))
+        poller.close()
+
+        self.assertEqual(sorted(done), ['p%s' % i for i in range(5)])
+        self.assertTrue(all(len(batch) <= 2 for batch in api.checks))
+        self.assertEqual(poller.nb_pending(), 0)
+
+    def test_failed(self):
+        api = FakeTicketAPI({
+            'failed': {'complete': 2},
+            'invalid': {'invalid': 1}})
+        done = []
+        poller = TicketPoller(api,
+                              lambda photo, photo_id: done.append(photo_id),
+                              interval=0)
+        poller.add('failed', self.photo('failed'))
+        poller.add('invalid', self.photo('invalid'))
+        poller.close()
+
+        self.assertEqual(done, [])
+        self.assertEqual(sorted(photo.title for photo in poller.failed),
+                         ['failed', 'invalid'])
+
+    def test_error_raised_on_close(self):
+        api = FakeTicketAPI({'1': {'complete': 1, 'photoid': 'p1'}})
+
+        def fail(photo, photo_id):
+            raise ValueError(photo_id)
+
+        poller = TicketPoller(api, fail, interval=0)
+        poller.add('1', self.photo('1'))
+        with self.assertRaises(ValueError):
+            poller.close()
+
+
+class TestUploadTickets(TestCase):
+
+    def test_check_tickets(self):
+        with FlickrMock(processing_time=60) as mock:
+            api = FlickrAPI('key', 'secret', 'token', 'token_secret',
+                            **mock.api_options())
+            result = api.upload_photo(
+                root_path + '/test_ubm_1/frog-photography-11__880.jpg',
+                title='frog',
+                ticket=True)
+            tickets = api.check_tickets([result['ticketid'], 'unknown'])
+            api.close()
+
+        self.assertEqual(tickets['ticket'][0]['complete'], 0)
+        self.assertEqual(tickets['ticket'][1]['invalid'], 1)
+
+    def test_upload(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        albums = {photo.album.key for photo in photos
+                  if photo.album is not None}
+
+        with FlickrMock(processing_time=0.2) as mock:
+            uploader = FlickrUploader('key', 'secret', 'token',
+                                      'token_secret',
+                                      api_options=mock.api_options(),
+                                      upload_tickets=True,
+                                      ticket_options={'interval': 0.25})
+            start = time.monotonic()
+            uploader.upload(photos)
+            elapsed = time.monotonic() - start
+            uploader.flickrAPI.close()
+
+        # one worker, the processing of the uploads overlaps
+        self.assertLess(elapsed, 0.2 * len(photos))
+        self.assertEqual(mock.calls['upload'], len(photos))
+        self.assertLess(mock.calls['flickr.photos.upload.checkTickets'],
+                        len(photos))
+        self.assertEqual(len(mock.photosets), len(albums))
+        self.assertEqual(sum(len(photoset['photos'])
+                             for photoset in mock.photosets.values()),
+                         len([photo for photo in photos
+                              if photo.album is not None]))
+        self.assertEqual(len(uploader.photo_cache), len(photos))
@@ -0,0 +1,119 @@
+from unittest import TestCase, skipUnless
+import importlib.util
+import os
+import os.path
+import tempfile
+
+from ubm.flickr_uploader import FlickrUploader
+from ubm.local_loader import LocalLoader
+from ubm.photo import Photo
+from ubm.progress import UploadProgress
+from ubm.transcode import TranscodeRule, Transcoder
+
+from flickr_mock import FlickrMock
+from helper import root_path
+
+HAS_PILLOW = importlib.util.find_spec('PIL') is not None
+SCREENSHOT = os.path.join(root_path, 'Screenshot from 2016-07-22 06:58:54.png')
+
+
+def photo_of(filename, key='key'):
+    photo = Photo()
+    photo.key = key
+    photo.title = key
+    photo.filename = filename
+    photo.size = os.path.getsize(filename)
+    return photo
+
+
+class TestTranscodeRule(TestCase):
+
+    def test_matches(self):
+        rule = TranscodeRule(['PNG'], min_size=1000, format='jpeg')
+        self.assertTrue(rule.matches('a/b.png', 1000))
+        self.assertFalse(rule.matches('a/b.png', 999))
+        self.assertFalse(rule.matches('a/b.jpg', 2000))
+        self.assertEqual(rule.output_extension('b.png'), 'jpg')
+        self.assertEqual(TranscodeRule(['jpg']).output_extension('b.JPG'),
+                         'jpg')
+        with self.assertRaises(ValueError):
+            TranscodeRule(['png'], format='webp')
+
+
+@skipUnless(HAS_PILLOW, 'Pillow is not installed')
+class TestTranscoder(TestCase):
+
+    def test_transcode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            transcoder = Transcoder([TranscodeRule(['png'], format='jpeg',
+                                                   max_dimension=200)],
+                                    workers=2,
+                                    cache_dir=tmp)
+            self.addCleanup(transcoder.close)
+            photo = photo_of(SCREENSHOT)
+            other = photo_of(os.path.join(root_path, 'test_ubm_1',
+                                          'frog-photography-11__880.jpg'),
+                             key='frog')
+
+            self.assertTrue(transcoder.start(photo, photo.size, ahead=True))
+            self.assertFalse(transcoder.start(other, other.size))
+            filename = transcoder.upload_file(photo, photo.size)
+            self.assertTrue(filename.endswith('.jpg'))
+            self.assertLess(os.path.getsize(filename), photo.size)
+            self.assertEqual(transcoder.upload_file(other, other.size),
+                             other.filename)
+
+            transcoder.done(photo)
+            self.assertEqual(os.listdir(tmp), [])
+            self.assertEqual(transcoder.budget.in_flight, 0)
+
+    def test_cache_bound(self):
+        transcoder = Transcoder([TranscodeRule(['png'], format='jpeg',
+                                               max_dimension=200)],
+                                workers=1,
+                                max_cache_bytes=1000)
+        self.addCleanup(transcoder.close)
+        photo = photo_of(SCREENSHOT)
+        self.assertTrue(transcoder.start(photo, photo.size, ahead=True))
+        # the cache is full, the next one waits for its upload
+        second = photo_of(SCREENSHOT, key='second')
+        self.assertFalse(transcoder.start(second, second.size, ahead=True))
+        self.assertNotEqual(transcoder.upload_file(second, second.size),
+                            second.filename)
+
+    def test_not_smaller(self):
+        # a screenshot is smaller as PNG than as JPEG
+        transcoder = Transcoder([TranscodeRule(['png'], format='jpeg')],
+                                workers=1)
+        self.addCleanup(transcoder.close)
+        photo = photo_of(SCREENSHOT)
+        self.assertEqual(transcoder.upload_file(photo, photo.size),
+                         photo.filename)
+        self.assertEqual(transcoder.nb_transcoded, 0)
+
+    def test_upload(self):
+        photos = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES) \
+            .load(root_path)
+        progress = UploadProgress(interval=0)
+        events = []
+        progress.add_hook(events.append)
+        transcoder = Transcoder([TranscodeRule(['png'], format='jpeg',
+                                               max_dimension=800)],
+                                workers=2)
+
+        with FlickrMock() as mock:
+            uploader = FlickrUploader('key', 'secret', 'token',
+                                      'token_secret',
+                                      workers=2,
+                                      api_options=mock.api_options(),
+                                      progress=progress,
+                                      transcoder=transcoder)
+            uploader.upload(photos)
+            uploader.flickrAPI.close()
+
+        self.assertEqual(mock.calls['upload'], len(photos))
+        self.assertEqual(transcoder.nb_transcoded, 3)
+        self.assertLess(mock.bytes_received,
+                        sum(photo.size for photo in photos))
+        self.assertEqual(events[-1]['bytes_done'], events[-1]['bytes_total'])
+        self.assertIsNone(transcoder.cache_dir)
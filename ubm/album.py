@@ -1,5 +1,7 @@
 
 class Album(object):
+    __slots__ = ('title', 'key')
+
     def __init__(self):
         self.title = None
         self.key = None
@@ -0,0 +1,272 @@
+import asyncio
+from collections import deque
+import json
+import time
+from urllib.parse import urlencode
+
+import aiohttp
+import oauthlib.oauth1
+import yarl
+
+from ubm.flickr_api import FlickrAPIBase, FlickrAPIError
+from ubm.metrics import Metrics
+from ubm.multipart import MultipartFileBody
+
+
+class AsyncFlickrAPI(FlickrAPIBase):
+    """asyncio version of FlickrAPI, on aiohttp.
+
+    Like FlickrAPI it derives from FlickrAPIBase, for the settings and the
+    API accessors. Here ``get``, ``post``, ``upload_photo`` and the API
+    accessors are awaitable and ``get_collection`` based accessors are
+    async generators. Use it as an
+    async context manager, or call ``close``, to release the connections.
+    """
+
+    TRANSIENT_ERRORS = (aiohttp.ClientConnectionError,
+                        asyncio.TimeoutError)
+
+    def __init__(self,
+                 client_key,
+                 client_secret,
+                 resource_owner_key,
+                 resource_owner_secret,
+                 max_connections=100,
+                 **kwargs):
+        super().__init__(client_key,
+                         client_secret,
+                         resource_owner_key,
+                         resource_owner_secret,
+                         **kwargs)
+        self.max_connections = max_connections
+        self.client = oauthlib.oauth1.Client(
+                        client_key,
+                        client_secret=client_secret,
+                        resource_owner_key=resource_owner_key,
+                        resource_owner_secret=resource_owner_secret)
+        self._async_session = None
+
+    @staticmethod
+    def request_not_sent(error):
+        """Whether a transient error happened before the request reached
+        Flickr, see FlickrAPI.request_not_sent."""
+        return isinstance(error, (aiohttp.ClientConnectorError,
+                                  aiohttp.ConnectionTimeoutError))
+
+    @staticmethod
+    def _client_timeout(timeout):
+        if isinstance(timeout, (tuple, list)):
+            return aiohttp.ClientTimeout(sock_connect=timeout[0],
+                                         sock_read=timeout[1])
+        return aiohttp.ClientTimeout(total=timeout)
+
+    def async_session(self):
+        """Get the aiohttp session, created on first use in the running
+        loop."""
+        if self._async_session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._async_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._client_timeout(self.timeout))
+        return self._async_session
+
+    async def close(self):
+        if self._async_session is not None:
+            await self._async_session.close()
+            self._async_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @staticmethod
+    async def _wait(limiter):
+        if limiter is not None:
+            waited = limiter.reserve()
+            if waited > 0:
+                await asyncio.sleep(waited)
+
+    def _sign_form(self, url, params):
+        """Sign a form encoded POST, the params are part of the
+        signature."""
+        body = urlencode(params)
+        url, headers, body = self.client.sign(
+            url,
+            http_method='POST',
+            body=body,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        return headers, body
+
+    async def _call_api(self, http_method, api_method, key, params=None):
+        _params = self._api_params(api_method, params)
+
+        await self._wait(self.rest_limiter)
+
+        session = self.async_session()
+        started = time.perf_counter()
+        error = True
+        bytes_sent = 0
+        data = b''
+        try:
+            if http_method == 'GET':
+                url, headers, body = self.client.sign(
+                                '%s?%s' % (self.api_url, urlencode(_params)))
+                bytes_sent = len(url)
+                # the url is signed, it must be sent as is
+                async with session.get(yarl.URL(url, encoded=True),
+                                       headers=headers) as response:
+                    data = await response.read()
+            elif http_method == 'POST':
+                headers, body = self._sign_form(self.api_url, _params)
+                bytes_sent = len(body)
+                async with session.post(self.api_url,
+                                        data=body,
+                                        headers=headers) as response:
+                    data = await response.read()
+            else:
+                raise Exception('Unsuported http method: %s' % http_method)
+
+            result = self._parse_result(json.loads(data), key)
+            error = False
+            return result
+        finally:
+            self.metrics.record(api_method,
+                                time.perf_counter() - started,
+                                error=error,
+                                bytes_sent=bytes_sent,
+                                bytes_received=len(data))
+
+    async def get(self, method, key, params=None, extras=None):
+        _params = {}
+
+        if params is not None:
+            _params.update(params)
+
+        if extras is not None:
+            _params['extras'] = ','.join(extras)
+
+        return await self._call_api('GET', method, key, params=_params)
+
+    async def get_collection(self,
+                             method,
+                             key,
+                             collection_key,
+                             params=None,
+                             extras=None):
+        """Yield the items of a paginated collection, in order, fetching
+        up to ``page_workers`` pages ahead."""
+        _params = {
+            'per_page': self.MAX_PER_PAGE
+        }
+
+        if params is not None:
+            _params.update(params)
+
+        def get_page(page):
+            page_params = dict(_params)
+            page_params['page'] = page
+            return asyncio.ensure_future(
+                self.get(method, key, params=page_params, extras=extras))
+
+        results = await get_page(1)
+        pages = int(results['pages'])
+        pending = deque()
+        next_page = 2
+        try:
+            while True:
+                # the next pages are fetched before the current one is
+                # given to the consumer
+                while next_page <= pages and \
+                        len(pending) < max(1, self.page_workers):
+                    pending.append(get_page(next_page))
+                    next_page += 1
+
+                for result in results[collection_key]:
+                    yield result
+                if not pending:
+                    break
+                results = await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def post(self, method, key, params=None):
+        return await self._call_api('POST', method, key, params=params)
+
+    async def photo_exists(self, photo_id):
+        """Whether a photo is still on Flickr."""
+        try:
+            await self.get_photo_info(photo_id)
+        except FlickrAPIError as e:
+            if e.code == self.PHOTO_NOT_FOUND:
+                return False
+            raise
+        return True
+
+    async def upload_photo(self,
+                           filename,
+                           title=None,
+                           desc=None,
+                           tags=None,
+                           progress=None,
+                           timeout=None,
+                           ticket=False):
+        _params = self._upload_params(title, desc, tags)
+        if ticket:
+            _params['async'] = '1'
+        if timeout is None:
+            timeout = self.upload_timeout
+
+        # sign a query without the files, the file is streamed
+        headers, _ = self._sign_form(self.upload_url, _params)
+        body = MultipartFileBody(_params,
+                                 'photo',
+                                 filename,
+                                 progress=progress)
+        headers['Content-Type'] = body.content_type
+        headers['Content-Length'] = str(len(body))
+
+        await self._wait(self.upload_limiter)
+        session = self.async_session()
+        started = time.perf_counter()
+        error = True
+        text = ''
+        try:
+            async with session.post(
+                    self.upload_url,
+                    data=stream_body(body, self.bandwidth),
+                    headers=headers,
+                    timeout=self._client_timeout(timeout)) \
+                    as response:
+                text = await response.text()
+            photo = self._parse_upload_result(text)
+            error = False
+            return photo
+        finally:
+            body.close()
+            self.metrics.record(Metrics.UPLOAD,
+                                time.perf_counter() - started,
+                                error=error,
+                                bytes_sent=len(body),
+                                bytes_received=len(text.encode('utf-8')))
+
+
+async def stream_body(body, bandwidth=None):
+    """Read the body chunks in the default executor, so that file reads do
+    not block the loop, and wait for the BandwidthLimiter if any."""
+    loop = asyncio.get_running_loop()
+    chunks = iter(body)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            if bandwidth is not None:
+                waited = bandwidth.reserve(len(chunk))
+                if waited > 0:
+                    await asyncio.sleep(waited)
+            yield chunk
+    finally:
+        body.close()
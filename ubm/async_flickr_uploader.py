@@ -0,0 +1,234 @@
+import asyncio
+import time
+
+from ubm.async_flickr_api import AsyncFlickrAPI
+from ubm.flickr_api import FlickrAPIError
+from ubm.flickr_uploader import FlickrUploader, format_size, photo_size
+
+
+class AsyncFlickrUploader(FlickrUploader):
+    """FlickrUploader running the upload loop on asyncio.
+
+    The remote state is loaded with the blocking FlickrAPI in a thread, then
+    up to ``concurrency`` photos are processed at the same time by
+    coroutines sharing one AsyncFlickrAPI.
+    """
+
+    def __init__(self,
+                 client_key,
+                 client_secret,
+                 resource_owner_key=None,
+                 resource_owner_secret=None,
+                 concurrency=100,
+                 api_options=None,
+                 **kwargs):
+        super().__init__(client_key,
+                         client_secret,
+                         resource_owner_key,
+                         resource_owner_secret,
+                         api_options=api_options,
+                         **kwargs)
+        if self.ticket_poller is not None:
+            # the coroutines do not hold threads while Flickr processes
+            # the files
+            raise ValueError('upload tickets are not supported in async '
+                             'mode')
+        self.concurrency = concurrency
+        self.async_api = AsyncFlickrAPI(client_key,
+                                        client_secret,
+                                        resource_owner_key,
+                                        resource_owner_secret,
+                                        max_connections=concurrency,
+                                        metrics=self.metrics,
+                                        bandwidth=self.flickrAPI.bandwidth,
+                                        **(api_options or {}))
+        self.async_album_locks = None
+
+    async def upload_photo_async(self, photo):
+        timeout, attempts = self.upload_attempts(photo)
+        for attempt in range(attempts):
+            started = time.time()
+            try:
+                return await self.upload_photo_once_async(photo, timeout)
+            except self.async_api.TRANSIENT_ERRORS as e:
+                if attempt + 1 == attempts:
+                    raise
+                await asyncio.sleep(self.retry_delay(photo, attempt, e))
+                if self.stop_event.is_set():
+                    raise
+                # the file may have reached Flickr
+                if not self.async_api.request_not_sent(e) and \
+                        await asyncio.get_running_loop().run_in_executor(
+                            None, self.find_uploaded, photo, started):
+                    return
+
+    async def upload_photo_once_async(self, photo, timeout=None):
+        desc = self.generate_desc(photo.key, photo.content_hash)
+
+        filename = photo.filename
+        if self.transcoder is not None and \
+                self.transcoder.start(photo, photo_size(photo)):
+            try:
+                await asyncio.wrap_future(self.transcoder.future(photo))
+            except Exception:
+                # logged by output_file
+                pass
+            filename = self.transcoder.output_file(photo, photo_size(photo))
+        file_progress = self.file_progress()
+        try:
+            result = await self.async_api.upload_photo(
+                    filename,
+                    title=photo.title,
+                    desc=desc,
+                    tags=self.tags,
+                    progress=file_progress,
+                    timeout=timeout)
+            self.count_transcoded(photo, filename, file_progress)
+        except Exception:
+            if file_progress is not None:
+                file_progress.cancel()
+            raise
+        finally:
+            if self.transcoder is not None:
+                self.transcoder.done(photo)
+        self.photo_uploaded(photo, result['photoid'])
+
+    async def create_album_async(self, album, photo):
+        desc = self.generate_desc(album.key)
+        photoset = await self.async_api.create_photoset(
+                                album.title,
+                                self.get_photo_id(photo),
+                                desc=desc)
+        self.album_created(album, photo, photoset['id'])
+
+    async def add_photo_to_album_async(self, photo):
+        try:
+            await self.async_api.add_photo_to_photoset(
+                                self.get_album_id(photo.album),
+                                self.get_photo_id(photo))
+        except FlickrAPIError as e:
+            if e.code == self.async_api.PHOTO_ALREADY_IN_SET:
+                # linked under the key of another copy of the photo
+                pass
+            elif e.code == self.async_api.PHOTOSET_PHOTO_NOT_FOUND:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.upload_deleted_photo, photo)
+                await self.async_api.add_photo_to_photoset(
+                                self.get_album_id(photo.album),
+                                self.get_photo_id(photo))
+            else:
+                raise
+        self.photo_linked(photo)
+
+    async def process_photo_async(self, photo):
+        """Upload a photo if needed, then create or link its album."""
+        if not self.photo_exists(photo):
+            self.logger.info("Uploading photo: '%s' (%s)",
+                             photo.title,
+                             format_size(photo_size(photo)))
+            await self.upload_photo_async(photo)
+        if photo.album is not None:
+            # The primary photo of an album creates it, the others wait for
+            # the creation before being linked.
+            lock = self.async_album_locks.setdefault(photo.album.key,
+                                                     asyncio.Lock())
+            async with lock:
+                if not self.album_exists(photo.album):
+                    if self.wait_for_primary(photo):
+                        return
+                    self.logger.info("Create album: '%s' with photo '%s'",
+                                     photo.album.title,
+                                     photo.title)
+                    await self.create_album_async(photo.album, photo)
+                    waiting = self.photos_waiting_for(photo.album)
+                    if waiting:
+                        await asyncio.get_running_loop().run_in_executor(
+                            None, self.link_photos, photo.album, waiting)
+                elif not self.photo_in_album_exists(photo):
+                    self.logger.info("Link album: '%s' with photo '%s'",
+                                     photo.album.title,
+                                     photo.title)
+                    if self.bulk_link_threshold is None:
+                        await self.add_photo_to_album_async(photo)
+                    else:
+                        batch = self.queue_link(photo)
+                        if batch is not None:
+                            await asyncio.get_running_loop().run_in_executor(
+                                None, self.link_photos, photo.album, batch)
+
+    async def upload_async(self, photos, full_sync=False):
+        loop = asyncio.get_running_loop()
+        plan = await loop.run_in_executor(None,
+                                          lambda: self.plan_upload(
+                                              photos, full_sync=full_sync))
+        await self.execute_async(plan)
+
+    async def execute_async(self, plan):
+        loop = asyncio.get_running_loop()
+        ready = await loop.run_in_executor(None, self.start_plan, plan)
+        if not ready:
+            return
+
+        self.logger.info('Uploading with %s coroutines', self.concurrency)
+        self.async_album_locks = {}
+        large = []
+        small = []
+        for photo in plan.photos_to_process():
+            if self.in_large_lane(photo):
+                large.append(photo)
+            else:
+                small.append(photo)
+        if large:
+            self.logger.info('Uploading %s large files with %s coroutines',
+                             len(large),
+                             self.large_workers)
+        errors = []
+
+        async def worker(pending):
+            # every worker takes the next photo, which bounds the number of
+            # photos in flight to the number of workers
+            for photo in pending:
+                if errors or self.stop_event.is_set():
+                    return
+                try:
+                    await self.process_photo_async(photo)
+                except Exception as e:
+                    self.logger.exception("Failed to process photo '%s'",
+                                          photo.title)
+                    errors.append(e)
+
+        failed = True
+        try:
+            try:
+                # the large files have their own workers, beside the others
+                small = iter(small)
+                large = iter(large)
+                await asyncio.gather(
+                    *[worker(small) for i in range(self.concurrency)],
+                    *[worker(large) for i in range(self.large_workers)])
+            finally:
+                await self.async_api.close()
+                try:
+                    try:
+                        await loop.run_in_executor(None,
+                                                   self.create_waiting_albums)
+                    finally:
+                        await loop.run_in_executor(None, self.flush_links)
+                finally:
+                    if self.transcoder is not None:
+                        await loop.run_in_executor(None,
+                                                   self.transcoder.close)
+            failed = bool(errors)
+        finally:
+            self.finish_progress(failed)
+
+        if errors:
+            raise errors[0]
+
+        self.finish_upload()
+
+    def upload(self, photos, full_sync=False):
+        asyncio.run(self.upload_async(photos, full_sync=full_sync))
+
+    def execute(self, plan):
+        asyncio.run(self.execute_async(plan))
@@ -0,0 +1,201 @@
+"""
+.. module:: bandwidth
+   :platform: Unix, Windows
+   :synopsis: Upload byte rate shared by the uploads, with a schedule.
+
+"""
+import datetime
+import logging
+import threading
+import time
+
+from ubm.rate_limiter import TokenBucket
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Rate of a limiter not checked yet, None means unlimited
+_UNSET = object()
+
+
+def parse_time(value):
+    """Minutes since midnight of a 'HH:MM' time.
+
+    Unquoted in YAML, 18:00 is read as the sexagesimal 1080, which is
+    already in minutes.
+    """
+    if isinstance(value, int):
+        return value
+    hours, minutes = str(value).split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class ScheduleWindow(object):
+    """Rate applied between two times of the day, on some days."""
+
+    def __init__(self, start, end, rate=None, days=None):
+        """Window from ``start`` to ``end``, it goes past midnight when
+        ``end`` is before ``start``.
+
+        :param start: 'HH:MM' time.
+        :param end: 'HH:MM' time.
+        :param rate: bytes per second, None for unlimited.
+        :type rate: int.
+        :param days: days the window starts on, 'mon' to 'sun', every day
+                     by default.
+        :type days: list.
+
+        """
+        self.start = parse_time(start)
+        self.end = parse_time(end)
+        self.rate = rate
+        self.days = None
+        if days is not None:
+            self.days = {DAYS.index(day.lower()[:3]) for day in days}
+
+    def _starts_on(self, weekday):
+        return self.days is None or weekday in self.days
+
+    def contains(self, when):
+        minutes = when.hour * 60 + when.minute
+        weekday = when.weekday()
+        if self.start <= self.end:
+            return self._starts_on(weekday) and \
+                self.start <= minutes < self.end
+        # past midnight, the end belongs to the day after the start
+        return (self._starts_on(weekday) and minutes >= self.start) or \
+            (self._starts_on((weekday - 1) % 7) and minutes < self.end)
+
+
+class BandwidthLimiter(object):
+    """Byte rate shared by every upload of the process.
+
+    The rate is the one of the first schedule window containing the local
+    time, ``rate`` outside of them, None meaning unlimited. ``set_rate``
+    overrides the schedule while the run goes on, and ``configure``
+    replaces it. ``configure_later`` does it from a signal handler.
+    """
+
+    # Seconds between two checks of the schedule
+    CHECK_INTERVAL = 10
+
+    def __init__(self, rate=None, schedule=None, burst=1.0):
+        """Limiter following a schedule.
+
+        :param rate: bytes per second outside of the schedule windows.
+        :type rate: int.
+        :param schedule: ScheduleWindow list.
+        :type schedule: list.
+        :param burst: seconds of rate that can be sent at once.
+        :type burst: float.
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.override = None
+        self.has_override = False
+        self.bucket = None
+        self.current_rate = _UNSET
+        self.checked = None
+        # (rate, schedule) given by configure_later, and the last applied
+        self.pending = None
+        self.applied = None
+        self.configure(rate, schedule)
+
+    def configure(self, rate=None, schedule=None):
+        """Replace the default rate and the schedule."""
+        with self.lock:
+            self.rate = rate
+            self.schedule = list(schedule or [])
+            self.checked = None
+
+    def configure_later(self, rate=None, schedule=None):
+        """Replace the default rate and the schedule on the next
+        ``reserve``.
+
+        It does not take the lock, a signal handler can call it while the
+        interrupted thread holds it.
+        """
+        self.pending = (rate, list(schedule or []))
+
+    def set_rate(self, rate):
+        """Use rate, None for unlimited, until ``clear_rate``."""
+        with self.lock:
+            self.override = rate
+            self.has_override = True
+            self.checked = None
+
+    def clear_rate(self):
+        """Go back to the schedule."""
+        with self.lock:
+            self.has_override = False
+            self.checked = None
+
+    def rate_at(self, when):
+        """Scheduled rate at a local time.
+
+        :param when: local time.
+        :type when: datetime.datetime.
+        :returns: int -- Bytes per second, None for unlimited.
+
+        """
+        for window in self.schedule:
+            if window.contains(when):
+                return window.rate
+        return self.rate
+
+    def _update(self):
+        # the pending conf is only read here, a newer one set meanwhile is
+        # applied next time
+        pending = self.pending
+        if pending is not self.applied:
+            self.applied = pending
+            self.rate, self.schedule = pending
+            self.checked = None
+
+        # the schedule is checked every CHECK_INTERVAL seconds only
+        now = time.monotonic()
+        if self.checked is not None and \
+                now - self.checked < self.CHECK_INTERVAL:
+            return
+        self.checked = now
+        if self.has_override:
+            rate = self.override
+        else:
+            rate = self.rate_at(datetime.datetime.now())
+        if rate == self.current_rate:
+            return
+
+        self.logger.info('upload bandwidth: %s',
+                         'unlimited' if rate is None
+                         else '%s bytes/s' % rate)
+        self.current_rate = rate
+        if rate is None:
+            self.bucket = None
+        elif self.bucket is None:
+            self.bucket = TokenBucket(rate, rate * self.burst)
+        else:
+            self.bucket.set_rate(rate)
+            self.bucket.capacity = rate * self.burst
+
+    def reserve(self, size):
+        """Take bytes without waiting.
+
+        :returns: float -- Time to wait before sending them, in seconds.
+        """
+        with self.lock:
+            self._update()
+            bucket = self.bucket
+        if bucket is None:
+            return 0
+        return bucket.reserve(size)
+
+    def acquire(self, size):
+        """Wait until size bytes can be sent.
+
+        :returns: float -- Time waited, in seconds.
+        """
+        waited = self.reserve(size)
+        if waited > 0:
+            time.sleep(waited)
+        return waited
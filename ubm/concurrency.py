@@ -0,0 +1,56 @@
+import threading
+
+
+class ByteBudget(object):
+    """Bound the number of bytes in flight across upload workers.
+
+    A request bigger than the whole budget is clamped to it, so a large file
+    still goes through, alone.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def _clamp(self, size):
+        return min(size, self.max_bytes)
+
+    def acquire(self, size):
+        size = self._clamp(size)
+        with self.condition:
+            while self.in_flight + size > self.max_bytes:
+                self.condition.wait()
+            self.in_flight += size
+
+    def try_acquire(self, size):
+        """Acquire without waiting.
+
+        :returns: bool -- False if the bytes are not available.
+        """
+        size = self._clamp(size)
+        with self.condition:
+            if self.in_flight + size > self.max_bytes:
+                return False
+            self.in_flight += size
+            return True
+
+    def release(self, size):
+        size = self._clamp(size)
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class KeyedLock(object):
+    """Hand out one lock per key, created on first use."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
@@ -0,0 +1,34 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_NAME = 'sha256'
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(filename, chunk_size=CHUNK_SIZE):
+    """Hash a file content, reading it by chunks.
+
+    :returns: str -- '<algorithm>:<hex digest>'.
+    """
+    digest = hashlib.new(HASH_NAME)
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return '%s:%s' % (HASH_NAME, digest.hexdigest())
+
+
+def hash_photos(photos, workers=4):
+    """Set the content_hash of photos, hashing the files on a thread pool.
+
+    hashlib releases the GIL on large buffers, so the threads hash in
+    parallel.
+    """
+    photos = [photo for photo in photos if photo.content_hash is None]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = executor.map(hash_file,
+                              [photo.filename for photo in photos])
+        for photo, content_hash in zip(photos, hashes):
+            photo.content_hash = content_hash
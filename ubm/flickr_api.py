@@ -1,12 +1,19 @@
+import abc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-import webbrowser
+import threading
+import time
 import requests
-import requests_oauthlib
+import requests.adapters
 import logging
-from requests_oauthlib import OAuth1Session
+from urllib3.exceptions import NewConnectionError
 import xml.etree.ElementTree as ET
 
-from ubm.oauth1_callback_server import OAuthCallbackServer
+from ubm.metrics import Metrics
+from ubm.multipart import MultipartFileBody
+from ubm.photo import IMAGE_FILE_TYPES, VIDEO_FILE_TYPES
+from ubm.rate_limiter import TokenBucket
 
 REQUEST_TOKEN_URL = 'https://www.flickr.com/services/oauth/request_token'
 AUTHORIZATION_URL = 'https://www.flickr.com/services/oauth/authorize'
@@ -23,7 +30,15 @@ class Permission(Enum):
 
 def request_user_authorization(client_key,
                                client_secret,
-                               perms=Permission.write):
+                               perms=Permission.write,
+                               request_token_url=REQUEST_TOKEN_URL,
+                               authorization_url=AUTHORIZATION_URL,
+                               access_token_url=ACCESS_TOKEN_URL):
+    # only needed once, to get the tokens of the conf
+    import webbrowser
+    from requests_oauthlib import OAuth1Session
+    from ubm.oauth1_callback_server import OAuthCallbackServer
+
     user_callback_url_host = 'localhost'
     user_callback_url_port = 7777
     user_callback_url = 'http://%s:%s/callback' % (
@@ -35,33 +50,33 @@ def request_user_authorization(client_key,
     oauth = OAuth1Session(client_key,
                           client_secret=client_secret,
                           callback_uri=user_callback_url)
-    request_token_response = oauth.fetch_request_token(REQUEST_TOKEN_URL)
+    request_token_response = oauth.fetch_request_token(request_token_url)
 
     request_token = request_token_response.get('oauth_token')
     request_token_secret = request_token_response.get('oauth_token_secret')
 
     # Obtain authorization from the user
-    authorization_url = oauth.authorization_url(AUTHORIZATION_URL)
+    user_authorization_url = oauth.authorization_url(authorization_url)
     if perms is not None:
-        authorization_url += '&perms=%s' % perms.name
+        user_authorization_url += '&perms=%s' % perms.name
 
+    # listen before opening the browser, so that no redirect is missed
+    server = OAuthCallbackServer(user_callback_url_host,
+                                 user_callback_url_port)
+    server.start()
     try:
-        webbrowser.open(authorization_url)
-
-        server = OAuthCallbackServer(user_callback_url_host,
-                                     user_callback_url_port)
-        server.start()
+        webbrowser.open(user_authorization_url)
 
         callback_url_with_tokens = server.wait_for_callback_url()
 
-        server.stop()
-
         oauth_response = oauth.parse_authorization_response(
                                       callback_url_with_tokens)
         verifier = oauth_response['oauth_verifier']
     except webbrowser.Error:
-        print('Please go here and authorize %s' % authorization_url)
+        print('Please go here and authorize %s' % user_authorization_url)
         verifier = input('Please input the verifier: ')
+    finally:
+        server.stop()
 
     # Obtain owner tokens from user verifier and request toekn
     oauth = OAuth1Session(client_key,
@@ -70,7 +85,7 @@ def request_user_authorization(client_key,
                           resource_owner_secret=request_token_secret,
                           verifier=verifier)
 
-    oauth_tokens = oauth.fetch_access_token(ACCESS_TOKEN_URL)
+    oauth_tokens = oauth.fetch_access_token(access_token_url)
     return {
         'resource_owner_key': oauth_tokens.get('oauth_token'),
         'resource_owner_secret': oauth_tokens.get('oauth_token_secret')
@@ -87,46 +102,100 @@ class FlickrAPIError(Exception):
         return repr(self.value)
 
 
-class FlickrAPI(object):
+class FlickrAPIBase(abc.ABC):
+    """Settings, quotas and API accessors shared by FlickrAPI and
+    AsyncFlickrAPI.
 
-    SUPPORTED_IMAGE_FILE_TYPES = {
-        'jpeg',
-        'jpg',
-        'png',
-        'gif'
-    }
+    The accessors return what ``get``, ``post`` and ``get_collection`` of
+    the subclass return, results with FlickrAPI, awaitables and async
+    generators with AsyncFlickrAPI. Helpers using the results are defined
+    by each subclass, which implements the abstract transport methods.
+    """
 
-    SUPPORTED_VIDEO_FILE_TYPES = {
-        'mp4',
-        'avi',
-        'wmv',
-        'mov',
-        'mpeg',
-        '3gp',
-        'm2ts',
-        'ogg',
-        'ogv'
-    }
+    SUPPORTED_IMAGE_FILE_TYPES = IMAGE_FILE_TYPES
+
+    SUPPORTED_VIDEO_FILE_TYPES = VIDEO_FILE_TYPES
+
+    # Largest page size accepted by the Flickr collection methods
+    MAX_PER_PAGE = 500
+
+    # Error code of flickr.photos.getInfo for a photo not found
+    PHOTO_NOT_FOUND = 1
+
+    # Error code of flickr.photosets.addPhoto and editPhotos for a photo
+    # not found
+    PHOTOSET_PHOTO_NOT_FOUND = 2
+
+    # Error code of flickr.photosets.addPhoto for a photo already in the set
+    PHOTO_ALREADY_IN_SET = 3
+
+    # Flickr API quota, per key
+    REST_CALLS_PER_HOUR = 3600
 
     def __init__(self,
                  client_key,
                  client_secret,
                  resource_owner_key,
-                 resource_owner_secret):
+                 resource_owner_secret,
+                 pool_size=10,
+                 timeout=(10, 60),
+                 upload_timeout=(10, 300),
+                 page_workers=4,
+                 rate_limit=None,
+                 api_url=API_URL,
+                 upload_url=UPLOAD_API_URL,
+                 metrics=None,
+                 bandwidth=None):
         self.logger = logging.getLogger(__name__)
         self.client_key = client_key
         self.client_secret = client_secret
         self.resource_owner_key = resource_owner_key
         self.resource_owner_secret = resource_owner_secret
 
-    def session(self):
-        """docstring for session"""
-        return OAuth1Session(self.client_key,
-                             resource_owner_key=self.resource_owner_key,
-                             client_secret=self.client_secret,
-                             resource_owner_secret=self.resource_owner_secret)
-
-    def _call_api(self, http_method, api_method, key, params=None):
+        self.pool_size = pool_size
+        self.timeout = self._timeout(timeout)
+        self.upload_timeout = self._timeout(upload_timeout)
+        self.page_workers = page_workers
+        # Flickr endpoints, a local mock can be used instead
+        self.api_url = api_url
+        self.upload_url = upload_url
+        # Stats of the calls, can be shared by several FlickrAPI
+        self.metrics = metrics
+        if self.metrics is None:
+            self.metrics = Metrics()
+        # BandwidthLimiter of the upload streams, can be shared too
+        self.bandwidth = bandwidth
+
+        # Quota buckets, shared by every FlickrAPI of the process using the
+        # same key
+        rate_limit = rate_limit or {}
+        margin = rate_limit.get('margin', 0.95)
+        burst = rate_limit.get('burst', 20)
+        rest_per_hour = rate_limit.get('rest_per_hour',
+                                       self.REST_CALLS_PER_HOUR)
+        upload_per_hour = rate_limit.get('upload_per_hour')
+        self.rest_limiter = None
+        if rest_per_hour is not None:
+            self.rest_limiter = TokenBucket.per_hour(
+                                    ('rest', client_key),
+                                    rest_per_hour,
+                                    margin=margin,
+                                    burst=burst)
+        self.upload_limiter = None
+        if upload_per_hour is not None:
+            self.upload_limiter = TokenBucket.per_hour(
+                                    ('upload', client_key),
+                                    upload_per_hour,
+                                    margin=margin,
+                                    burst=burst)
+
+    @staticmethod
+    def _timeout(timeout):
+        # yaml gives lists, requests wants a (connect, read) tuple
+        return tuple(timeout) if isinstance(timeout, list) else timeout
+
+    @staticmethod
+    def _api_params(api_method, params=None):
         _params = {
             'nojsoncallback': 1,
             'format': 'json',
@@ -135,14 +204,10 @@ class FlickrAPI(object):
 
         if params is not None:
             _params.update(params)
+        return _params
 
-        if http_method == 'GET':
-            result = self.session().get(API_URL, params=_params).json()
-        elif http_method == 'POST':
-            result = self.session().post(API_URL, data=_params).json()
-        else:
-            raise Exception('Unsuported http method: %s' % http_method)
-
+    @staticmethod
+    def _parse_result(result, key):
         if result['stat'] == 'ok':
             return result[key] if key is not None else None
         else:
@@ -150,42 +215,22 @@ class FlickrAPI(object):
                                  code=int(result['code']),
                                  message=result['message'])
 
+    @abc.abstractmethod
     def get(self, method, key, params=None, extras=None):
-        _params = {}
-
-        if params is not None:
-            _params.update(params)
-
-        if extras is not None:
-            _params['extras'] = ','.join(extras)
-
-        return self._call_api('GET', method, key, params=_params)
+        raise NotImplementedError
 
+    @abc.abstractmethod
     def get_collection(self,
                        method,
                        key,
                        collection_key,
                        params=None,
                        extras=None):
-        _params = {}
-
-        if params is not None:
-            _params.update(params)
-
-        page = 1
-        pages = 1
-        while page <= pages:
-            _params['page'] = page
-            results = self.get(method, key, params=_params, extras=extras)
-
-            for result in results[collection_key]:
-                yield(result)
-
-            pages = int(results['pages'])
-            page += 1
+        raise NotImplementedError
 
+    @abc.abstractmethod
     def post(self, method, key, params=None):
-        return self._call_api('POST', method, key, params=params)
+        raise NotImplementedError
 
     ######################
     # API accessors
@@ -219,12 +264,39 @@ class FlickrAPI(object):
                              'photo_id': photo_id
                          })
 
+    def set_photo_meta(self, photo_id, title, desc):
+        return self.post('flickr.photos.setMeta',
+                         None,
+                         params={
+                             'photo_id': photo_id,
+                             'title': title,
+                             'description': desc
+                         })
+
     def get_photos_not_in_set(self, extras=None):
         return self.get_collection('flickr.photos.getNotInSet',
                                    'photos',
                                    'photo',
                                    extras=extras)
 
+    def get_user_photos(self, user_id='me', extras=None):
+        return self.get_collection('flickr.people.getPhotos',
+                                   'photos',
+                                   'photo',
+                                   params={
+                                       'user_id': user_id
+                                   },
+                                   extras=extras)
+
+    def get_recently_updated_photos(self, min_date, extras=None):
+        return self.get_collection('flickr.photos.recentlyUpdated',
+                                   'photos',
+                                   'photo',
+                                   params={
+                                       'min_date': min_date
+                                   },
+                                   extras=extras)
+
     ######################
     # Photoset
     ######################
@@ -256,11 +328,11 @@ class FlickrAPI(object):
                          params=_params)
 
     def delete_photoset(self, photoset_id):
-        self.post('flickr.photosets.delete',
-                  None,
-                  params={
-                      'photoset_id': photoset_id
-                  })
+        return self.post('flickr.photosets.delete',
+                         None,
+                         params={
+                             'photoset_id': photoset_id
+                         })
 
     def add_photo_to_photoset(self, photoset_id, photo_id):
         return self.post('flickr.photosets.addPhoto',
@@ -270,11 +342,43 @@ class FlickrAPI(object):
                             'photo_id': photo_id
                          })
 
+    def remove_photo_from_photoset(self, photoset_id, photo_id):
+        return self.post('flickr.photosets.removePhoto',
+                         None,
+                         params={
+                            'photoset_id': photoset_id,
+                            'photo_id': photo_id
+                         })
+
+    def check_tickets(self, ticket_ids):
+        """Status of upload tickets, in one call.
+
+        :returns: dict -- The 'ticket' list, with the 'id', and 'complete'
+                  (0 while processed, 1 with the 'photoid' once done, 2 if
+                  it failed) or 'invalid'.
+        """
+        return self.get('flickr.photos.upload.checkTickets',
+                        'uploader',
+                        params={
+                            'tickets': ','.join(ticket_ids)
+                        })
+
+    def edit_photoset_photos(self, photoset_id, primary_photo_id, photo_ids):
+        """Replace the photos of a photoset."""
+        return self.post('flickr.photosets.editPhotos',
+                         None,
+                         params={
+                            'photoset_id': photoset_id,
+                            'primary_photo_id': primary_photo_id,
+                            'photo_ids': ','.join(photo_ids)
+                         })
+
     ######################
     # Upload photo
     ######################
 
-    def upload_photo(self, filename, title=None, desc=None, tags=None):
+    @staticmethod
+    def _upload_params(title=None, desc=None, tags=None):
         _params = {}
 
         if title is not None:
@@ -285,33 +389,301 @@ class FlickrAPI(object):
 
         if tags is not None:
             _params['tags'] = ','.join(tags)
+        return _params
 
-        _files = {
-            'photo': open(filename, 'rb')
-        }
-
-        # simulate a query without the files to get the auth param
-        auth = requests_oauthlib.OAuth1(
-                        self.client_key,
-                        resource_owner_key=self.resource_owner_key,
-                        client_secret=self.client_secret,
-                        resource_owner_secret=self.resource_owner_secret)
-        raw = requests.Request('POST', UPLOAD_API_URL, data=_params, auth=auth)
-        prepared = raw.prepare()
-        auth = {'Authorization': prepared.headers.get('Authorization')}
-
-        # use the auth without the files param
-        result = requests.post(UPLOAD_API_URL,
-                               data=_params,
-                               headers=auth,
-                               files=_files)
-        xml = ET.fromstring(result.text)
+    @staticmethod
+    def _parse_upload_result(text):
+        xml = ET.fromstring(text)
 
         if xml.attrib['stat'] == 'ok':
+            if xml[0].tag == 'ticketid':
+                return {
+                    'ticketid': xml[0].text
+                }
             return {
                 'photoid': xml[0].text
             }
         else:
-            raise FlickrAPIError(result.text,
+            raise FlickrAPIError(text,
                                  code=int(xml[0].attrib['code']),
                                  message=xml[0].attrib['msg'])
+
+    @abc.abstractmethod
+    def upload_photo(self,
+                     filename,
+                     title=None,
+                     desc=None,
+                     tags=None,
+                     progress=None,
+                     timeout=None,
+                     ticket=False):
+        raise NotImplementedError
+
+
+class FlickrAPI(FlickrAPIBase):
+    """Flickr API client on requests, safe to share between threads."""
+
+    # Errors of a call which may succeed if made again
+    TRANSIENT_ERRORS = (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout)
+
+    def __init__(self,
+                 client_key,
+                 client_secret,
+                 resource_owner_key,
+                 resource_owner_secret,
+                 **kwargs):
+        super().__init__(client_key,
+                         client_secret,
+                         resource_owner_key,
+                         resource_owner_secret,
+                         **kwargs)
+
+        # OAuth1 signing does not change the signer state, it can be shared
+        # between threads. requests_oauthlib also loads all of OAuth2, it is
+        # imported when a FlickrAPI is made, not with the module.
+        import requests_oauthlib
+        self.auth = requests_oauthlib.OAuth1(
+                        self.client_key,
+                        resource_owner_key=self.resource_owner_key,
+                        client_secret=self.client_secret,
+                        resource_owner_secret=self.resource_owner_secret)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @staticmethod
+    def request_not_sent(error):
+        """Whether a transient error happened before the request reached
+        Flickr, so that making it again does not do it twice.
+
+        :param error: one of TRANSIENT_ERRORS.
+        :type error: Exception.
+        :returns: bool -- False when the request may have been received,
+                  a read timeout or a connection reset for instance.
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(error, requests.exceptions.ConnectionError) and \
+                error.args:
+            # refused connection or unknown host
+            return isinstance(getattr(error.args[0], 'reason', None),
+                              NewConnectionError)
+        return False
+
+    def session(self):
+        """Get the keep-alive session shared by the REST and upload calls.
+
+        The session is created on first use with a connection pool of
+        ``pool_size`` connections per host, so that many threads can use it
+        at the same time.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                                    pool_connections=2,
+                                    pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """Close the pooled connections."""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _call_api(self, http_method, api_method, key, params=None):
+        _params = self._api_params(api_method, params)
+
+        if self.rest_limiter is not None:
+            self.rest_limiter.acquire()
+
+        started = time.perf_counter()
+        error = True
+        bytes_sent = 0
+        bytes_received = 0
+        try:
+            if http_method == 'GET':
+                response = self.session().get(self.api_url,
+                                              params=_params,
+                                              auth=self.auth,
+                                              timeout=self.timeout)
+                bytes_sent = len(response.request.url)
+            elif http_method == 'POST':
+                response = self.session().post(self.api_url,
+                                               data=_params,
+                                               auth=self.auth,
+                                               timeout=self.timeout)
+                bytes_sent = len(response.request.body or '')
+            else:
+                raise Exception('Unsuported http method: %s' % http_method)
+            bytes_received = len(response.content)
+
+            result = self._parse_result(response.json(), key)
+            error = False
+            return result
+        finally:
+            self.metrics.record(api_method,
+                                time.perf_counter() - started,
+                                error=error,
+                                bytes_sent=bytes_sent,
+                                bytes_received=bytes_received)
+
+    def get(self, method, key, params=None, extras=None):
+        _params = {}
+
+        if params is not None:
+            _params.update(params)
+
+        if extras is not None:
+            _params['extras'] = ','.join(extras)
+
+        return self._call_api('GET', method, key, params=_params)
+
+    def get_collection(self,
+                       method,
+                       key,
+                       collection_key,
+                       params=None,
+                       extras=None):
+        """Yield the items of a paginated collection, in order.
+
+        Pages are requested with the largest page size. Once the first page
+        gives the page count, the next pages are fetched ``page_workers`` at
+        a time while the current one, the first one included, is being
+        consumed.
+        """
+        _params = {
+            'per_page': self.MAX_PER_PAGE
+        }
+
+        if params is not None:
+            _params.update(params)
+
+        def get_page(page):
+            page_params = dict(_params)
+            page_params['page'] = page
+            return self.get(method, key, params=page_params, extras=extras)
+
+        results = get_page(1)
+        pages = int(results['pages'])
+        if pages <= 1 or self.page_workers <= 1:
+            for result in results[collection_key]:
+                yield(result)
+            for page in range(2, pages + 1):
+                for result in get_page(page)[collection_key]:
+                    yield(result)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=self.page_workers)
+        pending = deque()
+        next_page = 2
+        try:
+            while True:
+                # the next pages are fetched before the current one is
+                # given to the consumer
+                while next_page <= pages and \
+                        len(pending) < self.page_workers:
+                    pending.append(executor.submit(get_page, next_page))
+                    next_page += 1
+
+                for result in results[collection_key]:
+                    yield(result)
+                if not pending:
+                    break
+                results = pending.popleft().result()
+        finally:
+            # the consumer may stop early, drop the pages not started yet
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def post(self, method, key, params=None):
+        return self._call_api('POST', method, key, params=params)
+
+    ######################
+    # Helpers
+    ######################
+
+    def photo_exists(self, photo_id):
+        """Whether a photo is still on Flickr."""
+        try:
+            self.get_photo_info(photo_id)
+        except FlickrAPIError as e:
+            if e.code == self.PHOTO_NOT_FOUND:
+                return False
+            raise
+        return True
+
+    ######################
+    # Upload photo
+    ######################
+
+    def upload_photo(self,
+                     filename,
+                     title=None,
+                     desc=None,
+                     tags=None,
+                     progress=None,
+                     timeout=None,
+                     ticket=False):
+        """Upload a photo or a video.
+
+        :param timeout: (connect, read) timeout, ``upload_timeout`` by
+                        default.
+        :param ticket: do not wait for Flickr to process the file, see
+                       check_tickets.
+        :type ticket: bool.
+        :returns: dict -- The 'photoid' of the upload, or its 'ticketid'.
+        """
+        _params = self._upload_params(title, desc, tags)
+        if ticket:
+            _params['async'] = '1'
+        if timeout is None:
+            timeout = self.upload_timeout
+
+        # simulate a query without the files to get the auth param
+        raw = requests.Request('POST',
+                               self.upload_url,
+                               data=_params,
+                               auth=self.auth)
+        prepared = raw.prepare()
+
+        # use the auth without the files param, the file is streamed
+        throttle = None
+        if self.bandwidth is not None:
+            throttle = self.bandwidth.acquire
+        body = MultipartFileBody(_params,
+                                 'photo',
+                                 filename,
+                                 progress=progress,
+                                 throttle=throttle)
+        headers = {
+            'Authorization': prepared.headers.get('Authorization'),
+            'Content-Type': body.content_type
+        }
+        if self.upload_limiter is not None:
+            self.upload_limiter.acquire()
+        started = time.perf_counter()
+        error = True
+        bytes_received = 0
+        try:
+            result = self.session().post(self.upload_url,
+                                         data=body,
+                                         headers=headers,
+                                         timeout=self._timeout(timeout))
+            bytes_received = len(result.content)
+            photo = self._parse_upload_result(result.text)
+            error = False
+            return photo
+        finally:
+            body.close()
+            self.metrics.record(Metrics.UPLOAD,
+                                time.perf_counter() - started,
+                                error=error,
+                                bytes_sent=len(body),
+                                bytes_received=bytes_received)
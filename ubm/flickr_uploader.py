@@ -1,119 +1,613 @@
-import html.parser
-import os.path
+import html
 import logging
+import os.path
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import bitmath
-from ubm.flickr_api import FlickrAPI
+from ubm.flickr_api import FlickrAPI, FlickrAPIError
+from ubm.concurrency import ByteBudget, KeyedLock
+from ubm.inventory import RemoteInventory
+from ubm.metrics import Metrics
+from ubm.content_hash import hash_photos
+from ubm.photo import IMAGE_FILE_TYPES, VIDEO_FILE_TYPES, is_video, \
+    photo_size
+from ubm.plan import SyncPlan, SyncPlanner
+from ubm.tickets import TicketPoller
+
+
+def format_size(size):
+    return bitmath.Byte(size) \
+                  .best_prefix().format('{value:.2f} {unit}')
 
 
 class FlickrUploader(object):
 
-    SUPPORTED_IMAGE_FILE_TYPES = {
-        'jpeg',
-        'jpg',
-        'png',
-        'gif'
-    }
-
-    SUPPORTED_VIDEO_FILE_TYPES = {
-        'mp4',
-        'avi',
-        'wmv',
-        'mov',
-        'mpeg',
-        '3gp',
-        'm2ts',
-        'ogg',
-        'ogv'
-    }
+    SUPPORTED_IMAGE_FILE_TYPES = IMAGE_FILE_TYPES
+
+    SUPPORTED_VIDEO_FILE_TYPES = VIDEO_FILE_TYPES
+
+    # Overlap between two incremental refreshes, in seconds
+    REFRESH_MARGIN = 600
+
+    # Seconds before the first retry of a large upload, doubled each time
+    RETRY_DELAY = 5
 
     def __init__(self,
                  client_key,
                  client_secret,
                  resource_owner_key=None,
                  resource_owner_secret=None,
-                 tags=None):
+                 tags=None,
+                 workers=1,
+                 max_inflight_bytes=None,
+                 api_options=None,
+                 inventory=None,
+                 content_hash=False,
+                 hash_workers=4,
+                 journal=None,
+                 bulk_link_threshold=10,
+                 link_batch_size=500,
+                 metrics=None,
+                 progress=None,
+                 bandwidth=None,
+                 transcoder=None,
+                 large_file_size=512 * 1024 ** 2,
+                 large_workers=1,
+                 large_upload_timeout=(10, 3600),
+                 large_upload_retries=3,
+                 upload_tickets=False,
+                 ticket_options=None):
         self.logger = logging.getLogger(__name__)
+        # Stats of the Flickr calls of the run
+        self.metrics = metrics
+        if self.metrics is None:
+            self.metrics = Metrics()
         self.flickrAPI = FlickrAPI(client_key,
                                    client_secret,
                                    resource_owner_key,
-                                   resource_owner_secret)
+                                   resource_owner_secret,
+                                   metrics=self.metrics,
+                                   bandwidth=bandwidth,
+                                   **(api_options or {}))
         self.photo_cache = None
         self.album_cache = None
         self.photo_in_album_cache = None
+        # content hash to photo key, filled when content_hash is set
+        self.hash_cache = None
+        # Remote state the caches are loaded from, kept in memory by default
+        self.inventory = inventory
+        if self.inventory is None:
+            self.inventory = RemoteInventory()
+        # Guard the caches above when uploading with several workers
+        self.cache_lock = threading.RLock()
+        # Serialize album creation and linking per album
+        self.album_locks = KeyedLock()
+        # Primary photo key of the albums the running plan creates, and the
+        # photos waiting for the creation to be linked
+        self.album_primaries = {}
+        self.waiting_for_album = {}
+
+        self.workers = workers
+        self.max_inflight_bytes = max_inflight_bytes
+        self.content_hash = content_hash
+        self.hash_workers = hash_workers
+
+        # Links to existing albums are queued per album key, then albums
+        # with at least bulk_link_threshold photos to add are edited at once
+        self.bulk_link_threshold = bulk_link_threshold
+        self.link_batch_size = link_batch_size
+        self.pending_links = {}
+        self.nb_links = 0
+        self.nb_link_calls = 0
+
+        # Videos and files of at least large_file_size bytes are uploaded
+        # in their own lane, so that they do not hold back the photos
+        self.large_file_size = large_file_size
+        self.large_workers = large_workers
+        self.large_upload_timeout = large_upload_timeout
+        self.large_upload_retries = large_upload_retries
+
+        # With upload tickets, Flickr processes the uploaded files in the
+        # background and the poller hands their ids to the album steps
+        self.ticket_poller = None
+        if upload_tickets:
+            self.ticket_poller = TicketPoller(self.flickrAPI,
+                                              self.ticket_done,
+                                              **(ticket_options or {}))
+
+        # UploadProgress given the photos and bytes uploaded
+        self.progress = progress
+        # Transcoder shrinking the files before their upload
+        self.transcoder = transcoder
+        # Completed steps, to resume an interrupted run
+        self.journal = journal
+        # Set to stop scheduling new photos, the running ones are finished
+        self.stop_event = threading.Event()
 
         self.tags = tags
         if self.tags is None:
             self.tags = {'ubm'}
 
         self.key_regexp = re.compile(r'{UBM: "([^"]+)"}', re.IGNORECASE)
+        self.hash_regexp = re.compile(r'{UBM_HASH: "([^"]+)"}',
+                                      re.IGNORECASE)
 
     def find_key_from_desc(self, desc):
-        desc = html.parser.HTMLParser().unescape(desc)
+        desc = html.unescape(desc)
         match = self.key_regexp.search(desc)
         return match.group(1) if match is not None else None
 
-    def generate_desc(self, key):
-        return "{UBM: \"%s\"}" % key
+    def find_hash_from_desc(self, desc):
+        desc = html.unescape(desc)
+        match = self.hash_regexp.search(desc)
+        return match.group(1) if match is not None else None
+
+    def generate_desc(self, key, content_hash=None):
+        desc = "{UBM: \"%s\"}" % key
+        if content_hash is not None:
+            desc += " {UBM_HASH: \"%s\"}" % content_hash
+        return desc
+
+    def init_cache(self, full_sync=False, refresh=True):
+        """Load the remote state in the caches.
 
-    def init_cache(self):
+        The inventory is refreshed incrementally when it was synced before,
+        unless ``full_sync`` is set. With ``refresh`` unset, a synced
+        inventory is used as is.
+        """
         self.logger.info('init cache...')
-        # init album cache
+        started = time.time()
+        if full_sync or self.inventory.last_sync is None:
+            self.sync_inventory()
+            self.inventory.set_last_sync(started)
+        elif refresh:
+            self.refresh_inventory()
+            self.inventory.set_last_sync(started)
 
-        self.photo_cache = {}
-        self.album_cache = {}
-        self.photo_in_album_cache = {}
+        with self.cache_lock:
+            self.photo_cache, self.album_cache, self.photo_in_album_cache = \
+                self.inventory.load()
+            self.hash_cache = {
+                photo['hash']: key
+                for key, photo in self.photo_cache.items()
+                if photo['hash'] is not None
+            }
+
+    def sync_inventory(self):
+        """List every photo once, then the bare photo ids of each photoset,
+        to rebuild the inventory.
+
+        The content hashes found by hashing the local files are kept for
+        the same photos.
+        """
+        self.logger.info('full sync of the inventory')
+        known_hashes = self.inventory.photo_hashes()
+        self.inventory.clear()
+
+        # only the description is needed, it holds the keys
+        photos = self.flickrAPI.get_user_photos(extras={'description'})
+        keys_by_id = self._save_photos(photos, known_hashes)
 
         photosets = self.flickrAPI.get_photosets()
         for photoset in photosets:
-            album_key = self.find_key_from_desc(photoset['description']['_content'])
-            if album_key is not None and album_key not in self.album_cache:
-                self.album_cache[album_key] = photoset
+            self._save_photoset(photoset, keys_by_id)
 
-            photos = self.flickrAPI.get_photoset_photos(photoset['id'], extras={'description'})
-            for photo in photos:
-                photo_key = self.find_key_from_desc(photo['description']['_content'])
-                if photo_key is not None:
-                    # and photo_key not in self.album_cache
-                    self.photo_cache[photo_key] = photo
-                    self.photo_in_album_cache[photo_key] = album_key
-
-        # init photo cache for photo not in photoset
-        photos = self.flickrAPI.get_photos_not_in_set(extras={'description'})
+    def refresh_inventory(self):
+        """Only list the recently updated photos and the members of the
+        photosets changed since the last sync.
+
+        A photo which left a photoset is checked, and removed from the
+        inventory if it was deleted. Photos deleted while in no photoset
+        are only noticed by a full sync, or when linking them to their
+        album fails.
+        """
+        last_sync = self.inventory.last_sync
+        known_photosets = self.inventory.photosets()
+        nb_photosets = 0
+        nb_refreshed = 0
+
+        photos = self.flickrAPI.get_recently_updated_photos(
+                        int(last_sync) - self.REFRESH_MARGIN,
+                        extras={'description'})
+        nb_photos = len(self._save_photos(photos,
+                                          self.inventory.photo_hashes()))
+        keys_by_id = self.inventory.photo_keys_by_id()
+        # keys of the photos which left a photoset, maybe deleted
+        dropped = set()
+
+        photosets = self.flickrAPI.get_photosets()
+        for photoset in photosets:
+            nb_photosets += 1
+            state = (str(photoset['date_update']),
+                     self._photoset_size(photoset))
+            if known_photosets.pop(photoset['id'], None) != state:
+                nb_refreshed += 1
+                dropped.update(self._save_photoset(photoset, keys_by_id))
+
+        for photoset_id in known_photosets:
+            dropped.update(self.inventory.photoset_members(photoset_id))
+            self.inventory.remove_photoset(photoset_id)
+
+        nb_deleted = self._remove_deleted_photos(dropped, keys_by_id)
+
+        self.logger.info('inventory refresh: photosets %s/%s (%s removed), '
+                         '%s recently updated photos, %s deleted',
+                         nb_refreshed,
+                         nb_photosets,
+                         len(known_photosets),
+                         nb_photos,
+                         nb_deleted)
+
+    def _remove_deleted_photos(self, keys, keys_by_id):
+        """Remove from the inventory the photos of keys deleted on Flickr.
+
+        :returns: int -- The number of photos removed.
+        """
+        ids_by_key = {key: photo_id
+                      for photo_id, photo_keys in keys_by_id.items()
+                      for key in photo_keys}
+        nb_deleted = 0
+        for key in keys:
+            photo_id = ids_by_key.get(key)
+            if photo_id is not None and \
+                    not self.flickrAPI.photo_exists(photo_id):
+                self.logger.info("photo '%s' was deleted on Flickr", key)
+                self.inventory.remove_photo(key)
+                nb_deleted += 1
+        return nb_deleted
+
+    @staticmethod
+    def _photoset_size(photoset):
+        return int(photoset['photos']) + int(photoset.get('videos', 0))
+
+    def _save_photoset(self, photoset, keys_by_id):
+        """Save a photoset and its members.
+
+        :returns: set -- The keys of the members which left it.
+        """
+        album_key = self.find_key_from_desc(
+                            photoset['description']['_content'])
+        self.inventory.save_photoset(photoset['id'],
+                                     album_key,
+                                     photoset['title']['_content'],
+                                     str(photoset['date_update']),
+                                     self._photoset_size(photoset))
+
+        # bare listing, the photo keys are already known by id
+        photos = self.flickrAPI.get_photoset_photos(photoset['id'])
+        members = [key for photo in photos
+                   for key in keys_by_id.get(photo['id'], ())]
+        dropped = set(self.inventory.photoset_members(photoset['id']))
+        dropped.difference_update(members)
+        self.inventory.set_photoset_members(photoset['id'], members)
+        return dropped
+
+    def _save_photos(self, photos, known_hashes=None):
+        """Save the photos having a key.
+
+        :param known_hashes: (key, id) to content hash of the photos
+                             without one in their description.
+        :type known_hashes: dict.
+        :returns: dict -- photo id to keys of the saved photos.
+        """
+        known_hashes = known_hashes or {}
+        rows = []
         for photo in photos:
-            photo_key = self.find_key_from_desc(photo['description']['_content'])
-            if photo_key is not None and photo_key not in self.album_cache:
-                self.photo_cache[photo_key] = photo
+            desc = photo['description']['_content']
+            photo_key = self.find_key_from_desc(desc)
+            if photo_key is not None:
+                content_hash = self.find_hash_from_desc(desc)
+                if content_hash is None:
+                    content_hash = known_hashes.get((photo_key, photo['id']))
+                rows.append((photo_key,
+                             photo['id'],
+                             photo['title'],
+                             content_hash))
+
+        self.inventory.save_photos(rows)
+        return {row[1]: [row[0]] for row in rows}
 
     def photo_exists(self, photo):
-        return photo.key in self.photo_cache
+        with self.cache_lock:
+            return photo.key in self.photo_cache
 
     def get_photo_id(self, photo):
-        return self.photo_cache[photo.key]['id']
+        with self.cache_lock:
+            return self.photo_cache[photo.key]['id']
 
     def album_exists(self, album):
-        return album.key in self.album_cache
+        with self.cache_lock:
+            return album.key in self.album_cache
 
     def get_album_id(self, album):
-        return self.album_cache[album.key]['id']
+        with self.cache_lock:
+            return self.album_cache[album.key]['id']
 
     def photo_in_album_exists(self, photo):
-        return photo.key in self.photo_in_album_cache
+        with self.cache_lock:
+            return photo.key in self.photo_in_album_cache
+
+    def file_progress(self):
+        """Byte counter of one upload, None without progress."""
+        if self.progress is None:
+            return None
+        return self.progress.file()
+
+    def size_to_upload(self, photo):
+        """Size of the file of a photo, None if it is already uploaded."""
+        if self.photo_exists(photo):
+            return None
+        return photo_size(photo)
+
+    def is_large(self, photo):
+        """Whether a photo goes in the large file lane."""
+        if is_video(photo.filename):
+            return True
+        return self.large_file_size is not None and \
+            photo_size(photo) >= self.large_file_size
+
+    def upload_attempts(self, photo):
+        """Upload timeout and number of attempts of a photo.
+
+        :returns: tuple -- The timeout, None for the default one, and the
+                  number of attempts.
+        """
+        if self.is_large(photo):
+            return self.large_upload_timeout, 1 + self.large_upload_retries
+        return None, 1
+
+    def retry_delay(self, photo, attempt, error):
+        """Log a failed attempt and get the time to wait before the next
+        one."""
+        delay = self.RETRY_DELAY * 2 ** attempt
+        self.logger.warning("Upload of '%s' failed (%s), retry in %ss",
+                            photo.title,
+                            error,
+                            delay)
+        return delay
+
+    def upload_photo(self, photo, ticket=None):
+        """Upload a photo, retrying the large ones.
+
+        An upload failing after its file was sent may have reached Flickr,
+        it is only made again if the photo is not found, see
+        find_uploaded.
+
+        :param ticket: whether to upload with a ticket, by default when
+                       upload tickets are on.
+        :type ticket: bool.
+        :returns: bool -- False when the photo id is to come from an upload
+                  ticket.
+        """
+        timeout, attempts = self.upload_attempts(photo)
+        for attempt in range(attempts):
+            started = time.time()
+            try:
+                return self.upload_photo_once(photo, timeout, ticket=ticket)
+            except self.flickrAPI.TRANSIENT_ERRORS as e:
+                if attempt + 1 == attempts:
+                    raise
+                if self.stop_event.wait(self.retry_delay(photo, attempt, e)):
+                    raise
+                if not self.flickrAPI.request_not_sent(e) and \
+                        self.find_uploaded(photo, started):
+                    return True
+
+    def find_uploaded(self, photo, since):
+        """Look on Flickr for an upload of photo whose answer was lost.
+
+        :param since: time the upload started.
+        :type since: float.
+        :returns: bool -- True when found, the photo is then recorded as
+                  uploaded.
+        """
+        # a minute of margin between the clocks
+        remote_photos = self.flickrAPI.search_photos(
+                                {
+                                    'user_id': 'me',
+                                    'min_upload_date': int(since) - 60
+                                },
+                                extras={'description'})
+        for remote_photo in remote_photos:
+            desc = remote_photo['description']['_content']
+            if self.find_key_from_desc(desc) == photo.key:
+                self.logger.info("Photo '%s' was uploaded before the error",
+                                 photo.title)
+                self.photo_uploaded(photo, remote_photo['id'])
+                return True
+        return False
+
+    def upload_photo_once(self, photo, timeout=None, ticket=None):
+        desc = self.generate_desc(photo.key, photo.content_hash)
+        if ticket is None:
+            ticket = self.ticket_poller is not None
+
+        filename = photo.filename
+        if self.transcoder is not None:
+            filename = self.transcoder.upload_file(photo, photo_size(photo))
+        file_progress = self.file_progress()
+        try:
+            result = self.flickrAPI.upload_photo(
+                    filename,
+                    title=photo.title,
+                    desc=desc,
+                    tags=self.tags,
+                    progress=file_progress,
+                    timeout=timeout,
+                    ticket=ticket)
+            self.count_transcoded(photo, filename, file_progress)
+        except Exception:
+            if file_progress is not None:
+                file_progress.cancel()
+            raise
+        finally:
+            if self.transcoder is not None:
+                self.transcoder.done(photo)
+        if 'ticketid' in result:
+            self.ticket_poller.add(result['ticketid'], photo)
+            return False
+        self.photo_uploaded(photo, result['photoid'])
+        return True
+
+    def ticket_done(self, photo, photo_id):
+        """Finish a photo once Flickr processed its upload."""
+        self.photo_uploaded(photo, photo_id)
+        self.process_album(photo)
+
+    def count_transcoded(self, photo, filename, file_progress):
+        """Count the bytes saved by the transcoding of an uploaded photo as
+        done, the totals of the run being the original sizes."""
+        if file_progress is not None and filename != photo.filename:
+            file_progress(photo_size(photo) - os.path.getsize(filename))
+
+    def photo_uploaded(self, photo, photo_id):
+        """Record an uploaded photo in the caches, the inventory and the
+        journal."""
+        with self.cache_lock:
+            self.photo_cache[photo.key] = {
+                'id': photo_id,
+                'title': photo.title,
+                'hash': photo.content_hash
+            }
+            if photo.content_hash is not None:
+                self.hash_cache[photo.content_hash] = photo.key
+        self.inventory.save_photo(photo.key,
+                                  photo_id,
+                                  photo.title,
+                                  photo.content_hash)
+        if self.journal is not None:
+            self.journal.uploaded(photo.key,
+                                  photo_id,
+                                  photo.title,
+                                  photo.content_hash)
+        if self.progress is not None:
+            self.progress.photo_done(photo)
+
+    def relink_known_content(self, photos):
+        """Match the photos missing remotely with the remote content by
+        hash, so that moved or renamed files are not uploaded again."""
+        self.apply_known_content(self.match_known_content(photos))
+
+    def match_known_content(self, photos):
+        """Find the photos missing remotely whose content is known under
+        another key.
+
+        A remote photo whose old key is not found locally anymore is to be
+        re-keyed. If the old file is still there, the new one is only to be
+        linked to the same remote photo. Nothing is changed on Flickr, but
+        the photos uploaded without a content hash get the one of their
+        local file in the inventory, so that they are found once moved.
+
+        :returns: list -- (photo, old key, rekey) tuples.
+        """
+        missing = []
+        unhashed = []
+        with self.cache_lock:
+            for photo in photos:
+                remote_photo = self.photo_cache.get(photo.key)
+                if remote_photo is None:
+                    missing.append(photo)
+                elif remote_photo['hash'] is None:
+                    unhashed.append(photo)
+        if not (missing or unhashed):
+            return []
+        self.logger.info('hash %s photos missing remotely, %s uploaded '
+                         'without hash', len(missing), len(unhashed))
+        hash_photos(missing + unhashed, workers=self.hash_workers)
+        self.save_hashes(unhashed)
+
+        local_keys = {photo.key for photo in photos}
+        matches = []
+        for photo in missing:
+            with self.cache_lock:
+                old_key = self.hash_cache.get(photo.content_hash)
+            if old_key is None or old_key == photo.key:
+                continue
+            matches.append((photo, old_key, old_key not in local_keys))
+        return matches
+
+    def save_hashes(self, photos):
+        """Record the content hash of uploaded photos, whose description
+        does not have it, in the caches and the inventory."""
+        rows = []
+        with self.cache_lock:
+            for photo in photos:
+                remote_photo = self.photo_cache[photo.key]
+                remote_photo['hash'] = photo.content_hash
+                self.hash_cache.setdefault(photo.content_hash, photo.key)
+                rows.append((photo.key,
+                             remote_photo['id'],
+                             remote_photo['title'],
+                             photo.content_hash))
+        self.inventory.save_photos(rows)
+
+    def apply_known_content(self, matches):
+        """Re-key or share the remote photos found by match_known_content.
+        """
+        nb_rekeyed = 0
+        nb_linked = 0
+        for photo, old_key, rekey in matches:
+            with self.cache_lock:
+                remote_photo = self.photo_cache.get(old_key)
+                if remote_photo is None:
+                    # already re-keyed, by a resumed run
+                    continue
+                remote_photo = dict(remote_photo)
+            if not rekey:
+                nb_linked += 1
+            else:
+                self.rekey_photo(photo, old_key, remote_photo)
+                remote_photo['title'] = photo.title
+                nb_rekeyed += 1
 
-    def upload_photo(self, photo):
-        desc = self.generate_desc(photo.key)
+            with self.cache_lock:
+                self.photo_cache[photo.key] = remote_photo
+            self.inventory.save_photo(photo.key,
+                                      remote_photo['id'],
+                                      remote_photo['title'],
+                                      photo.content_hash)
+            if self.journal is not None:
+                self.journal.uploaded(photo.key,
+                                      remote_photo['id'],
+                                      remote_photo['title'],
+                                      photo.content_hash)
 
-        result = self.flickrAPI.upload_photo(
-                photo.filename,
-                title=photo.title,
-                desc=desc,
-                tags=self.tags)
+        self.logger.info('content hash: %s photos re-keyed, '
+                         '%s linked to the same content',
+                         nb_rekeyed,
+                         nb_linked)
 
-        self.photo_cache[photo.key] = {
-            'id': result['photoid'],
-            'title': photo.title,
-            'description': desc
-        }
+    def rekey_photo(self, photo, old_key, remote_photo):
+        """Give the key of photo to the remote photo of old_key, taking it
+        out of its old album."""
+        self.logger.info("Re-key photo: '%s' to '%s'",
+                         old_key,
+                         photo.key)
+        self.flickrAPI.set_photo_meta(
+            remote_photo['id'],
+            photo.title,
+            self.generate_desc(photo.key, photo.content_hash))
+        with self.cache_lock:
+            del self.photo_cache[old_key]
+            self.hash_cache[photo.content_hash] = photo.key
+            old_album_key = self.photo_in_album_cache.pop(old_key, None)
+            old_album = self.album_cache.get(old_album_key)
+        self.inventory.remove_photo(old_key)
+        if old_album is None:
+            return
+        if photo.album is not None and photo.album.key == old_album_key:
+            # still in the same album
+            with self.cache_lock:
+                self.photo_in_album_cache[photo.key] = old_album_key
+            self.inventory.add_photoset_member(old_album['id'], photo.key)
+        else:
+            self.logger.info("Remove photo '%s' from album '%s'",
+                             photo.title,
+                             old_album['title'])
+            self.flickrAPI.remove_photo_from_photoset(old_album['id'],
+                                                      remote_photo['id'])
 
     def create_album(self, album, photo):
         desc = self.generate_desc(album.key)
@@ -121,94 +615,505 @@ class FlickrUploader(object):
                                 album.title,
                                 self.get_photo_id(photo),
                                 desc=desc)
-        self.album_cache[album.key] = {
-            'id': photoset['id'],
-            'title': album.title,
-            'description': desc
-        }
-        self.photo_in_album_cache[photo.key] = album.key
+        self.album_created(album, photo, photoset['id'])
+
+    def album_created(self, album, photo, photoset_id):
+        """Record a created album in the caches, the inventory and the
+        journal."""
+        with self.cache_lock:
+            self.album_cache[album.key] = {
+                'id': photoset_id,
+                'title': album.title
+            }
+            self.photo_in_album_cache[photo.key] = album.key
+        # no update date, the photoset is listed again on the next refresh
+        self.inventory.save_photoset(photoset_id, album.key, album.title,
+                                     None, 1)
+        self.inventory.add_photoset_member(photoset_id, photo.key)
+        if self.journal is not None:
+            self.journal.album_created(album.key,
+                                       photoset_id,
+                                       album.title,
+                                       photo.key)
 
     def add_photo_to_album(self, photo):
         self.logger.info('link photo %s to album %s',
                          photo.title, photo.album.title)
-        self.flickrAPI.add_photo_to_photoset(self.get_album_id(photo.album),
-                                             self.get_photo_id(photo))
+        try:
+            self.flickrAPI.add_photo_to_photoset(
+                self.get_album_id(photo.album),
+                self.get_photo_id(photo))
+        except FlickrAPIError as e:
+            if e.code == FlickrAPI.PHOTO_ALREADY_IN_SET:
+                # linked under the key of another copy of the photo
+                pass
+            elif e.code == FlickrAPI.PHOTOSET_PHOTO_NOT_FOUND:
+                self.upload_deleted_photo(photo)
+                self.flickrAPI.add_photo_to_photoset(
+                    self.get_album_id(photo.album),
+                    self.get_photo_id(photo))
+            else:
+                raise
+        self.photo_linked(photo)
+
+    def photo_deleted(self, photo):
+        """Forget a photo deleted on Flickr, in the caches and the
+        inventory."""
+        with self.cache_lock:
+            remote_photo = self.photo_cache.pop(photo.key, None)
+            self.photo_in_album_cache.pop(photo.key, None)
+            if remote_photo is not None and \
+                    self.hash_cache.get(remote_photo['hash']) == photo.key:
+                del self.hash_cache[remote_photo['hash']]
+        self.inventory.remove_photo(photo.key)
+
+    def upload_deleted_photo(self, photo):
+        """Upload again a photo found deleted on Flickr while linking it.
+
+        The upload does not use a ticket, the photo id is needed at once.
+        """
+        self.logger.warning("Photo '%s' was deleted on Flickr, upload it "
+                            "again", photo.title)
+        self.photo_deleted(photo)
+        self.upload_photo(photo, ticket=False)
+
+    def queue_link(self, photo):
+        """Queue a photo to add to its existing album.
+
+        :returns: list -- The queued photos of the album to link now once
+                  link_batch_size photos are queued, None otherwise.
+        """
+        with self.cache_lock:
+            batch = self.pending_links.setdefault(photo.album.key, [])
+            batch.append(photo)
+            if len(batch) < self.link_batch_size:
+                return None
+            del self.pending_links[photo.album.key]
+            return batch
+
+    def flush_links(self):
+        """Add the queued photos to their albums."""
+        with self.cache_lock:
+            pending = self.pending_links
+            self.pending_links = {}
+
+        # albums are linked in parallel, one call after the other for each
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            list(executor.map(lambda batch: self.link_photos(batch[0].album,
+                                                             batch),
+                              pending.values()))
+
+        if self.nb_links:
+            self.logger.info('links: %s photos linked in %s calls '
+                             '(%s round trips saved)',
+                             self.nb_links,
+                             self.nb_link_calls,
+                             self.nb_links - self.nb_link_calls)
+
+    def link_photos(self, album, photos):
+        """Add photos to an existing album.
+
+        Under bulk_link_threshold photos, they are added one by one.
+        Otherwise the photoset members are listed and the photoset is edited
+        with the merged list, in one call.
+        """
+        if self.bulk_link_threshold is None or \
+                len(photos) < self.bulk_link_threshold:
+            for photo in photos:
+                self.add_photo_to_album(photo)
+            nb_calls = len(photos)
+        else:
+            self.logger.info("Link %s photos to album: '%s'",
+                             len(photos),
+                             album.title)
+            photoset_id = self.get_album_id(album)
+            primary_photo_id = None
+            photo_ids = []
+            for photo in self.flickrAPI.get_photoset_photos(photoset_id):
+                photo_ids.append(photo['id'])
+                if str(photo.get('isprimary')) == '1':
+                    primary_photo_id = photo['id']
+
+            try:
+                self.edit_album(photoset_id, primary_photo_id, photo_ids,
+                                photos)
+            except FlickrAPIError as e:
+                if e.code != FlickrAPI.PHOTOSET_PHOTO_NOT_FOUND:
+                    raise
+                # the listed members are there, some photos to add are not
+                for photo in photos:
+                    if not self.flickrAPI.photo_exists(
+                            self.get_photo_id(photo)):
+                        self.upload_deleted_photo(photo)
+                self.edit_album(photoset_id, primary_photo_id, photo_ids,
+                                photos)
+            for photo in photos:
+                self.photo_linked(photo)
+            # listing pages and the edit
+            nb_calls = -(-len(photo_ids) // FlickrAPI.MAX_PER_PAGE) + 1
+
+        with self.cache_lock:
+            self.nb_links += len(photos)
+            self.nb_link_calls += nb_calls
+
+    def edit_album(self, photoset_id, primary_photo_id, photo_ids, photos):
+        """Set the members of a photoset to photo_ids and the photos not
+        in them yet."""
+        photo_ids = list(photo_ids)
+        known_ids = set(photo_ids)
+        for photo in photos:
+            if self.get_photo_id(photo) not in known_ids:
+                photo_ids.append(self.get_photo_id(photo))
+        if primary_photo_id is None:
+            primary_photo_id = photo_ids[0]
+        self.flickrAPI.edit_photoset_photos(photoset_id,
+                                            primary_photo_id,
+                                            photo_ids)
+
+    def photo_linked(self, photo):
+        """Record a photo added to its album in the caches, the inventory
+        and the journal."""
+        with self.cache_lock:
+            self.photo_in_album_cache[photo.key] = photo.album.key
+        self.inventory.add_photoset_member(self.get_album_id(photo.album),
+                                           photo.key)
+        if self.journal is not None:
+            self.journal.linked(photo.key, photo.album.key)
 
-    def upload(self, photos):
+    def replay_journal(self, entries):
+        """Apply the steps recorded by an interrupted run to the caches and
+        the inventory."""
+        for entry in entries:
+            step = entry['step']
+            if step == self.journal.UPLOADED:
+                with self.cache_lock:
+                    self.photo_cache[entry['photo_key']] = {
+                        'id': entry['photo_id'],
+                        'title': entry['title'],
+                        'hash': entry['content_hash']
+                    }
+                    if entry['content_hash'] is not None:
+                        self.hash_cache[entry['content_hash']] = \
+                            entry['photo_key']
+                self.inventory.save_photo(entry['photo_key'],
+                                          entry['photo_id'],
+                                          entry['title'],
+                                          entry['content_hash'])
+            elif step == self.journal.ALBUM_CREATED:
+                with self.cache_lock:
+                    self.album_cache[entry['album_key']] = {
+                        'id': entry['photoset_id'],
+                        'title': entry['title']
+                    }
+                    self.photo_in_album_cache[entry['photo_key']] = \
+                        entry['album_key']
+                self.inventory.save_photoset(entry['photoset_id'],
+                                             entry['album_key'],
+                                             entry['title'],
+                                             None,
+                                             1)
+                self.inventory.add_photoset_member(entry['photoset_id'],
+                                                   entry['photo_key'])
+            elif step == self.journal.LINKED:
+                with self.cache_lock:
+                    self.photo_in_album_cache[entry['photo_key']] = \
+                        entry['album_key']
+                    album = self.album_cache.get(entry['album_key'])
+                if album is not None:
+                    self.inventory.add_photoset_member(album['id'],
+                                                       entry['photo_key'])
+        self.logger.info('resumed %s steps from the journal', len(entries))
+
+    def request_stop(self):
+        """Stop scheduling photos, the ones being uploaded are finished."""
+        self.logger.info('Stop requested, finishing the running uploads')
+        self.stop_event.set()
+
+    def upload(self, photos, full_sync=False):
+        self.execute(self.plan_upload(photos, full_sync=full_sync))
+
+    def load_remote_state(self, full_sync=False):
+        """Load the caches from the inventory, refreshed from Flickr, and
+        the steps of an interrupted run."""
+        self.logger.info('Load user flickr data')
+        journal_entries = []
+        if self.journal is not None:
+            journal_entries = self.journal.read()
+        # an interrupted run resumes from the inventory and the journal
+        # without listing the remote library again
+        self.init_cache(full_sync=full_sync, refresh=not journal_entries)
+        if journal_entries:
+            self.replay_journal(journal_entries)
+
+    def plan_upload(self, photos, full_sync=False, match_content=True):
+        """Load the remote state and plan the upload of photos, nothing is
+        uploaded.
+
+        :param match_content: with content_hash, hash the photos to find
+                              the moved and copied ones.
+        :type match_content: bool.
+        :returns: SyncPlan -- The steps left to do.
+        """
         if not photos:
-            self.logger.info('Nothing to upload')
+            return SyncPlan()
+        self.load_remote_state(full_sync=full_sync)
+        return SyncPlanner(self, match_content=match_content).plan(photos)
+
+    def execute(self, plan):
+        """Run a plan, made on the remote state loaded in the caches.
+
+        Each photo of the plan is processed as by ``process_photo``, the
+        steps already done since the plan was made are skipped.
+        """
+        if not self.start_plan(plan):
             return
 
-        self.logger.info('Load user flickr data')
-        self.init_cache()
+        photos = plan.photos_to_process()
+        failed = True
+        try:
+            try:
+                if self.workers > 1 or any(self.in_large_lane(photo)
+                                           for photo in photos):
+                    self.upload_concurrently(photos)
+                else:
+                    if self.transcoder is not None:
+                        # transcode the next photos while one is uploaded
+                        photos = self.transcoder.ahead(
+                                            photos,
+                                            self.transcoder.workers,
+                                            self.size_to_upload)
+                    for photo in photos:
+                        if self.stop_event.is_set():
+                            break
+                        self.process_photo(photo)
+            finally:
+                self.end_run()
+            failed = False
+        finally:
+            self.finish_progress(failed)
+
+        self.finish_upload()
 
-        stats = self.compute_upload_stats(photos)
+    def end_run(self):
+        """Wait for the pending tickets, link the queued photos and stop
+        the transcoder, even when the run failed."""
+        try:
+            if self.ticket_poller is not None:
+                # the photos of the pending tickets still need their album
+                self.ticket_poller.close()
+        finally:
+            try:
+                try:
+                    self.create_waiting_albums()
+                finally:
+                    self.flush_links()
+            finally:
+                # a photo deleted on Flickr is uploaded again when linked
+                if self.transcoder is not None:
+                    self.transcoder.close()
 
-        def format_size(size):
-            return bitmath.Byte(size) \
-                          .best_prefix().format('{value:.2f} {unit}')
+    def start_plan(self, plan):
+        """Log what is left to do and re-key the photos known by content.
 
-        self.logger.info('stats: photos %s/%s (%s/%s) album %s/%s' % (
+        :returns: bool -- False when there is nothing to do.
+        """
+        stats = plan.totals
+        if stats['nb_photos'] == 0:
+            self.logger.info('Nothing to upload')
+            return False
+
+        self.logger.info('stats: photos %s/%s (%s/%s) album %s/%s '
+                         'link %s' % (
                          stats['nb_photos_to_upload'],
                          stats['nb_photos'],
                          format_size(stats['size_photos_to_upload']),
                          format_size(stats['size_photos']),
                          stats['nb_album_to_create'],
-                         stats['nb_album']))
+                         stats['nb_album'],
+                         stats['nb_photos_to_link']))
 
-        if stats['nb_photos_to_upload'] == 0:
+        # photos uploaded by an interrupted run may still need their album
+        if plan.is_empty():
+            if self.journal is not None:
+                self.journal.clear()
             self.logger.info('Nothing to upload')
+            return False
+
+        if plan.known_content:
+            self.apply_known_content([
+                (plan.photos[key], old_key, rekey)
+                for key, old_key, rekey in plan.known_content])
+
+        # the albums are created with the primary photo of the plan, even
+        # when other photos are uploaded first
+        with self.cache_lock:
+            self.album_primaries = dict(plan.albums)
+            self.waiting_for_album = {}
+
+        self.logger.info('Start uploading')
+        if self.progress is not None:
+            self.progress.start(stats)
+        return True
+
+    def finish_progress(self, failed=False):
+        """Send the 'done' progress event, whether the run succeeded, was
+        interrupted or failed."""
+        if self.progress is not None:
+            self.progress.finish(interrupted=self.stop_event.is_set(),
+                                 failed=failed)
+
+    def finish_upload(self):
+        if self.stop_event.is_set():
+            self.logger.info('Upload interrupted, the next run resumes it')
             return
-        else:
-            self.logger.info('Start uploading')
 
-        for photo in photos:
-            if not self.photo_exists(photo):
-                photo_size = os.path.getsize(photo.filename)
-                self.logger.info("Uploading photo: '%s' (%s)",
-                                 photo.title,
-                                 format_size(photo_size))
-
-                self.upload_photo(photo)
-            if photo.album is not None:
+        if self.journal is not None:
+            self.journal.clear()
+        self.logger.info('Done uploading')
+
+    def process_photo(self, photo):
+        """Upload a photo if needed, then create or link its album."""
+        if not self.photo_exists(photo):
+            size = photo_size(photo)
+            self.logger.info("Uploading photo: '%s' (%s)",
+                             photo.title,
+                             format_size(size))
+
+            if not self.upload_photo(photo):
+                # the album steps wait for the upload ticket
+                return
+        self.process_album(photo)
+
+    def wait_for_primary(self, photo):
+        """Whether the missing album of photo is to be created with another
+        photo, its primary in the plan. The photo is then linked once the
+        album is created.
+
+        :returns: bool -- True when the photo waits for the album.
+        """
+        with self.cache_lock:
+            primary = self.album_primaries.get(photo.album.key)
+            if primary is None or primary == photo.key:
+                return False
+            self.waiting_for_album.setdefault(photo.album.key,
+                                              []).append(photo)
+            return True
+
+    def photos_waiting_for(self, album):
+        """Take the photos waiting for an album just created."""
+        with self.cache_lock:
+            self.album_primaries.pop(album.key, None)
+            return self.waiting_for_album.pop(album.key, [])
+
+    def create_waiting_albums(self):
+        """Create the albums whose primary photo did not, with the first
+        photo waiting for them, and link the others."""
+        with self.cache_lock:
+            waiting = self.waiting_for_album
+            self.waiting_for_album = {}
+            self.album_primaries = {}
+        for photos in waiting.values():
+            for photo in photos:
+                self.process_album(photo)
+
+    def process_album(self, photo):
+        """Create the album of an uploaded photo, or link the photo to
+        it."""
+        if photo.album is not None:
+            # The primary photo of an album creates it, the others wait for
+            # the creation before being linked.
+            with self.album_locks.get(photo.album.key):
                 if not self.album_exists(photo.album):
+                    if self.wait_for_primary(photo):
+                        return
                     self.logger.info("Create album: '%s' with photo '%s'",
                                      photo.album.title,
                                      photo.title)
                     self.create_album(photo.album, photo)
+                    waiting = self.photos_waiting_for(photo.album)
+                    if waiting:
+                        self.link_photos(photo.album, waiting)
                 elif not self.photo_in_album_exists(photo):
                     self.logger.info("Link album: '%s' with photo '%s'",
                                      photo.album.title,
                                      photo.title)
-                    self.add_photo_to_album(photo)
+                    if self.bulk_link_threshold is None:
+                        self.link_photos(photo.album, [photo])
+                    else:
+                        batch = self.queue_link(photo)
+                        if batch is not None:
+                            self.link_photos(photo.album, batch)
 
-        self.logger.info('Done uploading')
+    def in_large_lane(self, photo):
+        return not self.photo_exists(photo) and self.is_large(photo)
+
+    def upload_concurrently(self, photos):
+        """Process photos on a pool of workers.
+
+        At most ``2 * workers`` photos are queued at a time and, when
+        ``max_inflight_bytes`` is set, the size of the files being uploaded
+        is bounded too. The large files are uploaded on their own pool of
+        ``large_workers``, beside the others. The first error stops the
+        scheduling of new photos and is raised once the running ones are
+        done.
+        """
+        self.logger.info('Uploading with %s workers', self.workers)
+        budget = None
+        if self.max_inflight_bytes is not None:
+            budget = ByteBudget(self.max_inflight_bytes)
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        errors = []
+
+        def process(photo):
+            try:
+                self.process_photo(photo)
+            except Exception as e:
+                self.logger.exception("Failed to process photo '%s'",
+                                      photo.title)
+                errors.append(e)
 
-    def compute_upload_stats(self, photos):
-        nb_photos_to_upload = 0
-        size_photos = 0
-        size_photos_to_upload = 0
-        nb_album_to_create = 0
-        uniq_album = {}
+        def run(photo, size):
+            try:
+                process(photo)
+            finally:
+                if budget is not None:
+                    budget.release(size)
+                slots.release()
 
+        def run_large(photo):
+            # queued at once, they are skipped once the run stops
+            if not (errors or self.stop_event.is_set()):
+                process(photo)
+
+        large = []
+        small = []
         for photo in photos:
-            size = os.path.getsize(photo.filename)
-            size_photos += size
-            if not self.photo_exists(photo):
-                nb_photos_to_upload += 1
-                size_photos_to_upload += size
-
-            if photo.album is not None:
-                uniq_album[photo.album.key] = photo.album
-        for key, album in uniq_album.items():
-            if not self.album_exists(album):
-                nb_album_to_create += 1
-
-        return {
-            'nb_photos': len(photos),
-            'size_photos': size_photos,
-            'nb_photos_to_upload': nb_photos_to_upload,
-            'size_photos_to_upload': size_photos_to_upload,
-            'nb_album': len(uniq_album),
-            'nb_album_to_create': nb_album_to_create
-        }
+            if self.in_large_lane(photo):
+                large.append(photo)
+            else:
+                small.append(photo)
+        if large:
+            self.logger.info('Uploading %s large files with %s workers',
+                             len(large),
+                             self.large_workers)
+
+        with ThreadPoolExecutor(max_workers=self.large_workers) \
+                as large_executor, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for photo in large:
+                large_executor.submit(run_large, photo)
+            for photo in small:
+                if errors or self.stop_event.is_set():
+                    break
+                size = self.size_to_upload(photo)
+                slots.acquire()
+                if budget is not None:
+                    budget.acquire(size or 0)
+                if self.transcoder is not None and size is not None:
+                    # the queued photos are transcoded while the workers
+                    # upload the previous ones
+                    self.transcoder.start(photo, size, ahead=True)
+                executor.submit(run, photo, size or 0)
+
+        if errors:
+            raise errors[0]
@@ -0,0 +1,244 @@
+"""
+.. module:: inventory
+   :platform: Unix, Windows
+   :synopsis: Keep the remote Flickr state between runs.
+
+"""
+import logging
+import sqlite3
+import threading
+
+
+class RemoteInventory(object):
+    """SQLite store of the photos, photosets and photoset members known on
+    Flickr.
+
+    With the default ``':memory:'`` path the inventory only lives for the
+    run, otherwise it is kept on disk and refreshed incrementally.
+    """
+
+    SCHEMA_VERSION = 2
+
+    SCHEMA = [
+        """CREATE TABLE photo (
+            key TEXT PRIMARY KEY,
+            id TEXT NOT NULL,
+            title TEXT,
+            hash TEXT
+        )""",
+        """CREATE TABLE photoset (
+            id TEXT PRIMARY KEY,
+            key TEXT,
+            title TEXT,
+            date_update TEXT,
+            nb_items INTEGER
+        )""",
+        """CREATE TABLE photoset_member (
+            photoset_id TEXT NOT NULL,
+            photo_key TEXT NOT NULL,
+            PRIMARY KEY (photoset_id, photo_key)
+        )""",
+        """CREATE TABLE meta (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        )"""
+    ]
+
+    def __init__(self, path=':memory:'):
+        """Open or create the inventory.
+
+        :param path: SQLite database file.
+        :type path: str.
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self._init_schema()
+
+    def _init_schema(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == self.SCHEMA_VERSION:
+            return
+        if version != 0:
+            self.logger.info('inventory schema changed, resetting %s',
+                             self.path)
+        with self.connection:
+            for table in ('photo', 'photoset', 'photoset_member', 'meta'):
+                self.connection.execute('DROP TABLE IF EXISTS %s' % table)
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+            self.connection.execute('PRAGMA user_version = %d' %
+                                    self.SCHEMA_VERSION)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    ######################
+    # Sync state
+    ######################
+
+    @property
+    def last_sync(self):
+        """Time of the last refresh, None if the inventory was never
+        synced."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE name = 'last_sync'").fetchone()
+        return float(row[0]) if row is not None else None
+
+    def set_last_sync(self, timestamp):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('last_sync', ?)",
+                (repr(timestamp),))
+
+    def clear(self):
+        with self.lock, self.connection:
+            for table in ('photo', 'photoset', 'photoset_member', 'meta'):
+                self.connection.execute('DELETE FROM %s' % table)
+
+    ######################
+    # Photo
+    ######################
+
+    def save_photos(self, photos):
+        """Save photos.
+
+        :param photos: (key, id, title, content hash) tuples.
+        :type photos: iterable.
+
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO photo VALUES (?, ?, ?, ?)', photos)
+
+    def save_photo(self, key, photo_id, title, content_hash=None):
+        self.save_photos([(key, photo_id, title, content_hash)])
+
+    def photo_keys_by_id(self):
+        """Get the keys of the known photos.
+
+        :returns: dict -- photo id to the list of its keys, a photo shared
+                  by several local files having several.
+
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, key FROM photo').fetchall()
+        keys_by_id = {}
+        for photo_id, key in rows:
+            keys_by_id.setdefault(photo_id, []).append(key)
+        return keys_by_id
+
+    def photo_hashes(self):
+        """Get the content hashes of the known photos.
+
+        :returns: dict -- (photo key, photo id) to content hash.
+
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT key, id, hash FROM photo '
+                'WHERE hash IS NOT NULL').fetchall()
+        return {(key, photo_id): content_hash
+                for key, photo_id, content_hash in rows}
+
+    def remove_photo(self, key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM photoset_member WHERE photo_key = ?', (key,))
+            self.connection.execute('DELETE FROM photo WHERE key = ?',
+                                    (key,))
+
+    ######################
+    # Photoset
+    ######################
+
+    def photosets(self):
+        """Get the known photosets.
+
+        :returns: dict -- photoset id to (date_update, nb_items).
+
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, date_update, nb_items FROM photoset').fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def save_photoset(self, photoset_id, key, title, date_update, nb_items):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO photoset VALUES (?, ?, ?, ?, ?)',
+                (photoset_id, key, title, date_update, nb_items))
+
+    def remove_photoset(self, photoset_id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM photoset_member WHERE photoset_id = ?',
+                (photoset_id,))
+            self.connection.execute('DELETE FROM photoset WHERE id = ?',
+                                    (photoset_id,))
+
+    def photoset_members(self, photoset_id):
+        """Get the keys of the known members of a photoset."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT photo_key FROM photoset_member '
+                'WHERE photoset_id = ?', (photoset_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def set_photoset_members(self, photoset_id, photo_keys):
+        """Replace the members of a photoset."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM photoset_member WHERE photoset_id = ?',
+                (photoset_id,))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO photoset_member VALUES (?, ?)',
+                ((photoset_id, key) for key in photo_keys))
+
+    def add_photoset_member(self, photoset_id, photo_key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO photoset_member VALUES (?, ?)',
+                (photoset_id, photo_key))
+
+    ######################
+    # Caches
+    ######################
+
+    def load(self):
+        """Build the uploader caches.
+
+        :returns: tuple -- photo cache, album cache and photo in album cache.
+
+        """
+        with self.lock:
+            photos = self.connection.execute(
+                'SELECT key, id, title, hash FROM photo').fetchall()
+            photosets = self.connection.execute(
+                'SELECT id, key, title FROM photoset '
+                'ORDER BY rowid').fetchall()
+            # members of a ubm album come last so they win over other sets
+            members = self.connection.execute(
+                'SELECT m.photo_key, s.key FROM photoset_member m '
+                'JOIN photoset s ON s.id = m.photoset_id '
+                'ORDER BY s.key IS NOT NULL').fetchall()
+
+        photo_cache = {
+            key: {'id': photo_id, 'title': title, 'hash': content_hash}
+            for key, photo_id, title, content_hash in photos
+        }
+        album_cache = {}
+        for photoset_id, key, title in photosets:
+            if key is not None and key not in album_cache:
+                album_cache[key] = {'id': photoset_id, 'title': title}
+        photo_in_album_cache = {
+            photo_key: album_key for photo_key, album_key in members
+        }
+        return photo_cache, album_cache, photo_in_album_cache
@@ -0,0 +1,94 @@
+"""
+.. module:: journal
+   :platform: Unix, Windows
+   :synopsis: Append-only log of the completed upload steps.
+
+"""
+import json
+import logging
+import os
+import os.path
+import threading
+
+
+class UploadJournal(object):
+    """Record each completed upload step as a JSON line, flushed to disk
+    before going on, so that an interrupted run can resume from it.
+
+    """
+
+    UPLOADED = 'uploaded'
+    ALBUM_CREATED = 'album_created'
+    LINKED = 'linked'
+
+    def __init__(self, path):
+        """Journal kept in a file.
+
+        :param path: journal file, created on the first record.
+        :type path: str.
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def read(self):
+        """Read the steps recorded by a previous run.
+
+        :returns: list -- The recorded steps, as dicts.
+
+        """
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # the last line is cut if the run died while writing it
+                    self.logger.warning("skip truncated journal entry in "
+                                        "'%s'", self.path)
+        return entries
+
+    def record(self, step, **values):
+        values['step'] = step
+        line = json.dumps(values) + '\n'
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def uploaded(self, photo_key, photo_id, title, content_hash=None):
+        self.record(self.UPLOADED,
+                    photo_key=photo_key,
+                    photo_id=photo_id,
+                    title=title,
+                    content_hash=content_hash)
+
+    def album_created(self, album_key, photoset_id, title, photo_key):
+        self.record(self.ALBUM_CREATED,
+                    album_key=album_key,
+                    photoset_id=photoset_id,
+                    title=title,
+                    photo_key=photo_key)
+
+    def linked(self, photo_key, album_key):
+        self.record(self.LINKED,
+                    photo_key=photo_key,
+                    album_key=album_key)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def clear(self):
+        """Drop the journal once the run is complete."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
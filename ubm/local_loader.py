@@ -6,9 +6,13 @@
 .. moduleauthor:: q12321q <q12321q@gmail.com>
 
 """
+import json
 import logging
 import os
 import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from ubm.photo import Photo
 from ubm.album import Album
 
@@ -17,45 +21,224 @@ class LocalLoader(object):
     """Get images and album from a local file structure.
 
     """
-    def __init__(self, image_file_type):
+
+    MANIFEST_VERSION = 1
+
+    # A directory changed less than this many seconds before the scan may
+    # change again within the same mtime tick, it is not trusted.
+    RACY_DELAY = 2
+
+    def __init__(self, image_file_type, manifest_path=None, scan_workers=1):
         """This function does something.
 
         :param image_file_type: Set of eligible image file extension.
         :type image_file_type: Set.
+        :param manifest_path: File where to keep the scanned directories to
+                              skip the unchanged ones on the next load.
+        :type manifest_path: str.
+        :param scan_workers: Number of directories listed in parallel, for
+                             slow network file systems.
+        :type scan_workers: int.
 
         """
         self.logger = logging.getLogger(__name__)
         self.image_file_type = image_file_type
+        self.manifest_path = manifest_path
+        self.scan_workers = scan_workers
+        self.manifest = None
+        self.nb_dirs_skipped = 0
+        self.nb_dirs_scanned = 0
 
-    def load(self, root_path):
+    def load(self, root_path, namespace=None):
         """Build from the file structure a list of album and photos.
 
-        :param root_path: root directory where to find the image files.
+        :param root_path: root directory where to find the image files, or
+                          a list of them, see load_roots.
         :type root_path: str.
+        :param namespace: prefix of the photo and album keys, to keep apart
+                          the keys of several roots.
+        :type namespace: str.
         :yield: photo -- List of eligible photo linked with a album.
 
         """
+        if not isinstance(root_path, str):
+            return self.load_roots(root_path)
         self.logger.info("load file data for '%s'", root_path)
 
+        self.manifest = self._read_manifest(root_path)
+        self.nb_dirs_skipped = 0
+        self.nb_dirs_scanned = 0
+
+        namespaced = [namespace] if namespace else []
         albums = {}
         photos = []
-        for filename in self._image_files(root_path):
-            self.logger.debug("load file: %s", filename)
-            photo = Photo()
-            photo.key = self._photo_key(filename)
-            photo.title = self._photo_name(filename)
-            photo.filename = os.path.join(root_path, filename)
-            photos.append(photo)
-
-            album_key = self._album_key(filename)
-            if album_key is not None:
+        for reldir, files in self._walk(root_path):
+            # album and key prefix are computed once per directory, with
+            # the same rules as _album_key, _album_name and _photo_key
+            split = self._split_dir(reldir)
+            album = None
+            if len(split) > 0:
+                album_key = '|'.join(namespaced + split)
                 if album_key not in albums:
                     albums[album_key] = Album()
                     albums[album_key].key = album_key
-                    albums[album_key].title = self._album_name(filename)
-                photo.album = albums[album_key]
+                    albums[album_key].title = ', '.join(split)
+                album = albums[album_key]
+            key_prefix = ''.join(part + '|' for part in namespaced + split)
+            dirname = os.path.join(root_path, reldir)
+
+            for name, size, mtime in files:
+                self.logger.debug("load file: %s", os.path.join(reldir, name))
+                photo = Photo()
+                photo.key = key_prefix + name
+                photo.title = self._photo_name(name)
+                photo.filename = os.path.join(dirname, name)
+                photo.album = album
+                photo.size = size
+                photo.mtime = mtime
+                photos.append(photo)
+
+        self.logger.info("scan: %s directories skipped, %s rescanned",
+                         self.nb_dirs_skipped,
+                         self.nb_dirs_scanned)
+        self._write_manifest()
         return photos
 
+    def load_roots(self, roots):
+        """Load several roots into one list of photos, the roots of
+        different devices being scanned in parallel.
+
+        The keys of each root are prefixed by its name, so that the same
+        directories in two roots do not collide.
+
+        :param roots: root directories, either paths named after their base
+                      name, or dicts with a ``path`` and a ``name``, an
+                      empty name keeping the keys of a single root.
+        :type roots: list.
+        :returns: list -- The photos of every root, in the roots order.
+        :raise: IOError: if a root doesn't exist
+        :raise: ValueError: if two roots have the same name, or if a root
+                with an empty name is not the only one
+
+        """
+        roots = [self._root(root) for root in roots]
+        names = [name for path, name in roots]
+        for name in set(names):
+            if names.count(name) > 1:
+                raise ValueError("several roots named '%s'" % name)
+        if '' in names and len(names) > 1:
+            # its keys could be the ones of another root
+            raise ValueError('only a single root can have an empty name')
+
+        # one scanner per device, the roots of a device one after another
+        devices = {}
+        for index, (path, name) in enumerate(roots):
+            if not os.path.isdir(path):
+                raise IOError("folder '%s' not found" % path)
+            devices.setdefault(os.stat(path).st_dev, []).append(index)
+
+        def load_device(indexes):
+            loaded = []
+            for index in indexes:
+                path, name = roots[index]
+                loader = LocalLoader(self.image_file_type,
+                                     manifest_path=self._root_manifest(name),
+                                     scan_workers=self.scan_workers)
+                loaded.append((index, loader.load(path, namespace=name),
+                               loader))
+            return loaded
+
+        results = [None] * len(roots)
+        self.nb_dirs_skipped = 0
+        self.nb_dirs_scanned = 0
+        with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+            for loaded in executor.map(load_device, devices.values()):
+                for index, photos, loader in loaded:
+                    results[index] = photos
+                    self.nb_dirs_skipped += loader.nb_dirs_skipped
+                    self.nb_dirs_scanned += loader.nb_dirs_scanned
+        self.logger.info("%s roots loaded on %s devices",
+                         len(roots), len(devices))
+        return [photo for photos in results for photo in photos]
+
+    @staticmethod
+    def _root(root):
+        """(path, name) of a root of the conf."""
+        if isinstance(root, str):
+            root = {'path': root}
+        path = root['path']
+        name = root.get('name')
+        if name is None:
+            name = os.path.basename(os.path.normpath(os.path.abspath(path)))
+        if '|' in name:
+            raise ValueError("'|' in the root name '%s'" % name)
+        return path, name
+
+    def _root_manifest(self, name):
+        """Manifest file of a root, next to the manifest_path."""
+        if self.manifest_path is None or not name:
+            return self.manifest_path
+        return '%s.%s' % (self.manifest_path, name)
+
+    def invalidate_manifest(self, root_path=None):
+        """Forget the manifest so that the next load scans every directory.
+
+        :param root_path: root directory, or list of roots, whose manifests
+                          are removed too, see load_roots.
+        :type root_path: str.
+
+        """
+        self.manifest = None
+        if self.manifest_path is None:
+            return
+        paths = [self.manifest_path]
+        if root_path is not None and not isinstance(root_path, str):
+            paths.extend(self._root_manifest(name)
+                         for path, name in map(self._root, root_path))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _read_manifest(self, root_path):
+        """Read the manifest of a previous load of the same root path.
+
+        :param root_path: root directory being loaded.
+        :type root_path: str.
+        :returns: dict -- The manifest, without any directory if there is
+                  no usable previous manifest.
+
+        """
+        manifest = {
+            'version': self.MANIFEST_VERSION,
+            'root_path': os.path.abspath(root_path),
+            'file_types': sorted(self.image_file_type),
+            'dirs': {}
+        }
+        if self.manifest_path is None or \
+                not os.path.exists(self.manifest_path):
+            return manifest
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except ValueError:
+            self.logger.warning("ignore corrupted manifest '%s'",
+                                self.manifest_path)
+            return manifest
+
+        if all(previous.get(key) == manifest[key]
+               for key in ('version', 'root_path', 'file_types')):
+            manifest['dirs'] = previous['dirs']
+        return manifest
+
+    def _write_manifest(self):
+        if self.manifest_path is None or self.manifest is None:
+            return
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
     def _image_files(self, root_path):
         """Get eligible image files.
 
@@ -64,16 +247,151 @@ class LocalLoader(object):
         :yield: str -- eligible image files.
         :raise: IOError: if root_path doesn't exist
 
+        """
+        for reldir, files in self._walk(root_path):
+            for name, size, mtime in files:
+                yield os.path.join(reldir, name)
+
+    def _walk(self, root_path):
+        """Walk the tree top-down, like os.walk, listing the directories
+        on ``scan_workers`` threads.
+
+        :param root_path: root directory where to find image files.
+        :type name: str.
+        :yield: tuple -- directory relative to root_path and its eligible
+                files (name, size, mtime).
+        :raise: IOError: if root_path doesn't exist
+
         """
         if not os.path.isdir(root_path):
             raise IOError("folder '%s' not found" % root_path)
-        for root, dirs, files in os.walk(root_path):
-            for file in files:
-                filename, file_extension = os.path.splitext(file)
-                if file_extension is not None and len(file_extension) > 0:
-                    file_extension = file_extension[1:].lower()
-                if file_extension in self.image_file_type:
-                    yield os.path.relpath(os.path.join(root, file), root_path)
+        if self.manifest is None:
+            self.manifest = self._read_manifest(root_path)
+        previous_dirs = self.manifest['dirs']
+        self.manifest['dirs'] = {}
+        scan_time = time.time()
+
+        def scan(reldir):
+            try:
+                return self._scan_dir(root_path,
+                                      reldir,
+                                      previous_dirs.get(reldir),
+                                      scan_time)
+            except OSError as e:
+                # like os.walk, skip the directories that cannot be listed
+                self.logger.warning("cannot scan '%s': %s", reldir, e)
+                return None, False
+
+        executor = None
+        scans = {}
+        scans_lock = threading.Lock()
+
+        if self.scan_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=self.scan_workers)
+
+            def scan_subtree(reldir):
+                # start listing the sub directories before returning so that
+                # the walk below always finds them
+                entry, scanned = scan(reldir)
+                if entry is not None:
+                    with scans_lock:
+                        for name in entry['dirs']:
+                            subdir = os.path.join(reldir, name)
+                            scans[subdir] = executor.submit(scan_subtree,
+                                                            subdir)
+                return entry, scanned
+
+            scans[''] = executor.submit(scan_subtree, '')
+
+        try:
+            pending = ['']
+            while pending:
+                reldir = pending.pop()
+                if executor is not None:
+                    with scans_lock:
+                        future = scans.pop(reldir)
+                    entry, scanned = future.result()
+                else:
+                    entry, scanned = scan(reldir)
+                if entry is None:
+                    continue
+
+                if scanned:
+                    self.nb_dirs_scanned += 1
+                else:
+                    self.nb_dirs_skipped += 1
+                self.manifest['dirs'][reldir] = entry
+                yield reldir, entry['files']
+                # keep the os.walk top-down order
+                pending.extend(os.path.join(reldir, name)
+                               for name in reversed(entry['dirs']))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _scan_dir(self, root_path, reldir, previous, scan_time):
+        """List a directory, unless its manifest entry is still valid.
+
+        :param root_path: root directory being loaded.
+        :type root_path: str.
+        :param reldir: directory to list, relative to root_path.
+        :type reldir: str.
+        :param previous: manifest entry of the directory, or None.
+        :type previous: dict.
+        :returns: tuple -- manifest entry with the directory mtime, its
+                  eligible files (name, size, mtime) and sub directories,
+                  and whether the directory was listed.
+
+        """
+        path = os.path.join(root_path, reldir)
+        mtime = os.stat(path).st_mtime_ns
+        if previous is not None and previous['mtime'] == mtime:
+            # a file rewritten in place keeps the directory mtime, the
+            # files are stat again, which is cheaper than listing them
+            files = []
+            for name, size, file_mtime in previous['files']:
+                try:
+                    stat = os.stat(os.path.join(path, name))
+                except OSError as e:
+                    self.logger.warning("cannot stat '%s': %s",
+                                        os.path.join(reldir, name), e)
+                    continue
+                files.append((name, stat.st_size, stat.st_mtime))
+            return dict(previous, files=files), False
+
+        files = []
+        dirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # a broken link or a file deleted meanwhile is skipped, not
+                # its whole directory
+                try:
+                    if entry.is_dir():
+                        # like os.walk, do not follow links to directories
+                        if not entry.is_symlink():
+                            dirs.append(entry.name)
+                    elif self._is_eligible(entry.name):
+                        stat = entry.stat()
+                        files.append((entry.name,
+                                      stat.st_size,
+                                      stat.st_mtime))
+                except OSError as e:
+                    self.logger.warning("cannot stat '%s': %s",
+                                        os.path.join(reldir, entry.name), e)
+
+        if mtime / 1e9 > scan_time - self.RACY_DELAY:
+            mtime = None
+        return {
+            'mtime': mtime,
+            'files': files,
+            'dirs': dirs
+        }, True
+
+    def _is_eligible(self, name):
+        filename, file_extension = os.path.splitext(name)
+        if file_extension is not None and len(file_extension) > 0:
+            file_extension = file_extension[1:].lower()
+        return file_extension in self.image_file_type
 
     def _split_dir(self, path):
         """Split a file or directory path parts to a list.
@@ -86,8 +404,9 @@ class LocalLoader(object):
         split = []
         while path is not None and path != '':
             head, tail = os.path.split(path)
-            split.insert(0, tail)
+            split.append(tail)
             path = head
+        split.reverse()
         return split
 
     def _album_name(self, filename):
@@ -0,0 +1,175 @@
+"""
+.. module:: metrics
+   :platform: Unix, Windows
+   :synopsis: Count, latency and bytes of the Flickr calls.
+
+"""
+import bisect
+import json
+import logging
+import threading
+
+
+class LatencyHistogram(object):
+    """Latencies counted in buckets growing by ``GROWTH``, so that the
+    memory used does not depend on the number of calls. Percentiles are
+    rounded up to the bound of their bucket, at most 20% above.
+    """
+
+    MIN_LATENCY = 0.001
+    GROWTH = 1.2
+    # up to 15 minutes, above goes in the last bucket
+    BOUNDS = []
+    while not BOUNDS or BOUNDS[-1] < 900:
+        BOUNDS.append(MIN_LATENCY * GROWTH ** len(BOUNDS))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        self.counts[bisect.bisect_left(self.BOUNDS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the percentile, None without
+        any latency."""
+        if self.count == 0:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index == len(self.BOUNDS):
+                    return self.max
+                return min(self.BOUNDS[index], self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class EndpointStats(object):
+
+    __slots__ = ('count', 'errors', 'bytes_sent', 'bytes_received',
+                 'latency')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = LatencyHistogram()
+
+    def report(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'latency': {
+                'mean': self.latency.mean,
+                'p50': self.latency.percentile(50),
+                'p95': self.latency.percentile(95),
+                'p99': self.latency.percentile(99),
+                'max': self.latency.max
+            }
+        }
+
+
+class Metrics(object):
+    """Stats of the calls, per Flickr method and for the uploads.
+
+    Every call is also given to the hooks, as a dict with the
+    ``endpoint``, ``latency`` (seconds), ``error``, ``bytes_sent`` and
+    ``bytes_received`` keys. Hooks run in the calling thread and must be
+    quick.
+    """
+
+    UPLOAD = 'upload'
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self,
+               endpoint,
+               latency,
+               error=False,
+               bytes_sent=0,
+               bytes_received=0):
+        """Record a call.
+
+        :param endpoint: Flickr method, or UPLOAD.
+        :type endpoint: str.
+        :param latency: seconds from the request to the parsed answer.
+        :type latency: float.
+        :param error: the call raised or Flickr answered with an error.
+        :type error: bool.
+
+        """
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.count += 1
+            stats.errors += bool(error)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latency.add(latency)
+
+        if self.hooks:
+            event = {
+                'endpoint': endpoint,
+                'latency': latency,
+                'error': error,
+                'bytes_sent': bytes_sent,
+                'bytes_received': bytes_received
+            }
+            for hook in list(self.hooks):
+                try:
+                    hook(event)
+                except Exception:
+                    # a broken hook must not fail the upload
+                    self.logger.exception('metrics hook failed')
+
+    def report(self):
+        """Stats of each endpoint, and their total under 'total'.
+
+        :returns: dict -- endpoint to stats.
+
+        """
+        with self.lock:
+            report = {endpoint: stats.report()
+                      for endpoint, stats in sorted(self.endpoints.items())}
+            report['total'] = {
+                'count': sum(stats.count
+                             for stats in self.endpoints.values()),
+                'errors': sum(stats.errors
+                              for stats in self.endpoints.values()),
+                'bytes_sent': sum(stats.bytes_sent
+                                  for stats in self.endpoints.values()),
+                'bytes_received': sum(stats.bytes_received
+                                      for stats in self.endpoints.values())
+            }
+        return report
+
+    def write_report(self, path):
+        """Write the report as JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+            f.write('\n')
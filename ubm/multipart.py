@@ -0,0 +1,83 @@
+import mimetypes
+import os.path
+import uuid
+
+
+class MultipartFileBody(object):
+    """Stream a multipart/form-data body made of form fields and one file.
+
+    The file is read in ``chunk_size`` chunks while the body is sent, so the
+    memory used does not depend on the file size. The body length is known
+    up front so that it is sent with a Content-Length header.
+
+    ``progress`` is called with the size of each file chunk as it is handed
+    to the connection, and ``throttle`` before, it can block to bound the
+    upload rate.
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self,
+                 fields,
+                 file_field,
+                 filename,
+                 chunk_size=CHUNK_SIZE,
+                 progress=None,
+                 throttle=None):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.throttle = throttle
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self.file = None
+
+        parts = []
+        for name, value in fields.items():
+            parts.append(self._part_header(name))
+            parts.append(str(value).encode('utf-8'))
+            parts.append(b'\r\n')
+
+        file_type = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        parts.append(self._part_header(file_field,
+                                       os.path.basename(filename),
+                                       file_type))
+        self.head = b''.join(parts)
+        self.tail = ('\r\n--%s--\r\n' % self.boundary).encode('ascii')
+        self.file_size = os.path.getsize(filename)
+
+    def _part_header(self, name, filename=None, content_type=None):
+        header = '--%s\r\nContent-Disposition: form-data; name="%s"' % (
+                    self.boundary, name)
+        if filename is not None:
+            header += '; filename="%s"' % filename.replace('"', '%22')
+        if content_type is not None:
+            header += '\r\nContent-Type: %s' % content_type
+        return (header + '\r\n\r\n').encode('utf-8')
+
+    def __len__(self):
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        self.file = open(self.filename, 'rb')
+        try:
+            while True:
+                chunk = self.file.read(self.chunk_size)
+                if not chunk:
+                    break
+                if self.throttle is not None:
+                    self.throttle(len(chunk))
+                yield chunk
+                if self.progress is not None:
+                    self.progress(len(chunk))
+        finally:
+            self.close()
+        yield self.tail
+
+    def close(self):
+        """Close the file, even if the body was not fully sent."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
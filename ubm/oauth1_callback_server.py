@@ -1,66 +1,113 @@
+"""
+.. module:: oauth1_callback_server
+   :platform: Unix, Windows
+   :synopsis: Local web server receiving the OAuth authorization callback.
+
+"""
 import threading
-from queue import Queue
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
-import requests
-from flask import Flask, request
 
-app = Flask(__name__)
+class OAuthCallbackHandler(BaseHTTPRequestHandler):
 
+    def log_message(self, format, *args):
+        pass
 
-@app.route('/callback')
-def app_route_callback():
-    OAuthCallbackServer.callback_url_queue.put(request.url)
-    return 'ok'
+    def do_GET(self):
+        server = self.server.callback_server
+        if self.path.split('?', 1)[0] != server.path:
+            self._send(404, b'Not found')
+            return
+        self._send(200, b'ok')
+        server.callback_received(self.path)
 
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-@app.route('/ping')
-def app_route_ping():
-    return 'ok'
 
+class OAuthCallbackServer(object):
+    """http.server serving the OAuth callback from a background thread.
 
-@app.route('/shutdown')
-def app_route_shutdown():
-    func = request.environ.get('werkzeug.server.shutdown')
-    if func is None:
-        raise RuntimeError('Not running with the Werkzeug Server')
-    func()
-    return ''
+    ``start`` returns once the server accepts connections and
+    ``wait_for_callback_url`` blocks, without polling, until the user is
+    redirected to the callback.
+    """
 
+    def __init__(self, host='localhost', port=7777, path='/callback'):
+        """Server, listening once started.
 
-class OAuthCallbackServer(object):
+        :param host: interface to listen on.
+        :type host: str.
+        :param port: port to listen on, 0 for any free port.
+        :type port: int.
+        :param path: path of the callback URL.
+        :type path: str.
 
-    callback_url_queue = None
-
-    def __init__(self, host='localhost', port=7777):
+        """
         self.host = host
         self.port = port
-
-    def wait_for_callback_url(self):
-        return OAuthCallbackServer.callback_url_queue.get()
-
-    def start(self):
-        OAuthCallbackServer.callback_url_queue = Queue()
-
-        t = threading.Thread(target=self.start_threaded,
-                             args=(self.host, self.port))
-        t.daemon = True
-        t.start()
-
-        # Ping the server until it's ready
-        ping_url = "http://%s:%s/ping" % (self.host, self.port)
-        while True:
-            try:
-                requests.get(ping_url, timeout=0.5)
-                return
-            except requests.exceptions.ConnectionError:
-                pass
-
-    def start_threaded(self, host, port):
-        app.run(
-          host=host,
-          port=port
-        )
+        self.path = path
+        self.server = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.callback = threading.Event()
+        self.callback_url = None
+
+    def start(self, timeout=5):
+        """Listen and serve from a background thread.
+
+        :param timeout: seconds to wait for the server to be ready.
+        :type timeout: float.
+        :raise: OSError: if the port cannot be listened on
+        :raise: TimeoutError: if the server is not ready in time
+
+        """
+        self.ready.clear()
+        self.callback.clear()
+        self.callback_url = None
+        # the socket listens once bound, before serving
+        self.server = HTTPServer((self.host, self.port), OAuthCallbackHandler)
+        self.server.callback_server = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self._serve,
+                                       name='ubm-oauth-callback',
+                                       daemon=True)
+        self.thread.start()
+        if not self.ready.wait(timeout):
+            self.stop()
+            raise TimeoutError('OAuth callback server not ready after %ss' %
+                               timeout)
+
+    def _serve(self):
+        self.ready.set()
+        self.server.serve_forever(poll_interval=0.1)
+
+    def callback_received(self, path):
+        self.callback_url = 'http://%s:%s%s' % (self.host, self.port, path)
+        self.callback.set()
+
+    def wait_for_callback_url(self, timeout=None):
+        """Wait for the user to be redirected to the callback.
+
+        :param timeout: seconds to wait, forever by default.
+        :type timeout: float.
+        :returns: str -- The callback URL, with the OAuth parameters.
+        :raise: TimeoutError: if no callback came in time
+
+        """
+        if not self.callback.wait(timeout):
+            raise TimeoutError('no OAuth callback after %ss' % timeout)
+        return self.callback_url
 
     def stop(self):
-        shutdown_url = "http://%s:%s/shutdown" % (self.host, self.port)
-        requests.get(shutdown_url)
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.server = None
+        self.thread = None
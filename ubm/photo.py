@@ -1,7 +1,54 @@
+import os.path
+
+# File extensions Flickr accepts
+IMAGE_FILE_TYPES = frozenset({
+    'jpeg',
+    'jpg',
+    'png',
+    'gif'
+})
+
+VIDEO_FILE_TYPES = frozenset({
+    'mp4',
+    'avi',
+    'wmv',
+    'mov',
+    'mpeg',
+    '3gp',
+    'm2ts',
+    'ogg',
+    'ogv'
+})
+
 
 class Photo(object):
+    # millions of photos can be loaded, no per instance __dict__
+    __slots__ = ('title',
+                 'key',
+                 'filename',
+                 'album',
+                 'content_hash',
+                 'size',
+                 'mtime')
+
     def __init__(self):
         self.title = None
         self.key = None
         self.filename = None
         self.album = None
+        self.content_hash = None
+        # from the scan, None when unknown
+        self.size = None
+        self.mtime = None
+
+
+def photo_size(photo):
+    """Size of the photo file, from the scan when known."""
+    if photo.size is None:
+        photo.size = os.path.getsize(photo.filename)
+    return photo.size
+
+
+def is_video(filename):
+    extension = os.path.splitext(filename)[1][1:].lower()
+    return extension in VIDEO_FILE_TYPES
@@ -0,0 +1,262 @@
+"""
+.. module:: plan
+   :platform: Unix, Windows
+   :synopsis: What an upload run has to do, planned before any upload.
+
+"""
+import json
+import logging
+import os
+
+from ubm.album import Album
+from ubm.photo import Photo, photo_size
+
+
+class SyncPlan(object):
+    """Steps of an upload run, made from the local photos and the remote
+    state, which can be saved and executed later.
+
+    - ``uploads``: keys of the photos to upload,
+    - ``albums``: (album key, primary photo key) of the albums to create,
+    - ``links``: keys of the photos to add to their album,
+    - ``known_content``: (photo key, old key, rekey) of the photos found
+      remotely by content hash under another key, the remote photo is
+      re-keyed when ``rekey`` is set, shared otherwise.
+
+    ``steps`` are the keys of the photos to process, in order, and
+    ``photos`` the photos they refer to. ``totals`` counts the photos and
+    albums of the library and the ones left to upload, create or link.
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.photos = {}
+        self.steps = []
+        self.uploads = []
+        self.albums = []
+        self.links = []
+        self.known_content = []
+        self.totals = {
+            'nb_photos': 0,
+            'size_photos': 0,
+            'nb_photos_to_upload': 0,
+            'size_photos_to_upload': 0,
+            'nb_album': 0,
+            'nb_album_to_create': 0,
+            'nb_photos_to_link': 0
+        }
+
+    def _add_step(self, photo):
+        self.photos[photo.key] = photo
+        if not self.steps or self.steps[-1] != photo.key:
+            self.steps.append(photo.key)
+
+    def add_upload(self, photo):
+        self._add_step(photo)
+        self.uploads.append(photo.key)
+
+    def add_album(self, album, photo):
+        self._add_step(photo)
+        self.albums.append((album.key, photo.key))
+
+    def add_link(self, photo):
+        self._add_step(photo)
+        self.links.append(photo.key)
+
+    def add_known_content(self, photo, old_key, rekey):
+        self.photos[photo.key] = photo
+        self.known_content.append((photo.key, old_key, rekey))
+
+    def is_empty(self):
+        return not (self.steps or self.known_content)
+
+    def photos_to_process(self):
+        return [self.photos[key] for key in self.steps]
+
+    def describe(self):
+        """Lines telling what the plan does, for a dry run."""
+        albums = {}
+        for photo in self.photos.values():
+            if photo.album is not None:
+                albums[photo.album.key] = photo.album
+        lines = []
+        for key, old_key, rekey in self.known_content:
+            lines.append("%s '%s' as '%s'" % (
+                'rekey' if rekey else 'share',
+                old_key,
+                key))
+        for key in self.uploads:
+            lines.append("upload '%s' (%s bytes)" % (
+                self.photos[key].filename,
+                self.photos[key].size))
+        for album_key, photo_key in self.albums:
+            lines.append("create album '%s' with '%s'" % (
+                albums[album_key].title,
+                self.photos[photo_key].title))
+        for key in self.links:
+            lines.append("link '%s' to album '%s'" % (
+                self.photos[key].title,
+                self.photos[key].album.title))
+        return lines
+
+    def summary(self):
+        return ('photos to upload: %(nb_photos_to_upload)s/%(nb_photos)s '
+                '(%(size_photos_to_upload)s/%(size_photos)s bytes), '
+                'albums to create: %(nb_album_to_create)s/%(nb_album)s, '
+                'photos to link: %(nb_photos_to_link)s' % self.totals)
+
+    ######################
+    # Serialization
+    ######################
+
+    def to_dict(self):
+        albums = {}
+        photos = {}
+        for key, photo in self.photos.items():
+            album_key = None
+            if photo.album is not None:
+                album_key = photo.album.key
+                albums[album_key] = photo.album.title
+            photos[key] = {
+                'title': photo.title,
+                'filename': photo.filename,
+                'album': album_key,
+                'size': photo.size,
+                'mtime': photo.mtime,
+                'content_hash': photo.content_hash
+            }
+        return {
+            'version': self.VERSION,
+            'totals': self.totals,
+            'albums': albums,
+            'photos': photos,
+            'steps': self.steps,
+            'uploads': self.uploads,
+            'album_creations': [
+                {'album': album_key, 'primary': photo_key}
+                for album_key, photo_key in self.albums
+            ],
+            'links': self.links,
+            'known_content': [
+                {'key': key, 'old_key': old_key, 'rekey': rekey}
+                for key, old_key, rekey in self.known_content
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != cls.VERSION:
+            raise ValueError('unsupported plan version: %s' %
+                             data.get('version'))
+        plan = cls()
+        albums = {}
+        for key, title in data['albums'].items():
+            album = Album()
+            album.key = key
+            album.title = title
+            albums[key] = album
+        for key, values in data['photos'].items():
+            photo = Photo()
+            photo.key = key
+            photo.title = values['title']
+            photo.filename = values['filename']
+            photo.album = albums.get(values['album'])
+            photo.size = values['size']
+            photo.mtime = values['mtime']
+            photo.content_hash = values['content_hash']
+            plan.photos[key] = photo
+        plan.totals = data['totals']
+        plan.steps = data['steps']
+        plan.uploads = data['uploads']
+        plan.albums = [(step['album'], step['primary'])
+                       for step in data['album_creations']]
+        plan.links = data['links']
+        plan.known_content = [(step['key'], step['old_key'], step['rekey'])
+                              for step in data['known_content']]
+        return plan
+
+    def save(self, path):
+        """Write the plan as JSON, atomically."""
+        tmp_path = path + '.tmp'
+        # dumps runs the C encoder, dump does not
+        data = json.dumps(self.to_dict())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+class SyncPlanner(object):
+    """Diff the local photos against the remote state loaded in a
+    FlickrUploader, without any call to Flickr.
+
+    The steps are the ones the upload would take processing the photos in
+    order: the first photo of a missing album creates it, the next ones
+    are linked to it. With ``match_content`` unset, the photos are not
+    hashed and the moved or copied ones are planned as uploads.
+    """
+
+    def __init__(self, uploader, match_content=True):
+        self.logger = logging.getLogger(__name__)
+        self.uploader = uploader
+        self.match_content = match_content
+
+    def plan(self, photos):
+        """Plan the upload of photos.
+
+        :param photos: photos from LocalLoader.load.
+        :type photos: list.
+        :returns: SyncPlan -- The steps left to do.
+
+        """
+        uploader = self.uploader
+        plan = SyncPlan()
+        matches = []
+        if uploader.content_hash and self.match_content:
+            matches = uploader.match_known_content(photos)
+        known = set()
+        for photo, old_key, rekey in matches:
+            plan.add_known_content(photo, old_key, rekey)
+            known.add(photo.key)
+
+        size_photos = 0
+        size_photos_to_upload = 0
+        albums = set()
+        created = set()
+        with uploader.cache_lock:
+            photo_cache = uploader.photo_cache
+            album_cache = uploader.album_cache
+            photo_in_album_cache = uploader.photo_in_album_cache
+            for photo in photos:
+                size = photo_size(photo)
+                size_photos += size
+                if photo.key not in photo_cache and photo.key not in known:
+                    plan.add_upload(photo)
+                    size_photos_to_upload += size
+
+                album = photo.album
+                if album is None:
+                    continue
+                albums.add(album.key)
+                if album.key not in album_cache and \
+                        album.key not in created:
+                    created.add(album.key)
+                    plan.add_album(album, photo)
+                elif photo.key not in photo_in_album_cache:
+                    plan.add_link(photo)
+
+        plan.totals = {
+            'nb_photos': len(photos),
+            'size_photos': size_photos,
+            'nb_photos_to_upload': len(plan.uploads),
+            'size_photos_to_upload': size_photos_to_upload,
+            'nb_album': len(albums),
+            'nb_album_to_create': len(plan.albums),
+            'nb_photos_to_link': len(plan.links)
+        }
+        return plan
@@ -0,0 +1,251 @@
+"""
+.. module:: progress
+   :platform: Unix, Windows
+   :synopsis: Progress of an upload run, as a stream of events.
+
+"""
+from collections import deque
+import json
+import logging
+import sys
+import threading
+import time
+
+import bitmath
+
+
+class UploadProgress(object):
+    """Count the photos and bytes uploaded against the totals of the run
+    and give events to the hooks.
+
+    Events are dicts with an ``event`` key:
+
+    - 'start' once the totals are known,
+    - 'progress' while a file is sent, at most every ``interval`` seconds,
+    - 'photo' when a photo is uploaded, with its ``title``,
+    - 'done' at the end of the run, with ``interrupted`` and ``failed``,
+      also sent when the run stops on an error.
+
+    They all have ``time``, ``elapsed``, ``photos_done``, ``photos_total``,
+    ``photos_remaining``, ``bytes_done``, ``bytes_total``,
+    ``bytes_remaining``, ``rate`` (bytes per second over the last
+    ``window`` seconds) and ``eta`` (seconds, None while the rate is
+    unknown). Hooks run in the uploading threads and must be quick.
+    """
+
+    def __init__(self, interval=0.5, window=30):
+        """Progress without hook.
+
+        :param interval: least seconds between two 'progress' events, 0 to
+                         get an event for every chunk sent.
+        :type interval: float.
+        :param window: seconds the rate is measured over.
+        :type window: float.
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.interval = interval
+        self.window = window
+        self.lock = threading.Lock()
+        self.hooks = []
+        self._reset()
+
+    def _reset(self):
+        self.started = time.time()
+        self.photos_total = 0
+        self.photos_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.last_event = None
+        # (time, bytes_done) samples of the rate window
+        self.samples = deque([(time.monotonic(), 0)])
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _sample(self, now):
+        self.samples.append((now, self.bytes_done))
+        # keep one sample older than the window as its start
+        while len(self.samples) > 2 and \
+                self.samples[1][0] <= now - self.window:
+            self.samples.popleft()
+
+    def _rate(self, now):
+        since, bytes_done = self.samples[0]
+        if now - since <= 0:
+            return None
+        return (self.bytes_done - bytes_done) / (now - since)
+
+    def _event(self, name, **values):
+        now = time.monotonic()
+        self._sample(now)
+        rate = self._rate(now)
+        bytes_remaining = max(0, self.bytes_total - self.bytes_done)
+        eta = None
+        if rate:
+            eta = bytes_remaining / rate
+        elif bytes_remaining == 0:
+            eta = 0
+        values.update({
+            'event': name,
+            'time': time.time(),
+            'elapsed': time.time() - self.started,
+            'photos_done': self.photos_done,
+            'photos_total': self.photos_total,
+            'photos_remaining': max(0,
+                                    self.photos_total - self.photos_done),
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'bytes_remaining': bytes_remaining,
+            'rate': rate,
+            'eta': eta
+        })
+        return values
+
+    def _emit(self, event):
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception:
+                # a broken hook must not fail the upload
+                self.logger.exception('progress hook failed')
+
+    def start(self, stats):
+        """Start a run.
+
+        :param stats: totals of the SyncPlan.
+        :type stats: dict.
+
+        """
+        with self.lock:
+            self._reset()
+            self.photos_total = stats['nb_photos_to_upload']
+            self.bytes_total = stats['size_photos_to_upload']
+            event = self._event('start')
+        self._emit(event)
+
+    def add_bytes(self, size):
+        """Count bytes sent, negative to take back the bytes of a failed
+        upload."""
+        event = None
+        with self.lock:
+            self.bytes_done += size
+            now = time.monotonic()
+            if self.last_event is None or \
+                    now - self.last_event >= self.interval:
+                self.last_event = now
+                event = self._event('progress')
+        if event is not None:
+            self._emit(event)
+
+    def file(self):
+        """Byte counter to give to the upload of one file."""
+        return FileProgress(self)
+
+    def photo_done(self, photo):
+        with self.lock:
+            self.photos_done += 1
+            event = self._event('photo', title=photo.title)
+        self._emit(event)
+
+    def finish(self, interrupted=False, failed=False):
+        with self.lock:
+            event = self._event('done',
+                                interrupted=interrupted,
+                                failed=failed)
+        self._emit(event)
+
+
+class FileProgress(object):
+    """Count the bytes of one upload, ``cancel`` takes them back when the
+    upload fails."""
+
+    def __init__(self, progress):
+        self.progress = progress
+        self.size = 0
+
+    def __call__(self, size):
+        self.size += size
+        self.progress.add_bytes(size)
+
+    def cancel(self):
+        self.progress.add_bytes(-self.size)
+        self.size = 0
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60,
+                             seconds % 60)
+
+
+class TerminalProgress(object):
+    """Hook drawing a progress line on a terminal, rewritten in place.
+
+    On a stream which is not a terminal a line is written every
+    ``interval`` seconds instead.
+    """
+
+    def __init__(self, stream=None, interval=10):
+        self.stream = stream if stream is not None else sys.stderr
+        self.tty = self.stream.isatty()
+        self.interval = interval
+        self.last_line = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def format(event):
+        if event['bytes_total']:
+            percent = 100.0 * event['bytes_done'] / event['bytes_total']
+        else:
+            percent = 100.0
+        rate = event['rate'] or 0
+        return '%5.1f%%  %s/%s photos  %s/%s  %s/s  ETA %s' % (
+            percent,
+            event['photos_done'],
+            event['photos_total'],
+            bitmath.Byte(event['bytes_done']).best_prefix().format(
+                '{value:.1f} {unit}'),
+            bitmath.Byte(event['bytes_total']).best_prefix().format(
+                '{value:.1f} {unit}'),
+            bitmath.Byte(rate).best_prefix().format('{value:.1f} {unit}'),
+            format_duration(event['eta']))
+
+    def __call__(self, event):
+        line = self.format(event)
+        with self.lock:
+            if self.tty:
+                self.stream.write('\r\033[K' + line)
+                if event['event'] == 'done':
+                    self.stream.write('\n')
+            elif event['event'] in ('start', 'done') or \
+                    event['time'] - self.last_line >= self.interval:
+                self.last_line = event['time']
+                self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+class JsonLinesProgress(object):
+    """Hook appending every event as a JSON line to a file, kept open
+    until the end of the run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def __call__(self, event):
+        line = json.dumps(event) + '\n'
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(line)
+            self.file.flush()
+            if event['event'] == 'done':
+                self.file.close()
+                self.file = None
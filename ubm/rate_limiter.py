@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Thread safe token bucket.
+
+    Tokens are added at ``rate`` per second up to ``capacity``; acquire
+    blocks until enough tokens are available.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, name, rate, capacity=1):
+        """Get the bucket shared by the whole process under a name, created
+        on first use.
+
+        There is one quota per name, asked with another rate or capacity
+        the bucket is changed to them, for all its users.
+        """
+        with cls._shared_lock:
+            bucket = cls._shared.get(name)
+            if bucket is None:
+                bucket = cls._shared[name] = cls(rate, capacity)
+            elif bucket.rate != rate or bucket.capacity != capacity:
+                logger.warning('rate limit %s changed from %s/s (burst %s) '
+                               'to %s/s (burst %s)',
+                               name,
+                               bucket.rate,
+                               bucket.capacity,
+                               rate,
+                               capacity)
+                bucket.set_rate(rate, capacity)
+            return bucket
+
+    @classmethod
+    def per_hour(cls, name, per_hour, margin=0.95, burst=1):
+        """Get a shared bucket keeping just under ``per_hour`` calls."""
+        return cls.shared(name, per_hour * margin / 3600.0, burst)
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate, capacity=None):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            if capacity is not None:
+                self.capacity = capacity
+                self.tokens = min(self.tokens, capacity)
+
+    def reserve(self, tokens=1):
+        """Take tokens without waiting for them.
+
+        :returns: float -- Time to wait before using the tokens, in seconds.
+        """
+        with self.lock:
+            # tokens are reserved up front, a negative balance makes the
+            # next callers wait in line
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+            if self.tokens < 0:
+                return -self.tokens / self.rate
+        return 0
+
+    def acquire(self, tokens=1):
+        """Take tokens, waiting for them if needed.
+
+        :returns: float -- Time waited, in seconds.
+        """
+        waited = self.reserve(tokens)
+        if waited > 0:
+            time.sleep(waited)
+        return waited
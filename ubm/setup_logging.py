@@ -1,8 +1,6 @@
 import sys
 import os
-import logging.config
-
-import yaml
+import logging
 
 
 def setup_logging(
@@ -18,8 +16,11 @@ def setup_logging(
     if value:
         path = value
     if os.path.exists(path):
+        # only loaded with a logging configuration file
+        import logging.config as logging_config
+        import yaml
         with open(path, 'rt') as f:
             config = yaml.safe_load(f.read())
-        logging.config.dictConfig(config)
+        logging_config.dictConfig(config)
     else:
         logging.basicConfig(stream=sys.stdout, level=default_level)
@@ -0,0 +1,153 @@
+"""
+.. module:: tickets
+   :platform: Unix, Windows
+   :synopsis: Resolve the tickets of asynchronous uploads in batches.
+
+"""
+import logging
+import threading
+import time
+
+
+class TicketPoller(object):
+    """Poll the tickets of the uploads made with ``ticket=True`` from a
+    background thread.
+
+    Every ``interval`` seconds the pending tickets are checked with
+    ``flickr.photos.upload.checkTickets``, ``batch_size`` at a time.
+    ``on_complete(photo, photo_id)`` is called on the poller thread for
+    each ticket done. A failed or invalid ticket is logged and its photo
+    is left for the next run.
+    """
+
+    def __init__(self,
+                 flickr_api,
+                 on_complete,
+                 interval=1,
+                 batch_size=100,
+                 timeout=3600):
+        """Poller, started with the first ticket.
+
+        :param flickr_api: FlickrAPI to check the tickets with.
+        :param on_complete: function called with the photo and its id.
+        :type on_complete: function.
+        :param interval: seconds between two checks.
+        :type interval: float.
+        :param batch_size: tickets checked per call.
+        :type batch_size: int.
+        :param timeout: seconds after which a pending ticket is given up.
+        :type timeout: float.
+
+        """
+        self.logger = logging.getLogger(__name__)
+        self.flickr_api = flickr_api
+        self.on_complete = on_complete
+        self.interval = interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # ticket id to (photo, time of the upload), in upload order
+        self.pending = {}
+        self.closing = False
+        self.thread = None
+        self.errors = []
+        self.nb_checks = 0
+        self.failed = []
+
+    def add(self, ticket_id, photo):
+        """Wait for the ticket of an uploaded photo."""
+        with self.condition:
+            if self.thread is None:
+                self.closing = False
+                self.thread = threading.Thread(target=self._run,
+                                               name='ubm-tickets',
+                                               daemon=True)
+                self.thread.start()
+            # the tickets added while polling wait for the next round
+            if not self.pending:
+                self.condition.notify_all()
+            self.pending[ticket_id] = (photo, time.monotonic())
+
+    def nb_pending(self):
+        with self.condition:
+            return len(self.pending)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                ticket_ids = list(self.pending)
+            for start in range(0, len(ticket_ids), self.batch_size):
+                self._check(ticket_ids[start:start + self.batch_size])
+            self._expire()
+            with self.condition:
+                if self.pending:
+                    self.condition.wait(self.interval)
+
+    def _check(self, ticket_ids):
+        try:
+            tickets = self.flickr_api.check_tickets(ticket_ids)['ticket']
+            self.nb_checks += 1
+        except Exception:
+            # the tickets are checked again on the next round
+            self.logger.exception('Cannot check %s upload tickets',
+                                  len(ticket_ids))
+            return
+
+        for ticket in tickets:
+            complete = int(ticket.get('complete', 0))
+            if complete == 0 and not ticket.get('invalid'):
+                continue
+            with self.condition:
+                photo, uploaded = self.pending.pop(ticket['id'],
+                                                   (None, None))
+            if photo is None:
+                continue
+            if complete == 1:
+                try:
+                    self.on_complete(photo, ticket['photoid'])
+                except Exception as e:
+                    self.logger.exception("Failed to process photo '%s'",
+                                          photo.title)
+                    self.errors.append(e)
+            else:
+                self.logger.error("Flickr failed to process '%s' "
+                                  "(ticket %s)", photo.title, ticket['id'])
+                self.failed.append(photo)
+
+    def _expire(self):
+        if self.timeout is None:
+            return
+        now = time.monotonic()
+        with self.condition:
+            expired = [ticket_id
+                       for ticket_id, (photo, uploaded)
+                       in self.pending.items()
+                       if now - uploaded > self.timeout]
+            for ticket_id in expired:
+                photo, uploaded = self.pending.pop(ticket_id)
+                self.logger.error("Upload ticket %s of '%s' still pending "
+                                  "after %ss", ticket_id, photo.title,
+                                  self.timeout)
+                self.failed.append(photo)
+
+    def close(self):
+        """Wait for the pending tickets, then stop the thread.
+
+        :raise: the first error of on_complete.
+        """
+        with self.condition:
+            thread = self.thread
+            self.closing = True
+            self.condition.notify_all()
+        if thread is not None:
+            thread.join()
+        with self.condition:
+            self.thread = None
+            errors = self.errors
+            self.errors = []
+        if errors:
+            raise errors[0]
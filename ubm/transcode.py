@@ -0,0 +1,316 @@
+"""
+.. module:: transcode
+   :platform: Unix, Windows
+   :synopsis: Shrink files before their upload, on a process pool.
+
+Pillow is only needed when transcoding rules are set.
+"""
+import importlib.util
+import itertools
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+from collections import deque
+
+from ubm.concurrency import ByteBudget
+
+# Pillow format of the extensions a file can be written as
+FORMATS = {
+    'jpeg': 'JPEG',
+    'jpg': 'JPEG',
+    'png': 'PNG'
+}
+
+
+def file_extension(filename):
+    return os.path.splitext(filename)[1][1:].lower()
+
+
+class TranscodeRule(object):
+    """How to shrink the files of some extensions.
+
+    A file bigger than ``min_size`` is written as ``format``, the same
+    format by default, its longest side scaled down to ``max_dimension``.
+    """
+
+    def __init__(self,
+                 extensions,
+                 min_size=0,
+                 format=None,
+                 quality=90,
+                 max_dimension=None):
+        """Rule for some extensions.
+
+        :param extensions: file extensions, without the dot.
+        :type extensions: list.
+        :param min_size: smallest file size transcoded, in bytes.
+        :type min_size: int.
+        :param format: 'jpeg' or 'png', the format of the file by default.
+        :type format: str.
+        :param quality: JPEG quality, 1 to 95.
+        :type quality: int.
+        :param max_dimension: largest width or height, in pixels.
+        :type max_dimension: int.
+
+        """
+        self.extensions = {extension.lower() for extension in extensions}
+        self.min_size = min_size or 0
+        if format is not None and format.lower() not in FORMATS:
+            raise ValueError("unsupported transcoding format '%s'" % format)
+        self.format = format.lower() if format is not None else None
+        self.quality = quality
+        self.max_dimension = max_dimension
+
+    def matches(self, filename, size):
+        return file_extension(filename) in self.extensions and \
+            size >= self.min_size
+
+    def output_extension(self, filename):
+        if self.format is not None:
+            return 'jpg' if self.format == 'jpeg' else self.format
+        return file_extension(filename)
+
+
+def transcode_file(filename, output, rule):
+    """Write filename transcoded by rule to output, in a pool process.
+
+    :returns: bool -- False when the file is left as it is, animated
+              images are.
+    """
+    from PIL import Image
+
+    with Image.open(filename) as image:
+        if getattr(image, 'is_animated', False):
+            return False
+        pil_format = FORMATS[rule.output_extension(filename)]
+        exif = image.info.get('exif')
+        if rule.max_dimension is not None:
+            image.thumbnail((rule.max_dimension, rule.max_dimension))
+        options = {}
+        if pil_format == 'JPEG':
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            options['quality'] = rule.quality
+            options['optimize'] = True
+            if exif is not None:
+                options['exif'] = exif
+        else:
+            options['optimize'] = True
+        image.save(output, pil_format, **options)
+    return True
+
+
+class Transcoder(object):
+    """Transcode the photos to upload according to rules, ahead of their
+    upload.
+
+    ``start`` submits a photo to the process pool, ``upload_file`` gives
+    the file to send, waiting for the transcoding if needed, and ``done``
+    removes it once uploaded. The transcoded files are kept in
+    ``cache_dir``: the ones made ahead of their upload take at most
+    ``max_cache_bytes``, counting their original size which they do not
+    exceed. A file that fails to transcode, or does not get smaller, is
+    sent as it is.
+    """
+
+    def __init__(self,
+                 rules,
+                 workers=None,
+                 cache_dir=None,
+                 max_cache_bytes=1024 ** 3):
+        """Transcoder with a process pool started on first use.
+
+        :param rules: TranscodeRule list, the first matching one is used.
+        :type rules: list.
+        :param workers: number of processes, the number of CPUs by default.
+        :type workers: int.
+        :param cache_dir: directory of the transcoded files, a temporary
+                          one by default.
+        :type cache_dir: str.
+        :param max_cache_bytes: upper bound of the size of the files
+                                transcoded ahead of their upload.
+        :type max_cache_bytes: int.
+        :raise: ImportError: if Pillow is not installed
+
+        """
+        if importlib.util.find_spec('PIL') is None:
+            raise ImportError('transcoding needs Pillow '
+                              '(pip install ubm[transcode])')
+        self.logger = logging.getLogger(__name__)
+        self.rules = list(rules)
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self.own_cache_dir = False
+        # size reserved by the files transcoded ahead, the original one
+        self.budget = ByteBudget(max_cache_bytes)
+        self.executor = None
+        self.lock = threading.Lock()
+        # photo key to (future, output, reserved size)
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.nb_transcoded = 0
+        self.bytes_saved = 0
+
+    def rule_for(self, photo, size):
+        for rule in self.rules:
+            if rule.matches(photo.filename, size):
+                return rule
+        return None
+
+    def _start_executor(self):
+        with self.lock:
+            if self.executor is None:
+                if self.cache_dir is None:
+                    self.cache_dir = tempfile.mkdtemp(prefix='ubm-')
+                    self.own_cache_dir = True
+                else:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                # multiprocessing is only loaded when transcoding
+                from concurrent.futures import ProcessPoolExecutor
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def start(self, photo, size, ahead=False):
+        """Start transcoding a photo, if a rule matches it.
+
+        :param size: size of the photo file.
+        :type size: int.
+        :param ahead: transcoding ahead of the upload, only when the cache
+                      has room for it. Otherwise the file is not counted,
+                      it only lives during the upload.
+        :type ahead: bool.
+        :returns: bool -- True if the photo is being transcoded.
+        """
+        rule = self.rule_for(photo, size)
+        if rule is None:
+            return False
+        with self.lock:
+            if photo.key in self.jobs:
+                return True
+        reserved = 0
+        if ahead:
+            if not self.budget.try_acquire(size):
+                return False
+            reserved = size
+        self._start_executor()
+        output = os.path.join(self.cache_dir, '%s.%s' % (
+            next(self.counter), rule.output_extension(photo.filename)))
+        future = self.executor.submit(transcode_file,
+                                      photo.filename,
+                                      output,
+                                      rule)
+        with self.lock:
+            self.jobs[photo.key] = (future, output, reserved)
+        return True
+
+    def ahead(self, photos, count, size):
+        """Yield photos, the next ``count`` ones having their transcoding
+        started.
+
+        :param size: size of the file of a photo, None for the ones not to
+                     upload.
+        :type size: function.
+        """
+        queue = deque()
+        photos = iter(photos)
+        while True:
+            for photo in photos:
+                photo_size = size(photo)
+                if photo_size is not None:
+                    self.start(photo, photo_size, ahead=True)
+                queue.append(photo)
+                if len(queue) > count:
+                    break
+            if not queue:
+                return
+            yield queue.popleft()
+
+    def future(self, photo):
+        """Future of the transcoding of a photo, None if not started."""
+        with self.lock:
+            job = self.jobs.get(photo.key)
+        return job[0] if job is not None else None
+
+    def upload_file(self, photo, size):
+        """File to upload for a photo, waiting for its transcoding.
+
+        :returns: str -- The transcoded file, or the photo file.
+        """
+        if not self.start(photo, size):
+            return photo.filename
+        try:
+            self.future(photo).result()
+        except Exception:
+            # logged by output_file
+            pass
+        return self.output_file(photo, size)
+
+    def output_file(self, photo, size):
+        """File to upload for a photo whose transcoding is done.
+
+        :returns: str -- The transcoded file, or the photo file.
+        """
+        with self.lock:
+            job = self.jobs.get(photo.key)
+        if job is None:
+            return photo.filename
+        future, output, reserved = job
+        try:
+            transcoded = future.result()
+        except Exception:
+            self.logger.exception("cannot transcode '%s', upload it as it is",
+                                  photo.filename)
+            transcoded = False
+        if transcoded:
+            output_size = os.path.getsize(output)
+            if output_size < size:
+                self.logger.debug("transcoded '%s': %s -> %s bytes",
+                                  photo.filename, size, output_size)
+                with self.lock:
+                    self.nb_transcoded += 1
+                    self.bytes_saved += size - output_size
+                return output
+        return photo.filename
+
+    def done(self, photo):
+        """Remove the transcoded file of a photo, after its upload or its
+        failure."""
+        with self.lock:
+            job = self.jobs.pop(photo.key, None)
+        if job is None:
+            return
+        future, output, reserved = job
+        try:
+            # a failed upload may not have waited for it
+            future.result()
+        except Exception:
+            pass
+        if os.path.exists(output):
+            os.remove(output)
+        self.budget.release(reserved)
+
+    def close(self):
+        """Stop the process pool and remove the temporary cache."""
+        if self.nb_transcoded:
+            self.logger.info('transcoded %s photos, %s bytes saved',
+                             self.nb_transcoded,
+                             self.bytes_saved)
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+            jobs = list(self.jobs)
+        if executor is None:
+            return
+        executor.shutdown(wait=True, cancel_futures=True)
+        for key in jobs:
+            with self.lock:
+                future, output, reserved = self.jobs.pop(key)
+            if os.path.exists(output):
+                os.remove(output)
+            self.budget.release(reserved)
+        if self.own_cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            self.cache_dir = None
+            self.own_cache_dir = False
@@ -1,47 +1,298 @@
 import argparse
+import signal
 import yaml
 import logging
+import bitmath
 from ubm.setup_logging import setup_logging
+from ubm.bandwidth import BandwidthLimiter, ScheduleWindow
+from ubm.transcode import Transcoder, TranscodeRule
 from ubm.local_loader import LocalLoader
 from ubm.flickr_uploader import FlickrUploader
-
-# Setup global logging
-setup_logging()
+from ubm.inventory import RemoteInventory
+from ubm.journal import UploadJournal
+from ubm.plan import SyncPlan
+from ubm.progress import UploadProgress, TerminalProgress, JsonLinesProgress
 
 
 class Ubm(object):
 
-    def __init__(self, loader, uploader):
+    def __init__(self, loader, uploader, metrics_report=None):
         self.logger = logging.getLogger(__name__)
         self.loader = loader
         self.uploader = uploader
+        # JSON file where to write the stats of the Flickr calls
+        self.metrics_report = metrics_report
+
+    def plan(self, root_path, full_sync=False, match_content=True):
+        """Plan the upload of a directory, or a list of them, without
+        uploading anything."""
+        return self.uploader.plan_upload(self.loader.load(root_path),
+                                         full_sync=full_sync,
+                                         match_content=match_content)
+
+    def upload(self, root_path, full_sync=False):
+        self._run(lambda: self.uploader.upload(self.loader.load(root_path),
+                                               full_sync=full_sync))
+
+    def execute(self, plan, full_sync=False):
+        """Run a plan saved by a dry run, on the current remote state."""
+        def run():
+            self.uploader.load_remote_state(full_sync=full_sync)
+            self.uploader.execute(plan)
+        self._run(run)
+
+    def _run(self, run):
+        try:
+            run()
+        finally:
+            if self.metrics_report is not None:
+                self.uploader.metrics.write_report(self.metrics_report)
+                self.logger.info("Flickr calls stats written to '%s'",
+                                 self.metrics_report)
+
+    def upload_until_interrupted(self, root_path, full_sync=False):
+        """Upload, and on the first Ctrl-C finish the running uploads before
+        stopping. A second Ctrl-C aborts."""
+        self._until_interrupted(lambda: self.upload(root_path,
+                                                    full_sync=full_sync))
+
+    def execute_until_interrupted(self, plan, full_sync=False):
+        self._until_interrupted(lambda: self.execute(plan,
+                                                     full_sync=full_sync))
+
+    def _until_interrupted(self, run):
+        def stop(signum, frame):
+            signal.signal(signal.SIGINT, previous_handler)
+            self.logger.info('Interrupted, finishing the running uploads '
+                             '(Ctrl-C again to abort)')
+            self.uploader.request_stop()
+
+        previous_handler = signal.signal(signal.SIGINT, stop)
+        try:
+            run()
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+
+
+def parse_size(value):
+    """Parse a size from the conf, either a number of bytes or a string
+    like '256 MiB'. Units are read leniently, '10M' or '2 mb' being
+    binary units too."""
+    if value is None or isinstance(value, int):
+        return value
+    return int(bitmath.parse_string(value,
+                                    system=bitmath.NIST,
+                                    strict=False).bytes)
+
+
+def parse_rate(value):
+    """Parse a bandwidth rate from the conf, a size per second, None for
+    unlimited."""
+    rate = parse_size(value)
+    if rate is not None and rate <= 0:
+        raise ValueError('bandwidth rate must be positive, or null for '
+                         'unlimited: %r' % value)
+    return rate
 
-    def upload(self, root_path):
-        self.uploader.upload(self.loader.load(root_path))
+
+def bandwidth_options(upload_conf):
+    """Rate and schedule of the upload.bandwidth conf section, rates are
+    sizes per second, null for unlimited."""
+    bandwidth_conf = upload_conf.get('bandwidth') or {}
+    schedule = [ScheduleWindow(window['start'],
+                               window['end'],
+                               rate=parse_rate(window.get('rate')),
+                               days=window.get('days'))
+                for window in bandwidth_conf.get('schedule') or []]
+    return {
+        'rate': parse_rate(bandwidth_conf.get('rate')),
+        'schedule': schedule
+    }
+
+
+def build_transcoder(transcode_conf):
+    """Transcoder of the transcode conf section, None without rules."""
+    if not transcode_conf or not transcode_conf.get('rules'):
+        return None
+    rules = [TranscodeRule(rule['extensions'],
+                           min_size=parse_size(rule.get('min_size')),
+                           format=rule.get('format'),
+                           quality=rule.get('quality', 90),
+                           max_dimension=rule.get('max_dimension'))
+             for rule in transcode_conf['rules']]
+    return Transcoder(rules,
+                      workers=transcode_conf.get('workers'),
+                      cache_dir=transcode_conf.get('cache_dir'),
+                      max_cache_bytes=parse_size(
+                          transcode_conf.get('max_cache_size', '1 GiB')))
+
+
+def reload_bandwidth_on_hangup(conf_path, limiter):
+    """Apply the upload.bandwidth section of the conf file again on
+    SIGHUP, to change the rate without restarting the run.
+
+    The handler runs in the main thread, which may be uploading and
+    holding the limiter lock, the conf is only handed to the limiter.
+    """
+    logger = logging.getLogger(__name__)
+
+    def reload(signum, frame):
+        try:
+            with open(conf_path, 'r') as conf_file:
+                conf = yaml.safe_load(conf_file)
+            limiter.configure_later(
+                **bandwidth_options(conf.get('upload') or {}))
+        except Exception:
+            logger.exception("Cannot reload the bandwidth from '%s'",
+                             conf_path)
+            return
+        logger.info("Bandwidth reloaded from '%s'", conf_path)
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload)
 
 
 def main(args=None):
+    # Setup global logging, when run and not when imported
+    setup_logging()
     logger = logging.getLogger(__name__)
     parser = argparse.ArgumentParser()
     parser.add_argument("-c",
                         "--conf",
                         required=True,
                         help="configuration file")
+    parser.add_argument("--full-sync",
+                        action="store_true",
+                        help="list the whole remote library instead of "
+                             "refreshing the inventory")
+    parser.add_argument("--rescan",
+                        action="store_true",
+                        help="invalidate the manifest and scan every local "
+                             "directory")
+    parser.add_argument("--dry-run",
+                        action="store_true",
+                        help="print what would be uploaded, created and "
+                             "linked, without uploading anything. With "
+                             "content_hash, the files not known remotely "
+                             "are hashed, see --no-hash")
+    parser.add_argument("--plan",
+                        metavar="FILE",
+                        help="with --dry-run, save the plan to FILE")
+    parser.add_argument("--no-hash",
+                        action="store_true",
+                        help="with --dry-run, do not hash the files: the "
+                             "moved and copied photos are planned as "
+                             "uploads")
+    parser.add_argument("--execute",
+                        metavar="FILE",
+                        help="run a plan saved by --dry-run instead of "
+                             "scanning root_path")
     if args is not None:
         args = parser.parse_args(args)
     else:
         args = parser.parse_args()
+    if not args.dry_run:
+        for option, value in (('--plan', args.plan),
+                              ('--no-hash', args.no_hash)):
+            if value:
+                parser.error('%s requires --dry-run' % option)
 
     with open(args.conf, 'r') as conf_file:
-        conf = yaml.load(conf_file)
+        conf = yaml.safe_load(conf_file)
+        upload_conf = conf.get('upload') or {}
+
+        inventory = None
+        if conf.get('inventory') is not None:
+            inventory = RemoteInventory(conf['inventory'])
+        journal = None
+        if conf.get('journal') is not None:
+            journal = UploadJournal(conf['journal'])
+
+        progress = None
+        if upload_conf.get('progress') or upload_conf.get('progress_file'):
+            progress = UploadProgress()
+            if upload_conf.get('progress'):
+                progress.add_hook(TerminalProgress())
+            if upload_conf.get('progress_file') is not None:
+                progress.add_hook(
+                    JsonLinesProgress(upload_conf['progress_file']))
+
+        # shared by all the uploads, even in async mode
+        bandwidth = BandwidthLimiter(**bandwidth_options(upload_conf))
+        reload_bandwidth_on_hangup(args.conf, bandwidth)
+
+        uploader_class = FlickrUploader
+        uploader_options = {}
+        if upload_conf.get('mode') == 'async':
+            # aiohttp is only needed in async mode
+            from ubm.async_flickr_uploader import AsyncFlickrUploader
+            uploader_class = AsyncFlickrUploader
+            uploader_options['concurrency'] = upload_conf.get('concurrency',
+                                                              100)
 
-        loader = LocalLoader(FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES)
-        uploader = FlickrUploader(conf['flickr']['client_key'],
+        file_types = FlickrUploader.SUPPORTED_IMAGE_FILE_TYPES
+        # videos are backed up unless turned off
+        if upload_conf.get('videos', True):
+            file_types = file_types | FlickrUploader.SUPPORTED_VIDEO_FILE_TYPES
+        loader = LocalLoader(file_types,
+                             manifest_path=conf.get('manifest'),
+                             scan_workers=conf.get('scan_workers', 1))
+        if args.rescan:
+            loader.invalidate_manifest(conf['root_path'])
+        uploader = uploader_class(conf['flickr']['client_key'],
                                   conf['flickr']['client_secret'],
                                   conf['flickr']['resource_owner_key'],
-                                  conf['flickr']['resource_owner_secret'])
-        ubm = Ubm(loader, uploader)
-        ubm.upload(conf['root_path'])
+                                  conf['flickr']['resource_owner_secret'],
+                                  workers=upload_conf.get('workers', 1),
+                                  max_inflight_bytes=parse_size(
+                                      upload_conf.get('max_inflight_bytes')),
+                                  api_options=conf['flickr'].get('api'),
+                                  inventory=inventory,
+                                  content_hash=upload_conf.get(
+                                      'content_hash', False),
+                                  hash_workers=upload_conf.get(
+                                      'hash_workers', 4),
+                                  journal=journal,
+                                  bulk_link_threshold=upload_conf.get(
+                                      'bulk_link_threshold', 10),
+                                  link_batch_size=upload_conf.get(
+                                      'link_batch_size', 500),
+                                  progress=progress,
+                                  bandwidth=bandwidth,
+                                  transcoder=build_transcoder(
+                                      conf.get('transcode')),
+                                  large_file_size=parse_size(
+                                      upload_conf.get('large_file_size',
+                                                      '512 MiB')),
+                                  large_workers=upload_conf.get(
+                                      'large_workers', 1),
+                                  large_upload_timeout=upload_conf.get(
+                                      'large_upload_timeout', [10, 3600]),
+                                  large_upload_retries=upload_conf.get(
+                                      'large_upload_retries', 3),
+                                  upload_tickets=upload_conf.get(
+                                      'tickets', False),
+                                  ticket_options=upload_conf.get(
+                                      'ticket_options'),
+                                  **uploader_options)
+        ubm = Ubm(loader,
+                  uploader,
+                  metrics_report=conf.get('metrics_report'))
+        if args.dry_run:
+            plan = ubm.plan(conf['root_path'],
+                            full_sync=args.full_sync,
+                            match_content=not args.no_hash)
+            for line in plan.describe():
+                print(line)
+            print(plan.summary())
+            if args.plan is not None:
+                plan.save(args.plan)
+        elif args.execute is not None:
+            ubm.execute_until_interrupted(SyncPlan.load(args.execute),
+                                          full_sync=args.full_sync)
+        else:
+            ubm.upload_until_interrupted(conf['root_path'],
+                                         full_sync=args.full_sync)
 # config= None
 # for loc in os.curdir, os.path.expanduser("~"), "/etc/myproject", os.environ.get("MYPROJECT_CONF"):
 #     try: 